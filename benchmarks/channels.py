@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of WAMP channel membership.
+
+Compares channels kept as lists of clients, as originally implemented, with
+`Channels` keyed by session id, for 100 to 10000 subscribers: unsubscribing
+and subscribing a client again, publishing an event that excludes its
+publisher, and publishing an event to a single eligible session::
+
+    $ python benchmarks/channels.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from geventwebsocket.protocols.wamp import Channels  # noqa: E402
+
+
+SIZES = [100, 1000, 10000]
+
+URI = 'http://example.com/chat/lobby'
+
+
+class FakeClient(object):
+    __slots__ = ('session_id', 'ws')
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.ws = None
+
+    def enqueue(self, message):
+        return True
+
+
+class ListChannels(object):
+    """The channels as originally implemented, with a linear `exclude`."""
+
+    def __init__(self):
+        self.channels = {}
+
+    def create(self, uri):
+        self.channels.setdefault(uri, [])
+
+    def subscribe(self, uri, client):
+        self.channels[uri].append(client)
+
+    def unsubscribe(self, uri, client):
+        self.channels[uri].remove(client)
+
+    def deliver(self, uri, exclude=None, eligible=None):
+        queued = 0
+
+        for client in self.channels[uri]:
+            if exclude and client.session_id in exclude:
+                continue
+
+            if eligible is not None and client.session_id not in eligible:
+                continue
+
+            queued += client.enqueue(None)
+
+        return queued
+
+
+def main():
+    print('{0:>8}  {1:>10}{2:>14}{3:>14}{4:>14}'.format(
+        'clients', '', 'churn', 'exclude', 'eligible'))
+
+    for size in SIZES:
+        clients = [FakeClient('s{0:d}'.format(i)) for i in range(size)]
+        # The last subscriber is the worst case of a list
+        client = clients[-1]
+        exclude = [client.session_id]
+        eligible = [client.session_id]
+
+        listed = ListChannels()
+        listed.create(URI)
+        keyed = Channels()
+        keyed.create(URI)
+
+        for each in clients:
+            listed.subscribe(URI, each)
+            keyed.subscribe(URI, each, each.session_id)
+
+        def churn_listed():
+            listed.unsubscribe(URI, client)
+            listed.subscribe(URI, client)
+
+        def churn_keyed():
+            keyed.unsubscribe(URI, client, client.session_id)
+            keyed.subscribe(URI, client, client.session_id)
+
+        assert listed.deliver(URI, exclude) == \
+            keyed.deliver(URI, '', exclude) == size - 1
+        assert listed.deliver(URI, eligible=eligible) == \
+            keyed.deliver(URI, '', eligible=eligible) == 1
+
+        for name, funcs in (
+                ('list', (churn_listed,
+                          lambda: listed.deliver(URI, exclude),
+                          lambda: listed.deliver(URI, eligible=eligible))),
+                ('keyed', (churn_keyed,
+                           lambda: keyed.deliver(URI, '', exclude),
+                           lambda: keyed.deliver(URI, '',
+                                                 eligible=eligible)))):
+            row = []
+
+            for func in funcs:
+                number = max(10, 200000 // size)
+                best = min(timeit.repeat(func, number=number, repeat=3))
+                row.append('{0:.0f} /s'.format(number / best))
+
+            print('{0:>8}  {1:>10}'.format(size, name) + ''.join(
+                '{0:>14}'.format(cell) for cell in row))
+
+
+if __name__ == '__main__':
+    main()
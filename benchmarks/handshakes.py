@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+Benchmark of websocket upgrades per second over loopback.
+
+Starts a `WebSocketServer` in a child process, so that the clients don't
+compete with it for the interpreter, and has `--concurrency` client
+greenlets upgrade and close connections for `--duration` seconds::
+
+    $ python benchmarks/handshakes.py
+    $ python benchmarks/handshakes.py --concurrency 50 --deflate
+    $ python benchmarks/handshakes.py --workers 4 --client-processes 4
+
+With ``--deflate`` the clients offer permessage-deflate, so that the cost of
+negotiating it is included. With ``--workers`` the server runs as a
+`PreforkServer`, give the clients as many processes to keep up with it.
+"""
+from __future__ import print_function
+
+import argparse
+import base64
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gevent  # noqa: E402
+from gevent import socket  # noqa: E402
+
+from geventwebsocket import WebSocketServer  # noqa: E402
+from geventwebsocket.prefork import PreforkServer  # noqa: E402
+
+
+REQUEST = (
+    'GET / HTTP/1.1\r\n'
+    'Host: localhost\r\n'
+    'Upgrade: websocket\r\n'
+    'Connection: Upgrade\r\n'
+    'Sec-WebSocket-Key: {0}\r\n'
+    'Sec-WebSocket-Version: 13\r\n'
+    '{1}'
+    '\r\n'
+)
+
+DEFLATE_OFFER = ('Sec-WebSocket-Extensions: permessage-deflate; '
+                 'client_max_window_bits\r\n')
+
+
+def app(environ, start_response):
+    ws = environ['wsgi.websocket']
+
+    # Until the client closes the connection
+    ws.receive()
+
+    return []
+
+
+def serve(port, workers, ready):
+    if workers:
+        server = PreforkServer(('127.0.0.1', port), app, workers=workers,
+                               pin_cpus=True, log=None, error_log=None)
+    else:
+        server = WebSocketServer(('127.0.0.1', port), app, log=None,
+                                 error_log=None)
+
+    server.start()
+    ready.set()
+    server.serve_forever()
+
+
+def handshake(port, extensions):
+    key = base64.b64encode(os.urandom(16)).decode('ascii')
+    sock = socket.create_connection(('127.0.0.1', port))
+
+    try:
+        sock.sendall(REQUEST.format(key, extensions).encode('ascii'))
+        response = b''
+
+        while b'\r\n\r\n' not in response:
+            data = sock.recv(4096)
+
+            if not data:
+                break
+
+            response += data
+
+        assert response.startswith(b'HTTP/1.1 101'), response
+    finally:
+        sock.close()
+
+
+def client(port, extensions, deadline, counts):
+    while time.time() < deadline:
+        handshake(port, extensions)
+        counts[0] += 1
+
+
+def run_clients(port, extensions, concurrency, deadline, results=None):
+    counts = [0]
+
+    gevent.joinall([
+        gevent.spawn(client, port, extensions, deadline, counts)
+        for _ in range(concurrency)], raise_error=True)
+
+    if results is not None:
+        results.put(counts[0])
+
+    return counts[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--deflate', action='store_true')
+    parser.add_argument('--workers', type=int, default=0,
+                        help="server worker processes, 0 for a single "
+                             "process server")
+    parser.add_argument('--client-processes', type=int, default=1,
+                        help="processes to run --concurrency clients in each")
+    args = parser.parse_args()
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve,
+                                     args=(args.port, args.workers, ready))
+    server.daemon = True
+    server.start()
+    ready.wait()
+
+    extensions = DEFLATE_OFFER if args.deflate else ''
+
+    try:
+        # Warm up
+        handshake(args.port, extensions)
+
+        start = time.time()
+        deadline = start + args.duration
+
+        if args.client_processes > 1:
+            results = multiprocessing.Queue()
+            clients = [
+                multiprocessing.Process(target=run_clients, args=(
+                    args.port, extensions, args.concurrency, deadline,
+                    results))
+                for _ in range(args.client_processes)]
+
+            for process in clients:
+                process.start()
+
+            count = sum(results.get() for _ in clients)
+
+            for process in clients:
+                process.join()
+        else:
+            count = run_clients(args.port, extensions, args.concurrency,
+                                deadline)
+
+        elapsed = time.time() - start
+    finally:
+        server.terminate()
+        server.join()
+
+    print('{0:d} handshakes in {1:.1f}s: {2:.0f} handshakes/s'.format(
+        count, elapsed, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of `Header.encode_header`.
+
+Compares the encoder against the original implementation for the common
+frame shapes::
+
+    $ python benchmarks/header_encoding.py
+"""
+from __future__ import print_function
+
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from geventwebsocket.exceptions import FrameTooLargeException  # noqa: E402
+from geventwebsocket.websocket import Header, WebSocket  # noqa: E402
+
+
+def encode_header_legacy(fin, opcode, mask, length, flags):
+    """The encoder as originally implemented in `Header.encode_header`."""
+    first_byte = opcode
+    second_byte = 0
+    extra = b""
+    result = bytearray()
+
+    if fin:
+        first_byte |= Header.FIN_MASK
+
+    if flags & Header.RSV0_MASK:
+        first_byte |= Header.RSV0_MASK
+
+    if flags & Header.RSV1_MASK:
+        first_byte |= Header.RSV1_MASK
+
+    if flags & Header.RSV2_MASK:
+        first_byte |= Header.RSV2_MASK
+
+    if length < 126:
+        second_byte += length
+    elif length <= 0xffff:
+        second_byte += 126
+        extra = struct.pack('!H', length)
+    elif length <= 0xffffffffffffffff:
+        second_byte += 127
+        extra = struct.pack('!Q', length)
+    else:
+        raise FrameTooLargeException
+
+    if mask:
+        second_byte |= Header.MASK_MASK
+
+    result.append(first_byte)
+    result.append(second_byte)
+    result.extend(extra)
+
+    if mask:
+        result.extend(mask)
+
+    return result
+
+
+CASES = [
+    ('text, 20 B', (True, WebSocket.OPCODE_TEXT, b'', 20, 0)),
+    ('binary, 20 B, RSV1', (True, WebSocket.OPCODE_BINARY, b'', 20,
+                            Header.RSV0_MASK)),
+    ('text, 1 KB', (True, WebSocket.OPCODE_TEXT, b'', 1024, 0)),
+    ('binary, 1 MB', (True, WebSocket.OPCODE_BINARY, b'', 1024 * 1024, 0)),
+    ('text, 20 B, masked', (True, WebSocket.OPCODE_TEXT, b'abcd', 20, 0)),
+]
+
+
+def measure(func, args, number=200000):
+    best = min(timeit.repeat(lambda: func(*args), number=number, repeat=3))
+
+    return best / number * 1e9
+
+
+def main():
+    print('{0:<22}{1:>12}{2:>12}{3:>10}'.format(
+        'frame', 'legacy', 'current', 'speedup'))
+
+    for name, args in CASES:
+        assert bytes(Header.encode_header(*args)) == \
+            bytes(encode_header_legacy(*args)), name
+
+        legacy = measure(encode_header_legacy, args)
+        current = measure(Header.encode_header, args)
+
+        print('{0:<22}{1:>9.0f} ns{2:>9.0f} ns{3:>9.1f}x'.format(
+            name, legacy, current, legacy / current))
+
+
+if __name__ == '__main__':
+    main()
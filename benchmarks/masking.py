@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the frame (un)masking backends.
+
+Compares the original per-octet loop with every masking backend available in
+this interpreter (see `geventwebsocket.masking`) for payloads from 16 B up to
+16 MB::
+
+    $ python benchmarks/masking.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from geventwebsocket import masking  # noqa: E402
+from geventwebsocket._compat import range_type  # noqa: E402
+
+
+SIZES = [16, 256, 4 * 1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024]
+
+# The per-octet loop takes seconds for the larger payloads
+LOOP_MAX_SIZE = 1024 * 1024
+
+
+def mask_loop(key, data):
+    """The masking loop as originally implemented in `Header.mask_payload`."""
+    payload = bytearray(data)
+    key = bytearray(key)
+
+    for i in range_type(len(payload)):
+        payload[i] ^= key[i % 4]
+
+    return payload
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return '{0:d} {1}'.format(size, unit)
+        size //= 1024
+
+    return '{0:d} GB'.format(size)
+
+
+def measure(func, key, data):
+    # Aim for roughly the same amount of work per measurement
+    number = max(1, (4 * 1024 * 1024) // len(data))
+    best = min(timeit.repeat(lambda: func(key, data), number=number, repeat=3))
+
+    return best / number
+
+
+def main():
+    key = os.urandom(4)
+    backends = [('loop', mask_loop)] + masking.BACKENDS
+
+    print('default backend: {0}'.format(masking.BACKEND))
+    print('{0:>8}  '.format('size') + ''.join(
+        '{0:>14}'.format(name) for name, _ in backends))
+
+    for size in SIZES:
+        data = os.urandom(size)
+        expected = bytes(mask_loop(key, data[:LOOP_MAX_SIZE]))
+        row = []
+
+        for name, func in backends:
+            if name == 'loop' and size > LOOP_MAX_SIZE:
+                row.append('-')
+                continue
+
+            assert bytes(func(key, data))[:LOOP_MAX_SIZE] == expected, name
+
+            elapsed = measure(func, key, data)
+            row.append('{0:.1f} MB/s'.format(size / elapsed / 1024 / 1024))
+
+        print('{0:>8}  '.format(format_size(size)) + ''.join(
+            '{0:>14}'.format(cell) for cell in row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of `Resource` path routing.
+
+Compares the original linear scan with `re.match` against the compiled
+router (see `geventwebsocket.routing`), uncached and cached, for resources of
+10 to 1000 routes::
+
+    $ python benchmarks/routing.py
+"""
+from __future__ import print_function
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from geventwebsocket.routing import Router  # noqa: E402
+
+
+SIZES = [10, 100, 1000]
+
+# Past the size of the `re` module's cache, every `re.match` of the linear
+# scan compiles its pattern again
+LINEAR_WORK = 20000
+
+
+def make_routes(size):
+    return [('^/service{0:d}/(\\w+)$'.format(i), i) for i in range(size)]
+
+
+def match_linear(routes, path):
+    """The lookup as originally implemented in `Resource._app_by_path`."""
+    for pattern, app in routes:
+        if re.match(pattern, path):
+            return pattern, app
+
+    return None, None
+
+
+def main():
+    print('{0:>8}  {1:>14}{2:>14}{3:>14}'.format(
+        'routes', 'linear', 'compiled', 'cached'))
+
+    for size in SIZES:
+        routes = make_routes(size)
+        # The last route is the worst case of the linear scan
+        path = '/service{0:d}/chat'.format(size - 1)
+        uncached = Router(routes, cache_size=0)
+        cached = Router(routes)
+
+        expected = match_linear(routes, path)
+        assert uncached.match(path) == cached.match(path) == expected
+
+        row = []
+
+        for func, number in ((lambda: match_linear(routes, path),
+                              max(10, LINEAR_WORK // size)),
+                             (lambda: uncached.match(path), 2000),
+                             (lambda: cached.match(path), 2000)):
+            best = min(timeit.repeat(func, number=number, repeat=3))
+            row.append('{0:.0f} /s'.format(number / best))
+
+        print('{0:>8}  '.format(size) + ''.join(
+            '{0:>14}'.format(cell) for cell in row))
+
+
+if __name__ == '__main__':
+    main()
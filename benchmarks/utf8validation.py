@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the UTF-8 validator backends.
+
+Compares every validator available in this interpreter (see
+`geventwebsocket.utf8validator`) on ASCII, CJK and invalid text messages,
+validated in one go and in 4 KB chunks::
+
+    $ python benchmarks/utf8validation.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from geventwebsocket import utf8validator  # noqa: E402
+
+
+SIZE = 256 * 1024
+CHUNK_SIZE = 4 * 1024
+
+INPUTS = [
+    ('ascii', (b'The quick brown fox jumps over the lazy dog. ' * SIZE)[:SIZE]),
+    ('cjk', (u'日本語のテキスト '.encode('utf-8') *
+             SIZE)[:SIZE - 1] + b' '),
+    # Rejected at the very end, after validating everything before it
+    ('invalid', (b'x' * (SIZE - 3)) + b'\xed\xa0\x80'),
+]
+
+
+def validate(cls, data, chunk_size):
+    validator = cls()
+    validator.reset()
+
+    for i in range(0, len(data), chunk_size):
+        result = validator.validate(data[i:i + chunk_size])
+
+        if not result[0]:
+            break
+
+    return tuple(result)
+
+
+def measure(cls, data, chunk_size):
+    number = 3 if cls is utf8validator.DfaUtf8Validator else 50
+    best = min(timeit.repeat(lambda: validate(cls, data, chunk_size),
+                             number=number, repeat=3))
+
+    return best / number
+
+
+def main():
+    backends = utf8validator.BACKENDS
+
+    print('default backend: {0}'.format(utf8validator.BACKEND))
+    print('{0:<20}'.format('input') + ''.join(
+        '{0:>14}'.format(name) for name, _ in backends))
+
+    for name, data in INPUTS:
+        for chunk_size in (len(data), CHUNK_SIZE):
+            expected = validate(utf8validator.DfaUtf8Validator, data,
+                                chunk_size)
+            row = []
+
+            for backend, cls in backends:
+                assert validate(cls, data, chunk_size) == expected, backend
+
+                elapsed = measure(cls, data, chunk_size)
+                row.append('{0:.1f} MB/s'.format(
+                    len(data) / elapsed / 1024 / 1024))
+
+            label = '{0}, {1}'.format(
+                name, 'whole' if chunk_size == len(data) else '4 KB chunks')
+            print('{0:<20}'.format(label) + ''.join(
+                '{0:>14}'.format(cell) for cell in row))
+
+
+if __name__ == '__main__':
+    main()
@@ -42,12 +42,12 @@ class ChatApplication(WebSocketApplication):
         }))
 
     def broadcast(self, message):
-        for client in self.ws.handler.server.clients.values():
-            client.ws.send(json.dumps({
-                'msg_type': 'message',
-                'nickname': message['nickname'],
-                'message': message['message']
-            }))
+        # Queued for every client, a slow one doesn't hold up the others
+        self.ws.handler.server.broadcast(json.dumps({
+            'msg_type': 'message',
+            'nickname': message['nickname'],
+            'message': message['message']
+        }))
 
     def on_close(self, reason):
         print("Connection closed!")
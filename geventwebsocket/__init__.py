@@ -5,6 +5,13 @@ __all__ = [
     'Resource',
     'WebSocketServer',
     'WebSocketError',
+    'CompressionPolicy',
+    'PreparedMessage',
+    'Metrics',
+    'MetricsApp',
+    'connect',
+    'ConnectionPool',
+    'PreforkServer',
     'get_version'
 ]
 
@@ -17,5 +24,10 @@ try:
     from .resource import WebSocketApplication, Resource
     from .server import WebSocketServer
     from .exceptions import WebSocketError
+    from .deflate import CompressionPolicy
+    from .websocket import PreparedMessage
+    from .metrics import Metrics, MetricsApp
+    from .client import connect, ConnectionPool
+    from .prefork import PreforkServer
 except ImportError:
     pass
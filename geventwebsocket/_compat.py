@@ -21,3 +21,8 @@ else:
     range_type = range
     iteritems = lambda x: iter(x.items())
     # b = lambda x: codecs.latin_1_encode(x)[0]
+
+try:
+    from time import monotonic
+except ImportError:
+    from time import time as monotonic
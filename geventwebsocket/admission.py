@@ -0,0 +1,132 @@
+"""
+Admission control for websocket upgrades.
+
+Limits the number of concurrent websocket connections, for the whole server
+and per `Resource` route, and the rate at which handshakes are accepted.
+Upgrades over a limit are answered with ``503 Service Unavailable`` before
+anything is allocated for the connection, so that a reconnect storm after a
+restart costs little more than parsing the requests.
+"""
+import math
+
+from ._compat import monotonic
+
+__all__ = ('Admission', 'TokenBucket')
+
+MSG_TOO_MANY_CONNECTIONS = "Too many connections"
+MSG_TOO_MANY_HANDSHAKES = "Too many handshakes"
+
+
+class TokenBucket(object):
+    """
+    Allows `rate` events per second on average, with bursts of up to `burst`
+    events.
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError("Invalid rate: {0!r}".format(rate))
+
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self.tokens = self.burst
+        self.updated = monotonic()
+
+    def consume(self):
+        """
+        Take a token, if there is one.
+
+        :returns: 0 if a token was taken, otherwise the number of seconds
+            until there will be one.
+        """
+        now = monotonic()
+        tokens = min(self.burst,
+                     self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if tokens >= 1:
+            self.tokens = tokens - 1
+            return 0
+
+        self.tokens = tokens
+
+        return (1 - tokens) / self.rate
+
+
+class Admission(object):
+    """
+    Counts the websocket connections of a server, globally and per route,
+    and limits the rate of handshakes.
+
+    :param max_connections: The number of concurrent connections, `None` for
+        no limit.
+    :param handshake_rate: The number of handshakes accepted per second on
+        average, `None` for no limit.
+    :param handshake_burst: The number of handshakes accepted in a burst,
+        defaults to one second's worth.
+    :param retry_after: The seconds clients that hit a connection limit are
+        asked to wait before retrying.
+
+    :ivar connections: The number of connections admitted.
+    :ivar routes: The number of connections admitted per route.
+    :ivar rejected: The number of handshakes rejected.
+    """
+
+    __slots__ = ('max_connections', 'bucket', 'retry_after', 'connections',
+                 'routes', 'rejected')
+
+    def __init__(self, max_connections=None, handshake_rate=None,
+                 handshake_burst=None, retry_after=1):
+        self.max_connections = max_connections
+        self.bucket = (TokenBucket(handshake_rate, handshake_burst)
+                       if handshake_rate is not None else None)
+        self.retry_after = retry_after
+        self.connections = 0
+        self.routes = {}
+        self.rejected = 0
+
+    def admit(self, route=None, max_route_connections=None):
+        """
+        Admit a connection to `route`, which may have a limit of its own.
+        Admitted connections must be passed to `release` when they end.
+
+        :returns: `None` if the connection was admitted, otherwise a
+            ``(reason, retry_after)`` tuple with `retry_after` in whole
+            seconds.
+        """
+        if (self.max_connections is not None and
+                self.connections >= self.max_connections):
+            return self.reject(MSG_TOO_MANY_CONNECTIONS, self.retry_after)
+
+        if (max_route_connections is not None and
+                self.routes.get(route, 0) >= max_route_connections):
+            return self.reject(MSG_TOO_MANY_CONNECTIONS, self.retry_after)
+
+        if self.bucket is not None:
+            wait = self.bucket.consume()
+
+            if wait:
+                return self.reject(MSG_TOO_MANY_HANDSHAKES, wait)
+
+        self.connections += 1
+
+        if route is not None:
+            self.routes[route] = self.routes.get(route, 0) + 1
+
+        return None
+
+    def reject(self, reason, retry_after):
+        self.rejected += 1
+
+        return reason, int(math.ceil(retry_after))
+
+    def release(self, route=None):
+        self.connections -= 1
+
+        if route is not None:
+            count = self.routes.pop(route) - 1
+
+            if count:
+                self.routes[route] = count
@@ -0,0 +1,443 @@
+"""
+Publish/subscribe between the processes serving websockets.
+
+`WebSocketServer.broadcast` and the WAMP `Channels` only reach the clients of
+their own process. Given a backplane they publish through it as well, and
+deliver what other processes publish to their own clients::
+
+    backplane = UnixBackplane('/run/myapp/backplane.sock')
+    server = WebSocketServer(('', 8000), app, backplane=backplane)
+
+Two backplanes are included:
+
+- `InProcessBackplane` connects the subscribers of a single process, e.g.
+  several servers, or tests.
+- `UnixBackplane` connects to a `Broker` over a Unix domain socket, which
+  relays every message to the other processes subscribed to its topic. A
+  `PreforkServer` runs the broker itself with ``backplane=True``, otherwise
+  run one with ``python -m geventwebsocket.backplane PATH``.
+
+Payloads are byte strings, serialized once by the publisher. The records
+written to the broker, and by the broker to every process, are batched: they
+go out in a single system call once the writing greenlet yields. Writing
+never blocks, records for a process that stopped reading are dropped once
+`MAX_BUFFER_SIZE` octets are waiting for it.
+"""
+import errno
+import logging
+import os
+import struct
+
+import gevent
+from gevent import socket
+from gevent.event import Event
+from gevent.lock import Semaphore
+from gevent.pool import Pool
+from gevent.server import StreamServer
+
+__all__ = ('Backplane', 'InProcessBackplane', 'UnixBackplane', 'Broker')
+
+logger = logging.getLogger(__name__)
+
+# Record types on the wire
+SUBSCRIBE = 1
+UNSUBSCRIBE = 2
+PUBLISH = 3
+
+# Every record is a type, the lengths of the topic and the payload, the
+# topic in UTF-8 and the payload
+_record_header = struct.Struct('!BHI')
+HEADER_SIZE = _record_header.size
+
+READ_SIZE = 65536
+
+# The most octets queued for a slow connection before records are dropped
+MAX_BUFFER_SIZE = 16 * 1024 * 1024
+
+# Seconds to wait before reconnecting to the broker
+RECONNECT_DELAY = 1.0
+
+
+def encode_record(kind, topic, payload=b''):
+    topic = topic.encode('utf-8')
+
+    return _record_header.pack(kind, len(topic), len(payload)) + topic + \
+        payload
+
+
+def read_records(sock, size=READ_SIZE):
+    """
+    Yield the type, topic and encoded record of every record read from
+    `sock`, until it is closed.
+    """
+    buf = bytearray()
+
+    while True:
+        data = sock.recv(size)
+
+        if not data:
+            return
+
+        buf += data
+        offset = 0
+
+        while len(buf) - offset >= HEADER_SIZE:
+            kind, topic_length, payload_length = \
+                _record_header.unpack_from(buf, offset)
+            start = offset + HEADER_SIZE
+            end = start + topic_length + payload_length
+
+            if end > len(buf):
+                break
+
+            topic = bytes(buf[start:start + topic_length]).decode('utf-8')
+
+            yield kind, topic, bytes(buf[offset:end])
+
+            offset = end
+
+        del buf[:offset]
+
+
+def record_payload(record, topic):
+    return record[HEADER_SIZE + len(topic.encode('utf-8')):]
+
+
+class BatchWriter(object):
+    """
+    Writes records to a socket in batches, from a greenlet of its own: a
+    batch is written once the greenlet that started it yields, and records
+    written meanwhile go in the next one. `write` never blocks, so that a
+    peer that stops reading doesn't hold up anyone else.
+
+    :ivar dropped: The number of records dropped because `MAX_BUFFER_SIZE`
+        octets were waiting to be written already.
+    """
+
+    __slots__ = ('socket', 'buffer', 'pending', 'scheduled', 'lock',
+                 'dropped', 'closed')
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.buffer = bytearray()
+        # Octets taken out of the buffer, but not yet written
+        self.pending = 0
+        self.scheduled = False
+        self.lock = Semaphore()
+        self.dropped = 0
+        self.closed = False
+
+    def write(self, record):
+        if self.closed:
+            return
+
+        if len(self.buffer) + self.pending + len(record) > MAX_BUFFER_SIZE:
+            self.dropped += 1
+            return
+
+        self.buffer += record
+
+        if not self.scheduled:
+            self.scheduled = True
+            gevent.spawn(self._scheduled_flush)
+
+    def flush(self):
+        buf = self.buffer
+
+        if not buf or self.closed:
+            return
+
+        # Records written while this batch is sent go in the next one
+        self.buffer = bytearray()
+        self.pending += len(buf)
+
+        try:
+            with self.lock:
+                self.socket.sendall(buf)
+        except socket.error:
+            self.close()
+        finally:
+            self.pending -= len(buf)
+
+    def _scheduled_flush(self):
+        try:
+            # Until the peer caught up with everything written
+            while self.buffer and not self.closed:
+                self.flush()
+        finally:
+            self.scheduled = False
+
+    def close(self):
+        self.closed = True
+        self.buffer = bytearray()
+        self.socket.close()
+
+
+class Backplane(object):
+    """
+    Base class of backplanes. Subscribers are called with the topic and
+    payload of every message published to a topic they subscribed to, by any
+    process attached to the backplane.
+
+    Subclasses send what is published to the other processes in `send`, and
+    are told about the first and last subscriber of a topic through
+    `topic_added` and `topic_removed`.
+    """
+
+    def __init__(self):
+        # topic -> callbacks
+        self.subscribers = {}
+
+    def subscribe(self, topic, callback):
+        callbacks = self.subscribers.get(topic)
+
+        if callbacks is None:
+            callbacks = self.subscribers[topic] = []
+            self.topic_added(topic)
+
+        callbacks.append(callback)
+
+    def unsubscribe(self, topic, callback):
+        callbacks = self.subscribers.get(topic)
+
+        if not callbacks or callback not in callbacks:
+            return
+
+        callbacks.remove(callback)
+
+        if not callbacks:
+            del self.subscribers[topic]
+            self.topic_removed(topic)
+
+    def publish(self, topic, payload, exclude=None):
+        """
+        Publish `payload`, a byte string, to the subscribers of `topic` in
+        this and all other processes.
+
+        :param exclude: A callback of this process not to call, e.g. of a
+            publisher that delivers to its own clients itself.
+        """
+        self.deliver(topic, payload, exclude)
+        self.send(topic, payload)
+
+    def deliver(self, topic, payload, exclude=None):
+        """
+        Call the subscribers of `topic` in this process.
+        """
+        callbacks = self.subscribers.get(topic)
+
+        if not callbacks:
+            return
+
+        for callback in list(callbacks):
+            if exclude is not None and callback == exclude:
+                continue
+
+            try:
+                callback(topic, payload)
+            except Exception:
+                logger.exception("Backplane subscriber of %r failed", topic)
+
+    def send(self, topic, payload):
+        pass
+
+    def topic_added(self, topic):
+        pass
+
+    def topic_removed(self, topic):
+        pass
+
+    def close(self):
+        self.subscribers.clear()
+
+
+class InProcessBackplane(Backplane):
+    """
+    A backplane for the subscribers of a single process.
+    """
+
+
+class UnixBackplane(Backplane):
+    """
+    A backplane that connects to a `Broker` listening on the Unix domain
+    socket `path`, and reconnects if the connection is lost. Messages
+    published while it isn't connected only reach the subscribers of this
+    process.
+
+    It must be created in the process that uses it, e.g. after forking.
+
+    :ivar dropped: The number of messages not sent to the broker.
+    """
+
+    def __init__(self, path, reconnect_delay=RECONNECT_DELAY):
+        super(UnixBackplane, self).__init__()
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self.writer = None
+        self.dropped = 0
+        self.closed = False
+        self.connected = Event()
+        self.runner = gevent.spawn(self._run)
+
+    def send(self, topic, payload):
+        writer = self.writer
+
+        if writer is None or writer.closed:
+            self.dropped += 1
+            return
+
+        writer.write(encode_record(PUBLISH, topic, payload))
+
+    def topic_added(self, topic):
+        if self.writer is not None:
+            self.writer.write(encode_record(SUBSCRIBE, topic))
+
+    def topic_removed(self, topic):
+        if self.writer is not None:
+            self.writer.write(encode_record(UNSUBSCRIBE, topic))
+
+    def wait_connected(self, timeout=None):
+        """
+        :returns: Whether the backplane is connected to the broker, waiting
+            up to `timeout` seconds for it.
+        """
+        return self.connected.wait(timeout)
+
+    def _run(self):
+        while not self.closed:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+            try:
+                sock.connect(self.path)
+            except socket.error as error:
+                sock.close()
+                logger.debug("Can't connect to the broker at %s: %s",
+                             self.path, error)
+                gevent.sleep(self.reconnect_delay)
+                continue
+
+            writer = BatchWriter(sock)
+
+            for topic in self.subscribers:
+                writer.write(encode_record(SUBSCRIBE, topic))
+
+            self.writer = writer
+            self.connected.set()
+
+            try:
+                for kind, topic, record in read_records(sock):
+                    if kind == PUBLISH:
+                        self.deliver(topic, record_payload(record, topic))
+            except socket.error as error:
+                logger.debug("Lost the connection to the broker: %s", error)
+            finally:
+                self.connected.clear()
+                self.writer = None
+                self.dropped += writer.dropped
+                writer.close()
+
+            if not self.closed:
+                gevent.sleep(self.reconnect_delay)
+
+    def close(self):
+        self.closed = True
+        self.runner.kill(block=False)
+
+        if self.writer is not None:
+            self.writer.flush()
+            self.writer.close()
+
+        super(UnixBackplane, self).close()
+
+
+class Broker(object):
+    """
+    Relays the records published by the processes connected to the Unix
+    domain socket `path` to the others subscribed to their topic. Records
+    are forwarded as they are, without decoding their payload.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # topic -> writers of the connections subscribed to it
+        self.subscriptions = {}
+        self.pool = Pool()
+        self.server = None
+
+    def start(self):
+        try:
+            os.unlink(self.path)
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                raise
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        listener.listen(128)
+
+        self.server = StreamServer(listener, self.handle, spawn=self.pool)
+        self.server.start()
+
+    def serve_forever(self):
+        if self.server is None:
+            self.start()
+
+        self.server.serve_forever()
+
+    def stop(self):
+        """
+        Stop the broker and remove its socket.
+        """
+        self.close()
+
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def close(self):
+        """
+        Stop the broker, e.g. in a forked process, and leave its socket.
+        """
+        if self.server is not None:
+            self.server.stop(timeout=0)
+
+    def handle(self, sock, address):
+        writer = BatchWriter(sock)
+        topics = set()
+
+        try:
+            for kind, topic, record in read_records(sock):
+                if kind == PUBLISH:
+                    # Subscriptions may change while this one is served
+                    for other in list(self.subscriptions.get(topic, ())):
+                        if other is not writer:
+                            other.write(record)
+                elif kind == SUBSCRIBE:
+                    self.subscriptions.setdefault(topic, set()).add(writer)
+                    topics.add(topic)
+                elif kind == UNSUBSCRIBE:
+                    self._unsubscribe(topic, writer)
+                    topics.discard(topic)
+        except socket.error:
+            pass
+        finally:
+            for topic in topics:
+                self._unsubscribe(topic, writer)
+
+            writer.close()
+
+    def _unsubscribe(self, topic, writer):
+        writers = self.subscriptions.get(topic)
+
+        if writers is not None:
+            writers.discard(writer)
+
+            if not writers:
+                del self.subscriptions[topic]
+
+
+if __name__ == '__main__':
+    import sys
+
+    Broker(sys.argv[1]).serve_forever()
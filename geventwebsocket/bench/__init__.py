@@ -0,0 +1,260 @@
+"""
+Throughput and latency benchmarks of the frame and message paths.
+
+A `WebSocketServer` running an echo application and a client run in the same
+process, over loopback. For every combination of payload size, text or
+binary, single frame or fragmented, permessage-deflate on or off and masking
+backend (see `geventwebsocket.masking`), the client keeps a window of
+messages in flight for a while, and reports the messages echoed per second
+and the percentiles of their round trip times::
+
+    $ python -m geventwebsocket.bench
+    $ python -m geventwebsocket.bench --quick --json results.json
+    $ python -m geventwebsocket.bench --compare results.json
+
+Text payloads are compressible prose, binary payloads random octets.
+The JSON results of different releases or machines can be compared with
+``--compare``.
+"""
+import itertools
+import os
+import platform
+import sys
+from collections import deque
+from contextlib import contextmanager
+
+import gevent
+from gevent.lock import Semaphore
+
+from .. import masking, websocket
+from .._compat import monotonic
+from ..server import WebSocketServer
+from .client import BenchClient
+
+__all__ = ('Case', 'run', 'run_case')
+
+SIZES = (16, 1024, 16 * 1024, 256 * 1024)
+QUICK_SIZES = (16, 16 * 1024)
+
+# Seconds to run every case for, and the least number of messages
+DURATION = 1.0
+QUICK_DURATION = 0.25
+MIN_MESSAGES = 50
+
+# The number of messages in flight
+WINDOW = 16
+
+# The number of frames fragmented messages are sent in
+FRAGMENTS = 4
+
+PERCENTILES = (('p50', 0.5), ('p99', 0.99), ('p999', 0.999))
+
+TEXT = (b'The quick brown fox jumps over the lazy dog, and then some more '
+        b'words follow to make the text a little less repetitive. ')
+
+
+class Case(object):
+    """
+    A single benchmark configuration.
+    """
+
+    __slots__ = ('size', 'binary', 'fragmented', 'deflate', 'masking')
+
+    def __init__(self, size, binary=False, fragmented=False, deflate=False,
+                 masking=masking.BACKEND):
+        self.size = size
+        self.binary = binary
+        self.fragmented = fragmented
+        self.deflate = deflate
+        self.masking = masking
+
+    @property
+    def key(self):
+        return (self.size, self.binary, self.fragmented, self.deflate,
+                self.masking)
+
+    def payload(self):
+        if self.binary:
+            return os.urandom(self.size)
+
+        return (TEXT * (self.size // len(TEXT) + 1))[:self.size]
+
+    def as_dict(self):
+        return {
+            'size': self.size,
+            'type': 'binary' if self.binary else 'text',
+            'fragmented': self.fragmented,
+            'deflate': self.deflate,
+            'masking': self.masking,
+        }
+
+
+def echo(environ, start_response):
+    ws = environ['wsgi.websocket']
+
+    while True:
+        message = ws.receive()
+
+        if message is None:
+            break
+
+        ws.send(message)
+
+    return []
+
+
+@contextmanager
+def masking_backend(name):
+    """
+    Have the server (and benchmark client) mask with backend `name`.
+    """
+    func = dict(masking.BACKENDS)[name]
+    previous = websocket.mask
+    websocket.mask = func
+
+    try:
+        yield
+    finally:
+        websocket.mask = previous
+
+
+def percentile(values, fraction):
+    # Nearest rank on sorted values
+    index = max(0, min(len(values) - 1,
+                       int(-(-len(values) * fraction // 1)) - 1))
+
+    return values[index]
+
+
+def run_case(case, port, duration=DURATION, window=WINDOW):
+    """
+    :returns: The results of `case` against the echo server on `port`, as a
+        dict.
+    """
+    with masking_backend(case.masking):
+        client = BenchClient('127.0.0.1', port, case.deflate)
+
+        try:
+            return _measure(case, client, duration, window)
+        finally:
+            client.close()
+
+
+def _measure(case, client, duration, window):
+    opcode = websocket.WebSocket.OPCODE_BINARY if case.binary else \
+        websocket.WebSocket.OPCODE_TEXT
+    payload = case.payload()
+    fragments = FRAGMENTS if case.fragmented else 1
+
+    in_flight = Semaphore(window)
+    sent = deque()
+    latencies = []
+
+    def receive():
+        while True:
+            received_opcode, data = client.receive()
+            latencies.append(monotonic() - sent.popleft())
+            in_flight.release()
+
+            assert received_opcode == opcode and len(data) == len(payload)
+
+    # Warm up, e.g. the zlib contexts
+    client.send(opcode, payload, fragments, case.deflate)
+    client.receive()
+
+    start = monotonic()
+    deadline = start + duration
+    count = 0
+    receiver = None
+
+    try:
+        while count < MIN_MESSAGES or monotonic() < deadline:
+            in_flight.acquire()
+            sent.append(monotonic())
+            client.send(opcode, payload, fragments, case.deflate)
+            count += 1
+
+            if receiver is None:
+                receiver = gevent.spawn(receive)
+
+        while len(latencies) < count:
+            gevent.sleep(0.001)
+
+            if receiver.dead:
+                receiver.get()
+    finally:
+        if receiver is not None:
+            receiver.kill()
+
+    elapsed = monotonic() - start
+    latencies.sort()
+
+    result = case.as_dict()
+    result.update({
+        'messages': count,
+        'seconds': round(elapsed, 6),
+        'messages_per_sec': round(count / elapsed, 1),
+        'mb_per_sec': round(count * case.size / elapsed / 1024 / 1024, 3),
+        'latency_ms': dict(
+            (name, round(percentile(latencies, fraction) * 1000, 4))
+            for name, fraction in PERCENTILES),
+    })
+
+    return result
+
+
+def cases(sizes=SIZES, backends=None):
+    """
+    :returns: Every combination of the parameters to benchmark.
+    """
+    if backends is None:
+        backends = [name for name, _ in masking.BACKENDS]
+
+    for size, binary, fragmented, deflate, backend in itertools.product(
+            sizes, (False, True), (False, True), (False, True), backends):
+        yield Case(size, binary, fragmented, deflate, backend)
+
+
+def run(cases, duration=DURATION, window=WINDOW, progress=None):
+    """
+    Run `cases` against a fresh in-process echo server.
+
+    :param progress: Called with every result as it comes in.
+    :returns: A dict of the environment and the results, ready to be dumped
+        as JSON.
+    """
+    server = WebSocketServer(('127.0.0.1', 0), echo, log=None,
+                             error_log=None)
+    server.start()
+    results = []
+
+    try:
+        for case in cases:
+            result = run_case(case, server.server_port, duration, window)
+            results.append(result)
+
+            if progress is not None:
+                progress(result)
+    finally:
+        server.stop(timeout=1)
+
+    return {
+        'environment': environment(),
+        'duration': duration,
+        'window': window,
+        'results': results,
+    }
+
+
+def environment():
+    from .. import get_version
+
+    return {
+        'geventwebsocket': get_version(),
+        'gevent': gevent.__version__,
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'masking_backends': [name for name, _ in masking.BACKENDS],
+        'wsaccel': any(name == 'wsaccel' for name, _ in masking.BACKENDS),
+    }
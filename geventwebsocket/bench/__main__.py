@@ -0,0 +1,100 @@
+"""
+Command line interface of the benchmarks, see `geventwebsocket.bench`.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+
+from . import (DURATION, QUICK_DURATION, QUICK_SIZES, SIZES, WINDOW, cases,
+               run)
+from .. import masking
+
+COLUMNS = '{0:>8} {1:<7}{2:<6}{3:<8}{4:<9}{5:>12}{6:>10}{7:>10}{8:>10}'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m geventwebsocket.bench',
+        description="Throughput and latency of the frame and message paths.")
+    parser.add_argument('--quick', action='store_true',
+                        help="fewer sizes and shorter runs")
+    parser.add_argument('--sizes', type=int, nargs='+', metavar='SIZE',
+                        help="payload sizes in octets")
+    parser.add_argument('--duration', type=float,
+                        help="seconds to run every case for")
+    parser.add_argument('--window', type=int, default=WINDOW,
+                        help="messages in flight")
+    parser.add_argument('--masking', nargs='+', metavar='BACKEND',
+                        choices=[name for name, _ in masking.BACKENDS],
+                        help="masking backends to run with, default all")
+    parser.add_argument('--json', metavar='PATH',
+                        help="write the results as JSON, - for stdout")
+    parser.add_argument('--compare', metavar='PATH',
+                        help="compare with earlier JSON results")
+
+    return parser.parse_args(argv)
+
+
+def case_key(result):
+    return (result['size'], result['type'], result['fragmented'],
+            result['deflate'], result['masking'])
+
+
+def format_row(result, baseline=None):
+    latency = result['latency_ms']
+    row = COLUMNS.format(
+        result['size'], result['type'],
+        'frag' if result['fragmented'] else '-',
+        'deflate' if result['deflate'] else '-', result['masking'],
+        result['messages_per_sec'], latency['p50'], latency['p99'],
+        latency['p999'])
+
+    if baseline is not None:
+        row += '{0:>+9.1%}'.format(
+            result['messages_per_sec'] / baseline['messages_per_sec'] - 1)
+
+    return row
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    duration = args.duration or (QUICK_DURATION if args.quick else DURATION)
+
+    baselines = {}
+
+    if args.compare:
+        with open(args.compare) as f:
+            for result in json.load(f)['results']:
+                baselines[case_key(result)] = result
+
+    # The table goes to stderr when the JSON goes to stdout
+    out = sys.stderr if args.json == '-' else sys.stdout
+    header = COLUMNS.format('size', 'type', 'frag', 'deflate', 'masking',
+                            'msgs/s', 'p50 ms', 'p99 ms', 'p999 ms')
+
+    if baselines:
+        header += '{0:>9}'.format('change')
+
+    print(header, file=out)
+
+    def progress(result):
+        print(format_row(result, baselines.get(case_key(result))), file=out)
+        out.flush()
+
+    results = run(cases(sizes, args.masking), duration, args.window,
+                  progress)
+
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
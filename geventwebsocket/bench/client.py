@@ -0,0 +1,171 @@
+"""
+A minimal websocket client for the benchmarks: it masks its frames like a
+browser would, and optionally compresses them, but implements nothing else.
+"""
+import base64
+import os
+import struct
+import zlib
+
+from gevent import socket
+
+from .. import websocket
+from ..deflate import parse_extensions
+
+REQUEST = (
+    'GET / HTTP/1.1\r\n'
+    'Host: {0}:{1:d}\r\n'
+    'Upgrade: websocket\r\n'
+    'Connection: Upgrade\r\n'
+    'Sec-WebSocket-Key: {2}\r\n'
+    'Sec-WebSocket-Version: 13\r\n'
+    '{3}'
+    '\r\n'
+)
+
+DEFLATE_OFFER = 'Sec-WebSocket-Extensions: permessage-deflate\r\n'
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_CLOSE = 0x8
+RSV1 = 0x40
+FIN = 0x80
+MASK = 0x80
+
+_pack_BB = struct.Struct('!BB').pack
+_pack_BBH = struct.Struct('!BBH').pack
+_pack_BBQ = struct.Struct('!BBQ').pack
+_unpack_H = struct.Struct('!H').unpack
+_unpack_Q = struct.Struct('!Q').unpack
+
+
+class BenchClient(object):
+    """
+    A connection to the benchmark's echo server.
+
+    :param deflate: Whether to offer permessage-deflate. `deflate` tells
+        whether the server accepted it.
+    """
+
+    def __init__(self, host, port, deflate=False):
+        self.socket = socket.create_connection((host, port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.socket.makefile('rb')
+        self.deflate = False
+        self.decompressor = None
+
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        self.socket.sendall(REQUEST.format(
+            host, port, key, DEFLATE_OFFER if deflate else '').encode('ascii'))
+        self.handshake(deflate)
+
+    def handshake(self, deflate):
+        status = self.rfile.readline()
+
+        if not status.startswith(b'HTTP/1.1 101'):
+            raise RuntimeError("Upgrade failed: {0!r}".format(status))
+
+        while True:
+            line = self.rfile.readline().decode('latin-1').strip()
+
+            if not line:
+                break
+
+            name, _, value = line.partition(':')
+
+            if (deflate and
+                    name.lower() == 'sec-websocket-extensions' and
+                    parse_extensions(value)[0][0] == 'permessage-deflate'):
+                self.deflate = True
+                self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def send(self, opcode, payload, fragments=1, compress=False):
+        """
+        Send a message in `fragments` frames of about the same size.
+        """
+        flags = 0
+
+        if compress and self.deflate:
+            # A fresh context per message is valid with and without context
+            # takeover
+            compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+            payload = compressor.compress(payload)
+            payload += compressor.flush(zlib.Z_SYNC_FLUSH)
+            payload = payload[:-4]
+            flags = RSV1
+
+        size = -(-len(payload) // fragments) or 1
+        frames = []
+
+        for i in range(0, max(len(payload), 1), size):
+            fin = i + size >= len(payload)
+            frames.append(self.encode_frame(
+                fin, opcode if not i else OPCODE_CONTINUATION,
+                payload[i:i + size], flags if not i else 0))
+
+        self.socket.sendall(b''.join(frames))
+
+    def encode_frame(self, fin, opcode, payload, flags=0):
+        b0 = (FIN if fin else 0) | flags | opcode
+        length = len(payload)
+
+        if length < 126:
+            header = _pack_BB(b0, MASK | length)
+        elif length < 65536:
+            header = _pack_BBH(b0, MASK | 126, length)
+        else:
+            header = _pack_BBQ(b0, MASK | 127, length)
+
+        key = os.urandom(4)
+
+        # The masking backend under test
+        return header + key + bytes(websocket.mask(key, payload))
+
+    def receive(self):
+        """
+        :returns: The opcode and payload of the next message.
+        """
+        read = self.rfile.read
+        opcode = None
+        compressed = False
+        payload = []
+
+        while True:
+            b0, b1 = bytearray(read(2))
+            length = b1 & 0x7f
+
+            if length == 126:
+                length = _unpack_H(read(2))[0]
+            elif length == 127:
+                length = _unpack_Q(read(8))[0]
+
+            data = read(length)
+
+            if len(data) != length:
+                raise EOFError("Connection closed")
+
+            if opcode is None:
+                opcode = b0 & 0x0f
+                compressed = bool(b0 & RSV1)
+
+            payload.append(data)
+
+            if b0 & FIN:
+                break
+
+        payload = b''.join(payload)
+
+        if compressed:
+            payload = self.decompressor.decompress(payload + b'\0\0\xff\xff')
+
+        return opcode, payload
+
+    def close(self):
+        try:
+            self.socket.sendall(self.encode_frame(
+                True, OPCODE_CLOSE, struct.pack('!H', 1000)))
+        except socket.error:
+            pass
+
+        self.rfile.close()
+        self.socket.close()
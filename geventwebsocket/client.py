@@ -0,0 +1,435 @@
+"""
+A gevent websocket client.
+
+`connect` performs the opening handshake and returns a `ClientWebSocket`,
+which has the same API as the `WebSocket` of a server connection: `receive`,
+`send`, `send_stream`, `close` and so on. Its frames are masked as RFC 6455
+requires of clients.
+
+A connection takes a few KB of memory besides the socket, so that a single
+process can hold tens of thousands of them, e.g. to load test a server
+(mind the limit on open files, ``ulimit -n``). `ConnectionPool` keeps
+connections to an upstream service open for reuse::
+
+    ws = connect('ws://localhost:8000/echo')
+    ws.send(u'Hello')
+    ws.receive()
+    ws.close()
+
+    pool = ConnectionPool('ws://backend:8000/rpc', size=4)
+
+    with pool.connection() as ws:
+        ws.send(request)
+        response = ws.receive()
+"""
+import base64
+import hashlib
+import logging
+import os
+from collections import deque
+from contextlib import contextmanager
+
+from gevent import socket
+from gevent.lock import BoundedSemaphore
+
+from ._compat import PY3, monotonic
+from .deflate import EXTENSION_NAME, MIN_WINDOW_BITS, MAX_WINDOW_BITS, \
+    PerMessageDeflate, parse_extensions, parse_window_bits
+from .exceptions import HandshakeError, WebSocketError
+from .masking import mask
+from .websocket import Header, Stream, WebSocket, _mock_app
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+__all__ = ('connect', 'ClientWebSocket', 'ConnectionPool')
+
+logger = logging.getLogger(__name__)
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+DEFAULT_PORTS = {'ws': 80, 'wss': 443}
+
+# The response to the handshake is read through a small buffer, frames are
+# read from the socket directly afterwards
+HANDSHAKE_BUFFER_SIZE = 1024
+
+MAX_RESPONSE_LINE = 65536
+MAX_RESPONSE_HEADERS = 100
+
+# Mask keys are sliced off a block of random octets, rather than asking the
+# OS for four octets per frame
+MASK_KEYS_SIZE = 4096
+
+_mask_keys = [b'', 0]
+
+
+def random_mask_key():
+    keys, offset = _mask_keys
+
+    if offset >= len(keys):
+        keys = _mask_keys[0] = os.urandom(MASK_KEYS_SIZE)
+        offset = 0
+
+    _mask_keys[1] = offset + 4
+
+    return keys[offset:offset + 4]
+
+
+class Connection(object):
+    """
+    The socket of a client connection, stands in for the `WebSocketHandler`
+    of a server connection.
+    """
+
+    __slots__ = ('socket', 'rfile', 'url')
+
+    def __init__(self, socket, rfile, url):
+        self.socket = socket
+        self.rfile = rfile
+        self.url = url
+
+    def close(self):
+        self.rfile.close()
+        self.socket.close()
+
+
+class ClientWebSocket(WebSocket):
+    """
+    The client end of a websocket connection, see `connect`.
+
+    :ivar response_headers: The headers of the server's handshake response,
+        by lower case name.
+    """
+
+    __slots__ = ('response_headers',)
+
+    # Many client connections may be open at once, e.g. for load tests
+    read_buffer_size = 4096
+
+    @property
+    def current_app(self):
+        return _mock_app
+
+    @property
+    def logger(self):
+        return logger
+
+    @property
+    def url(self):
+        return self.handler.url
+
+    def encode_frame(self, fin, opcode, payload, flags=0):
+        key = random_mask_key()
+
+        return (Header.encode_header(fin, opcode, key, len(payload), flags),
+                mask(key, payload))
+
+    def write_prepared(self, message):
+        # A prepared frame can't be shared, every frame has a mask key of
+        # its own
+        self.write_message(message.payload, message.opcode, True)
+
+    def close(self, code=1000, message=b''):
+        """
+        Send a close frame and close the connection.
+        """
+        try:
+            super(ClientWebSocket, self).close(code, message)
+        finally:
+            self.handler.close()
+
+
+def connect(url, protocols=None, origin=None, headers=None, compress=False,
+            deflate_no_context_takeover=False, timeout=None,
+            ssl_context=None, source_address=None, max_frame_size=None,
+            max_message_size=None):
+    """
+    Open a websocket connection to `url`.
+
+    :param url: A ``ws://`` or ``wss://`` URL.
+    :param protocols: The subprotocols to offer, the one the server picked
+        is `ClientWebSocket.protocol`.
+    :param origin: The value of the `Origin` header, if any.
+    :param headers: Extra request headers as a list of ``(name, value)``
+        tuples.
+    :param compress: Whether to offer permessage-deflate.
+    :param deflate_no_context_takeover: Whether to ask for the compression
+        context to be reset after every message, which saves memory on
+        both ends.
+    :param timeout: Seconds to wait for the connection and handshake.
+    :param ssl_context: The `ssl.SSLContext` of ``wss://`` connections,
+        defaults to `ssl.create_default_context()`.
+    :returns: A `ClientWebSocket`.
+    :raises HandshakeError: If the server refuses the connection.
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+
+    if scheme not in DEFAULT_PORTS:
+        raise ValueError("Not a websocket URL: {0!r}".format(url))
+
+    host = parts.hostname
+    port = parts.port or DEFAULT_PORTS[scheme]
+    path = parts.path or '/'
+
+    if parts.query:
+        path += '?' + parts.query
+
+    sock = socket.create_connection((host, port), timeout, source_address)
+
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        if scheme == 'wss':
+            if ssl_context is None:
+                from gevent import ssl
+                ssl_context = ssl.create_default_context()
+
+            sock = ssl_context.wrap_socket(sock, server_hostname=host)
+
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        lines = [
+            'GET {0} HTTP/1.1'.format(path),
+            'Host: {0}'.format(parts.netloc.rpartition('@')[2]),
+            'Upgrade: websocket',
+            'Connection: Upgrade',
+            'Sec-WebSocket-Key: {0}'.format(key),
+            'Sec-WebSocket-Version: 13',
+        ]
+
+        if origin:
+            lines.append('Origin: {0}'.format(origin))
+
+        if protocols:
+            lines.append('Sec-WebSocket-Protocol: {0}'.format(
+                ', '.join(protocols)))
+
+        if compress:
+            offer = [EXTENSION_NAME, 'client_max_window_bits']
+
+            if deflate_no_context_takeover:
+                offer += ['server_no_context_takeover',
+                          'client_no_context_takeover']
+
+            lines.append('Sec-WebSocket-Extensions: {0}'.format(
+                '; '.join(offer)))
+
+        for name, value in headers or ():
+            lines.append('{0}: {1}'.format(name, value))
+
+        sock.sendall(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+        rfile = sock.makefile('rb', HANDSHAKE_BUFFER_SIZE)
+        response_headers = read_response(rfile, key)
+
+        protocol = response_headers.get('sec-websocket-protocol')
+
+        if protocol is not None and protocol not in (protocols or ()):
+            raise HandshakeError(
+                "Server picked a protocol that wasn't offered: "
+                "{0}".format(protocol))
+
+        extensions = response_headers.get('sec-websocket-extensions')
+        permessage_deflate = None
+
+        if extensions:
+            if not compress:
+                raise HandshakeError(
+                    "Server picked an extension that wasn't offered: "
+                    "{0}".format(extensions))
+
+            permessage_deflate = accept_response(extensions)
+
+        sock.settimeout(None)
+    except Exception:
+        sock.close()
+        raise
+
+    environ = {
+        'PATH_INFO': parts.path or '/',
+        'QUERY_STRING': parts.query,
+        'HTTP_HOST': parts.netloc,
+        'HTTP_ORIGIN': origin,
+        'HTTP_SEC_WEBSOCKET_VERSION': '13',
+        'HTTP_SEC_WEBSOCKET_PROTOCOL': protocol,
+    }
+    connection = Connection(sock, rfile, url)
+
+    ws = ClientWebSocket(environ, Stream(connection), connection,
+                         permessage_deflate or False)
+    ws.response_headers = response_headers
+    ws.max_frame_size = max_frame_size
+    ws.max_message_size = max_message_size
+
+    return ws
+
+
+def read_response(rfile, key):
+    """
+    Read and validate the server's response to the opening handshake.
+
+    :returns: The response headers by lower case name.
+    """
+    status = rfile.readline(MAX_RESPONSE_LINE).decode('latin-1').rstrip()
+
+    if not status:
+        raise HandshakeError("Connection closed during the handshake")
+
+    headers = {}
+
+    for _ in range(MAX_RESPONSE_HEADERS):
+        line = rfile.readline(MAX_RESPONSE_LINE).decode('latin-1').strip()
+
+        if not line:
+            break
+
+        name, _, value = line.partition(':')
+        name = name.strip().lower()
+        value = value.strip()
+
+        if name in headers:
+            headers[name] += ', ' + value
+        else:
+            headers[name] = value
+    else:
+        raise HandshakeError("Too many response headers", status)
+
+    if status.split(None, 2)[1:2] != ['101']:
+        raise HandshakeError(
+            "Server refused the upgrade: {0}".format(status), status)
+
+    if headers.get('upgrade', '').lower() != 'websocket':
+        raise HandshakeError("Missing Upgrade: websocket header", status)
+
+    if 'upgrade' not in headers.get('connection', '').lower():
+        raise HandshakeError("Missing Connection: Upgrade header", status)
+
+    if headers.get('sec-websocket-accept') != accept_key(key):
+        raise HandshakeError("Invalid Sec-WebSocket-Accept header", status)
+
+    return headers
+
+
+def accept_key(key):
+    accept = base64.b64encode(hashlib.sha1(
+        (key + GUID).encode('latin-1')).digest())
+
+    return accept.decode('latin-1') if PY3 else accept
+
+
+def accept_response(header):
+    """
+    :returns: The `PerMessageDeflate` parameters the server accepted in its
+        `Sec-WebSocket-Extensions` response header, mirrored: as seen by the
+        client, its `server_*` parameters apply to the messages it sends.
+    :raises HandshakeError: If they can't be honoured.
+    """
+    extensions = parse_extensions(header)
+
+    if len(extensions) != 1 or extensions[0][0] != EXTENSION_NAME:
+        raise HandshakeError("Unexpected extensions: {0}".format(header))
+
+    params = dict(extensions[0][1])
+
+    try:
+        # Our messages, compressed with the client parameters
+        send_bits = parse_window_bits(
+            params.get('client_max_window_bits', str(MAX_WINDOW_BITS)))
+        receive_bits = parse_window_bits(
+            params.get('server_max_window_bits', str(MAX_WINDOW_BITS)))
+    except ValueError as error:
+        raise HandshakeError(str(error))
+
+    if send_bits < MIN_WINDOW_BITS:
+        raise HandshakeError("Window too small for zlib: {0}".format(
+            send_bits))
+
+    return PerMessageDeflate(
+        server_no_context_takeover='client_no_context_takeover' in params,
+        client_no_context_takeover='server_no_context_takeover' in params,
+        server_max_window_bits=send_bits,
+        client_max_window_bits=receive_bits)
+
+
+class ConnectionPool(object):
+    """
+    Keeps up to `size` connections to `url` open for reuse, e.g. for links
+    to a backend service. Connections are opened as needed, callers wait for
+    one to be returned when all are in use.
+
+    :param max_idle: Seconds a connection may sit in the pool unused before
+        it is closed instead of handed out, `None` for no limit.
+    :param kwargs: Passed on to `connect`.
+    """
+
+    def __init__(self, url, size=10, max_idle=None, **kwargs):
+        self.url = url
+        self.size = size
+        self.max_idle = max_idle
+        self.kwargs = kwargs
+        # (connection, time returned), most recently returned last
+        self.idle = deque()
+        self.slots = BoundedSemaphore(size)
+
+    def get(self, timeout=None):
+        """
+        :returns: An open connection, which must be passed to `put` when done
+            with it.
+        :raises WebSocketError: If none became available within `timeout`.
+        """
+        if not self.slots.acquire(timeout=timeout):
+            raise WebSocketError("No connection available")
+
+        try:
+            while self.idle:
+                ws, returned = self.idle.pop()
+
+                if ws.closed:
+                    continue
+
+                if (self.max_idle is not None and
+                        monotonic() - returned > self.max_idle):
+                    ws.close()
+                    continue
+
+                return ws
+
+            return connect(self.url, **self.kwargs)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def put(self, ws):
+        """
+        Return a connection to the pool, closed ones are dropped.
+        """
+        if not ws.closed:
+            self.idle.append((ws, monotonic()))
+
+        self.slots.release()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        A context manager version of `get` and `put`. The connection is
+        closed rather than reused if the block raises.
+        """
+        ws = self.get(timeout)
+
+        try:
+            yield ws
+        except BaseException:
+            ws.close()
+            raise
+        finally:
+            self.put(ws)
+
+    def close(self):
+        """
+        Close the idle connections.
+        """
+        while self.idle:
+            self.idle.pop()[0].close()
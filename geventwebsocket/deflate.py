@@ -0,0 +1,315 @@
+"""
+Negotiation of the permessage-deflate extension (RFC 7692).
+
+A compressor with the zlib defaults and context takeover holds on to about
+256 KB, and a decompressor to 32 KB plus change, for as long as the
+connection lives. The extension parameters let both ends agree on smaller
+LZ77 windows, and on resetting the context after every message. Without
+context takeover `WebSocket` only allocates the zlib state while a message
+is being (de)compressed, so idle connections hold none at all.
+"""
+import zlib
+
+__all__ = ('PerMessageDeflate', 'CompressionPolicy', 'negotiate')
+
+EXTENSION_NAME = 'permessage-deflate'
+
+# The default compression level of outgoing messages
+COMPRESSION_LEVEL = 7
+
+# zlib can't compress with a window of 2 ** 8 octets, so offers that insist
+# on it are declined
+MIN_WINDOW_BITS = 9
+MAX_WINDOW_BITS = zlib.MAX_WBITS
+DEFAULT_MEM_LEVEL = 8
+
+
+class PerMessageDeflate(object):
+    """
+    The permessage-deflate parameters in effect for a connection, as seen by
+    the server.
+
+    :ivar server_no_context_takeover: Whether the compression context is
+        reset after every outgoing message.
+    :ivar client_no_context_takeover: Whether the client resets its
+        compression context after every message, so that incoming messages
+        can be inflated without the previous ones.
+    :ivar server_max_window_bits: The base-2 logarithm of the LZ77 window
+        outgoing messages are compressed with.
+    :ivar client_max_window_bits: The base-2 logarithm of the largest LZ77
+        window incoming messages may have been compressed with.
+    :ivar mem_level: The zlib memLevel outgoing messages are compressed with.
+    """
+
+    __slots__ = ('server_no_context_takeover', 'client_no_context_takeover',
+                 'server_max_window_bits', 'client_max_window_bits',
+                 'mem_level')
+
+    def __init__(self, server_no_context_takeover=False,
+                 client_no_context_takeover=False,
+                 server_max_window_bits=MAX_WINDOW_BITS,
+                 client_max_window_bits=MAX_WINDOW_BITS,
+                 mem_level=DEFAULT_MEM_LEVEL):
+        self.server_no_context_takeover = server_no_context_takeover
+        self.client_no_context_takeover = client_no_context_takeover
+        self.server_max_window_bits = server_max_window_bits
+        self.client_max_window_bits = client_max_window_bits
+        self.mem_level = mem_level
+
+    def compressobj(self, level=COMPRESSION_LEVEL):
+        return zlib.compressobj(level, zlib.DEFLATED,
+                                -self.server_max_window_bits, self.mem_level)
+
+    def decompressobj(self):
+        # A larger window than the client's is harmless, and zlib only
+        # inflates with at least 2 ** 9 octets anyway
+        return zlib.decompressobj(
+            -max(self.client_max_window_bits, MIN_WINDOW_BITS))
+
+    def response(self):
+        """
+        :returns: The value of the `Sec-WebSocket-Extensions` header that
+            accepts the offer these parameters were negotiated from.
+        """
+        params = [EXTENSION_NAME]
+
+        if self.server_no_context_takeover:
+            params.append('server_no_context_takeover')
+
+        if self.client_no_context_takeover:
+            params.append('client_no_context_takeover')
+
+        if self.server_max_window_bits < MAX_WINDOW_BITS:
+            params.append('server_max_window_bits={0:d}'.format(
+                self.server_max_window_bits))
+
+        if self.client_max_window_bits < MAX_WINDOW_BITS:
+            params.append('client_max_window_bits={0:d}'.format(
+                self.client_max_window_bits))
+
+        return '; '.join(params)
+
+
+class CompressionPolicy(object):
+    """
+    Decides which outgoing messages of a compressed connection are worth
+    compressing, and at which level.
+
+    Messages smaller than `min_size` octets are sent as is, zlib can't shrink
+    them by much. For every connection the ratio achieved per opcode is
+    tracked over `sample_size` octets at a time. If the compressed size is
+    more than `max_ratio` of the original, say for already compressed binary
+    data, the next `retry_after` messages with that opcode are sent
+    uncompressed before trying again.
+
+    A policy is stateless and can be shared, set it on the server, handler
+    or a `WebSocketApplication` as `compression_policy`.
+
+    :param level: The zlib level to compress messages with, 0 disables
+        compression.
+    :param levels: Optional overrides of `level` by opcode, e.g.
+        ``{WebSocket.OPCODE_BINARY: 1}``. A level of 0 always applies. Other
+        levels only apply per message without context takeover: with
+        context takeover a connection keeps compressing at the level of its
+        first compressed message, since zlib can't switch levels without
+        losing the context.
+    """
+
+    __slots__ = ('min_size', 'level', 'levels', 'max_ratio', 'sample_size',
+                 'retry_after')
+
+    def __init__(self, min_size=128, level=COMPRESSION_LEVEL, levels=None,
+                 max_ratio=0.9, sample_size=64 * 1024, retry_after=100):
+        self.min_size = min_size
+        self.level = level
+        self.levels = levels or {}
+        self.max_ratio = max_ratio
+        self.sample_size = sample_size
+        self.retry_after = retry_after
+
+    def level_for(self, opcode):
+        return self.levels.get(opcode, self.level)
+
+
+class CompressionTracker(object):
+    """
+    Applies a `CompressionPolicy` to the outgoing messages of a single
+    connection.
+    """
+
+    __slots__ = ('policy', 'stats')
+
+    def __init__(self, policy):
+        self.policy = policy
+        # [original octets, compressed octets, messages left to skip] per
+        # opcode
+        self.stats = {}
+
+    def level(self, opcode, size=None):
+        """
+        :returns: The zlib level to compress a message with, or 0 if it should
+            be sent uncompressed.
+        :param size: The size of the message, `None` if it isn't known in
+            advance.
+        """
+        policy = self.policy
+
+        if size is not None and size < policy.min_size:
+            return 0
+
+        stats = self.stats.get(opcode)
+
+        if stats is not None and stats[2]:
+            stats[2] -= 1
+            return 0
+
+        return policy.level_for(opcode)
+
+    def record(self, opcode, size, compressed_size):
+        """
+        Account for a message of `size` octets that was compressed to
+        `compressed_size` octets.
+        """
+        stats = self.stats.get(opcode)
+
+        if stats is None:
+            stats = self.stats[opcode] = [0, 0, 0]
+
+        stats[0] += size
+        stats[1] += compressed_size
+
+        if stats[0] < self.policy.sample_size:
+            return
+
+        if stats[1] > stats[0] * self.policy.max_ratio:
+            # Not paying off, back off for a while
+            stats[2] = self.policy.retry_after
+
+        stats[0] = stats[1] = 0
+
+
+DEFAULT_POLICY = CompressionPolicy()
+
+
+def parse_window_bits(value):
+    if value is None or not value.isdigit() or value[0] == '0':
+        raise ValueError("Invalid window bits: {0!r}".format(value))
+
+    bits = int(value)
+
+    if not 8 <= bits <= MAX_WINDOW_BITS:
+        raise ValueError("Invalid window bits: {0!r}".format(value))
+
+    return bits
+
+
+def parse_extensions(header):
+    """
+    Parse a `Sec-WebSocket-Extensions` header.
+
+    :returns: A list of ``(name, params)`` tuples in the order offered, with
+        `params` a list of ``(name, value)`` tuples. `value` is `None` for
+        parameters without one.
+    """
+    extensions = []
+
+    for extension in header.split(','):
+        parts = [part.strip() for part in extension.split(';')]
+
+        if not parts[0]:
+            continue
+
+        params = []
+
+        for param in parts[1:]:
+            name, sep, value = param.partition('=')
+            value = value.strip().strip('"') if sep else None
+            params.append((name.strip(), value))
+
+        extensions.append((parts[0], params))
+
+    return extensions
+
+
+def accept_offer(params, max_window_bits=MAX_WINDOW_BITS,
+                 mem_level=DEFAULT_MEM_LEVEL, no_context_takeover=False):
+    """
+    Accept a single permessage-deflate offer, within the limits of the
+    server's policy.
+
+    :param params: The parameters of the offer, see `parse_extensions`.
+    :returns: The `PerMessageDeflate` parameters for the connection.
+    :raises ValueError: If the offer is invalid or can't be accepted.
+    """
+    offer = {}
+
+    for name, value in params:
+        if name in offer:
+            raise ValueError("Duplicate parameter {0}".format(name))
+
+        if name in ('server_no_context_takeover',
+                    'client_no_context_takeover'):
+            if value is not None:
+                raise ValueError("Unexpected value for {0}".format(name))
+        elif name == 'server_max_window_bits':
+            value = parse_window_bits(value)
+        elif name == 'client_max_window_bits':
+            if value is not None:
+                value = parse_window_bits(value)
+        else:
+            raise ValueError("Unknown parameter {0}".format(name))
+
+        offer[name] = value
+
+    max_window_bits = max(MIN_WINDOW_BITS, min(max_window_bits,
+                                               MAX_WINDOW_BITS))
+    server_window_bits = min(
+        offer.get('server_max_window_bits', MAX_WINDOW_BITS), max_window_bits)
+
+    if server_window_bits < MIN_WINDOW_BITS:
+        raise ValueError("Window too small for zlib")
+
+    if 'client_max_window_bits' in offer:
+        # The client can be asked for a smaller window too
+        client_window_bits = min(
+            offer['client_max_window_bits'] or MAX_WINDOW_BITS,
+            max_window_bits)
+    else:
+        client_window_bits = MAX_WINDOW_BITS
+
+    return PerMessageDeflate(
+        server_no_context_takeover=(
+            no_context_takeover or 'server_no_context_takeover' in offer),
+        client_no_context_takeover=(
+            no_context_takeover or 'client_no_context_takeover' in offer),
+        server_max_window_bits=server_window_bits,
+        client_max_window_bits=client_window_bits,
+        mem_level=mem_level)
+
+
+def negotiate(header, max_window_bits=MAX_WINDOW_BITS,
+              mem_level=DEFAULT_MEM_LEVEL, no_context_takeover=False):
+    """
+    Negotiate permessage-deflate from the client's `Sec-WebSocket-Extensions`
+    header.
+
+    :param max_window_bits: The largest LZ77 window, as a base-2 logarithm
+        between 9 and 15, to compress with and to ask the client for.
+    :param mem_level: The zlib memLevel to compress with, between 1 and 9.
+    :param no_context_takeover: Whether to have both ends reset their
+        compression context after every message.
+    :returns: The `PerMessageDeflate` parameters for the first acceptable
+        offer, or `None` if there is none.
+    """
+    for name, params in parse_extensions(header):
+        if name != EXTENSION_NAME:
+            continue
+
+        try:
+            return accept_offer(params, max_window_bits, mem_level,
+                                no_context_takeover)
+        except ValueError:
+            # Try the next offer
+            continue
+
+    return None
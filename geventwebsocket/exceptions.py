@@ -15,5 +15,18 @@ class ProtocolError(WebSocketError):
 
 class FrameTooLargeException(ProtocolError):
     """
-    Raised if a frame is received that is too large.
+    Raised if a frame or message is received that is larger than allowed.
     """
+
+
+class HandshakeError(WebSocketError):
+    """
+    Raised if a server refuses or botches the opening handshake of a client
+    connection.
+
+    :ivar status: The HTTP status line of the response, if any.
+    """
+
+    def __init__(self, message, status=None):
+        super(HandshakeError, self).__init__(message)
+        self.status = status
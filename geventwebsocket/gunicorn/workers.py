@@ -1,6 +1,27 @@
+from functools import partial
+
+from geventwebsocket.backplane import UnixBackplane
 from geventwebsocket.handler import WebSocketHandler
+from geventwebsocket.server import WebSocketServer
 from gunicorn.workers.ggevent import GeventPyWSGIWorker
 
 
 class GeventWebSocketWorker(GeventPyWSGIWorker):
     wsgi_handler = WebSocketHandler
+
+    # The socket of a `Broker` to attach the workers to, so that broadcasts
+    # and WAMP channels reach the clients of all workers. Set it in a
+    # subclass, see `geventwebsocket.backplane`.
+    backplane_path = None
+
+    backplane = None
+
+    @property
+    def server_class(self):
+        if self.backplane_path is None:
+            return GeventPyWSGIWorker.server_class
+
+        if self.backplane is None:
+            self.backplane = UnixBackplane(self.backplane_path)
+
+        return partial(WebSocketServer, backplane=self.backplane)
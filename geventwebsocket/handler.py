@@ -1,16 +1,93 @@
 import base64
 import hashlib
+import time
+from logging import INFO
 
+import gevent
 from gevent.pywsgi import WSGIHandler
-from ._compat import PY3
-from .websocket import WebSocket, Stream
+from gevent.queue import Queue, Full
+from ._compat import PY3, text_type
+from .admission import Admission
+from .deflate import DEFAULT_POLICY, negotiate
+from .exceptions import WebSocketError
+from .websocket import WebSocket, Stream, PreparedMessage
 from .logging import create_logger
 
+# The constant headers of every 101 response
+UPGRADE_HEADER = ("Upgrade", "websocket")
+CONNECTION_HEADER = ("Connection", "Upgrade")
+
+
+def _encode_body(msg):
+    # Response bodies are bytes (PEP 3333), messages may quote headers
+    if isinstance(msg, text_type):
+        return msg.encode('latin-1')
+
+    return msg
+
 
 class Client(object):
-    def __init__(self, address, ws):
+    """
+    A connected client, see `WebSocketServer.clients`.
+
+    Messages passed to `enqueue` are put on a bounded outbound queue and
+    written by a greenlet of the client's own, so that a slow client doesn't
+    hold up whoever sends to it. The queue and greenlet are only created once
+    the first message is enqueued.
+
+    :ivar dropped: The number of messages dropped because the queue was full.
+    """
+
+    def __init__(self, address, ws, max_queue_size=1024):
         self.address = address
         self.ws = ws
+        self.max_queue_size = max_queue_size
+        self.queue = None
+        self.writer = None
+        self.dropped = 0
+
+    def enqueue(self, message):
+        """
+        Queue `message`, a `PreparedMessage` or anything `WebSocket.send`
+        accepts, to be sent to this client.
+
+        :returns: Whether the message was queued. It is dropped if the queue
+            is full or the connection is closed.
+        """
+        if self.ws is None or self.ws.closed:
+            return False
+
+        if self.queue is None:
+            self.queue = Queue(self.max_queue_size)
+            self.writer = gevent.spawn(self._write)
+
+        try:
+            self.queue.put_nowait(message)
+        except Full:
+            self.dropped += 1
+            return False
+
+        return True
+
+    def _write(self):
+        ws = self.ws
+
+        for message in self.queue:
+            try:
+                if isinstance(message, PreparedMessage):
+                    ws.send_prepared(message)
+                else:
+                    ws.send(message)
+            except WebSocketError:
+                break
+
+    def close(self):
+        """
+        Stop the writer, messages still queued are discarded.
+        """
+        if self.writer is not None:
+            self.writer.kill(block=False)
+            self.writer = None
 
 
 class WebSocketHandler(WSGIHandler):
@@ -25,7 +102,31 @@ class WebSocketHandler(WSGIHandler):
     before calling run_application().  This is useful if you want to do more
     things before calling the app, and want to off-load the WebSocket
     negotiations to this library.  Socket.IO needs this for example, to send
-    the 'ack' before yielding the control to your WSGI app.
+    the 'ack' before yielding the control to your WSGI app. The connection
+    then counts towards `max_connections` until the handler is done with it.
+
+    The maximum payload size of incoming frames and messages can be limited
+    with `max_frame_size` and `max_message_size`. They are taken from the
+    application's route (see `Resource.app_settings`), the server or this
+    handler, in that order. `None` means unlimited.
+
+    `outbound_queue_size` is the number of messages that can be queued for a
+    client, see `Client.enqueue`, before they are dropped.
+
+    permessage-deflate is negotiated within the limits of the
+    `deflate_max_window_bits` (9 to 15), `deflate_mem_level` (1 to 9) and
+    `deflate_no_context_takeover` settings, which are looked up the same way.
+    Smaller windows and memory levels trade compression ratio for memory;
+    without context takeover no zlib state is kept between messages. Which
+    outgoing messages get compressed is up to the `compression_policy`
+    setting, see `CompressionPolicy`.
+
+    Upgrades are rejected with ``503 Service Unavailable`` and a
+    ``Retry-After`` header while the server has `max_connections` websocket
+    connections, or the route has its own `max_connections` (see
+    `Resource.app_settings`), or while handshakes arrive faster than
+    `max_handshake_rate` per second (in bursts of `handshake_burst`). See
+    `Admission`.
     """
 
     SUPPORTED_VERSIONS = ('13', '8', '7')
@@ -33,6 +134,25 @@ class WebSocketHandler(WSGIHandler):
 
     websocket_class = WebSocket
 
+    max_frame_size = None
+    max_message_size = None
+
+    deflate_max_window_bits = 15
+    deflate_mem_level = 8
+    deflate_no_context_takeover = False
+    compression_policy = DEFAULT_POLICY
+
+    outbound_queue_size = 1024
+
+    max_connections = None
+    max_handshake_rate = None
+    handshake_burst = None
+
+    # Whether, and to which route, the connection was admitted, see
+    # `Admission`
+    admitted = False
+    admitted_route = None
+
     def run_websocket(self):
         """
         Called when a websocket has been created successfully.
@@ -48,12 +168,31 @@ class WebSocketHandler(WSGIHandler):
         # Since we're now a websocket connection, we don't care what the
         # application actually responds with for the http response
 
+        client = Client(self.client_address, self.websocket,
+                        self.get_setting('outbound_queue_size', {}))
+        heartbeat = getattr(self.server, 'heartbeat', None)
+        metrics = self.websocket.metrics
+
+        if metrics is not None:
+            metrics.connections += 1
+
         try:
-            self.server.clients[self.client_address] = Client(
-                self.client_address, self.websocket)
+            self.server.clients[self.client_address] = client
+
+            if heartbeat is not None:
+                heartbeat.add(self.websocket)
+
             list(self.application(self.environ, lambda s, h, e=None: []))
         finally:
-            if self.client_address in self.server.clients:
+            client.close()
+
+            if heartbeat is not None:
+                heartbeat.remove(self.websocket)
+
+            if metrics is not None:
+                metrics.connections -= 1
+
+            if self.server.clients.get(self.client_address) is client:
                 del self.server.clients[self.client_address]
             if not self.websocket.closed:
                 self.websocket.close()
@@ -63,25 +202,49 @@ class WebSocketHandler(WSGIHandler):
             self.websocket = None
 
     def run_application(self):
-        if (hasattr(self.server, 'pre_start_hook') and self.server.pre_start_hook):
+        pre_start_hook = getattr(self.server, 'pre_start_hook', None)
+
+        if pre_start_hook:
             self.logger.debug("Calling pre-start hook")
-            if self.server.pre_start_hook(self):
+            if pre_start_hook(self):
                 return super(WebSocketHandler, self).run_application()
 
         self.logger.debug("Initializing WebSocket")
-        self.result = self.upgrade_websocket()
 
-        if hasattr(self, 'websocket'):
-            if self.status and not self.headers_sent:
-                self.write('')
+        try:
+            self.result = self.upgrade_websocket()
+        except BaseException:
+            # The upgrade failed after the connection was admitted
+            self.release_admission()
+            raise
+
+        metrics = getattr(self.server, 'metrics', None)
 
-            self.run_websocket()
+        if hasattr(self, 'websocket'):
+            try:
+                if self.status and not self.headers_sent:
+                    self.write('')
+
+                if metrics is not None:
+                    metrics.handshakes_accepted += 1
+                    metrics.handshake_latency.observe(
+                        time.time() - self.time_start)
+
+                self.run_websocket()
+            finally:
+                # Otherwise whoever prevented the call still serves the
+                # connection, it is released once `handle` returns
+                if not getattr(self, 'prevent_wsgi_call', False):
+                    self.release_admission()
         else:
             if self.status:
                 # A status was set, likely an error so just send the response
                 if not self.result:
                     self.result = []
 
+                if metrics is not None:
+                    metrics.handshakes_rejected += 1
+
                 self.process_result()
                 return
 
@@ -89,6 +252,17 @@ class WebSocketHandler(WSGIHandler):
             # underlying application object
             return super(WebSocketHandler, self).run_application()
 
+    def handle(self):
+        try:
+            super(WebSocketHandler, self).handle()
+        finally:
+            self.release_admission()
+
+    def release_admission(self):
+        if self.admitted:
+            self.admitted = False
+            self.server.admission.release(self.admitted_route)
+
     def upgrade_websocket(self):
         """
         Attempt to upgrade the current environ into a websocket enabled
@@ -99,23 +273,24 @@ class WebSocketHandler(WSGIHandler):
         """
 
         # Some basic sanity checks first
+        environ = self.environ
+        logger = self.logger
 
-        self.logger.debug("Validating WebSocket request")
+        logger.debug("Validating WebSocket request")
 
-        if self.environ.get('REQUEST_METHOD', '') != 'GET':
+        if environ.get('REQUEST_METHOD', '') != 'GET':
             # This is not a websocket request, so we must not handle it
-            self.logger.debug('Can only upgrade connection if using GET method.')
+            logger.debug('Can only upgrade connection if using GET method.')
             return
 
-        upgrade = self.environ.get('HTTP_UPGRADE', '').lower()
+        upgrade = environ.get('HTTP_UPGRADE', '').lower()
 
         if upgrade == 'websocket':
-            connection = self.environ.get('HTTP_CONNECTION', '').lower()
+            connection = environ.get('HTTP_CONNECTION', '').lower()
 
             if 'upgrade' not in connection:
                 # This is not a websocket request, so we must not handle it
-                self.logger.warning("Client didn't ask for a connection "
-                                    "upgrade")
+                logger.warning("Client didn't ask for a connection upgrade")
                 return
         else:
             # This is not a websocket request, so we must not handle it
@@ -123,18 +298,18 @@ class WebSocketHandler(WSGIHandler):
 
         if self.request_version != 'HTTP/1.1':
             self.start_response('402 Bad Request', [])
-            self.logger.warning("Bad server protocol in headers")
+            logger.warning("Bad server protocol in headers")
 
-            return ['Bad protocol version']
+            return [b'Bad protocol version']
 
-        if self.environ.get('HTTP_SEC_WEBSOCKET_VERSION'):
+        if environ.get('HTTP_SEC_WEBSOCKET_VERSION'):
             return self.upgrade_connection()
         else:
-            self.logger.warning("No protocol defined")
+            logger.warning("No protocol defined")
             self.start_response('426 Upgrade Required', [
                 ('Sec-WebSocket-Version', ', '.join(self.SUPPORTED_VERSIONS))])
 
-            return ['No Websocket protocol version defined']
+            return [b'No Websocket protocol version defined']
 
     def upgrade_connection(self):
         """
@@ -151,75 +326,119 @@ class WebSocketHandler(WSGIHandler):
         :return: The WSGI response iterator is something went awry.
         """
 
-        self.logger.debug("Attempting to upgrade connection")
+        environ = self.environ
+        logger = self.logger
 
-        version = self.environ.get("HTTP_SEC_WEBSOCKET_VERSION")
+        logger.debug("Attempting to upgrade connection")
+
+        version = environ.get("HTTP_SEC_WEBSOCKET_VERSION")
 
         if version not in self.SUPPORTED_VERSIONS:
             msg = "Unsupported WebSocket Version: {0}".format(version)
 
-            self.logger.warning(msg)
+            logger.warning(msg)
             self.start_response('400 Bad Request', [
                 ('Sec-WebSocket-Version', ', '.join(self.SUPPORTED_VERSIONS))
             ])
 
-            return [msg]
+            return [_encode_body(msg)]
 
-        key = self.environ.get("HTTP_SEC_WEBSOCKET_KEY", '').strip()
+        key = environ.get("HTTP_SEC_WEBSOCKET_KEY", '').strip()
 
         if not key:
             # 5.2.1 (3)
             msg = "Sec-WebSocket-Key header is missing/empty"
 
-            self.logger.warning(msg)
+            logger.warning(msg)
             self.start_response('400 Bad Request', [])
 
-            return [msg]
+            return [_encode_body(msg)]
 
         try:
             key_len = len(base64.b64decode(key))
-        except TypeError:
+        except (TypeError, ValueError):
+            # binascii.Error is a ValueError on Python 3
             msg = "Invalid key: {0}".format(key)
 
-            self.logger.warning(msg)
+            logger.warning(msg)
             self.start_response('400 Bad Request', [])
 
-            return [msg]
+            return [_encode_body(msg)]
 
         if key_len != 16:
             # 5.2.1 (3)
             msg = "Invalid key: {0}".format(key)
 
-            self.logger.warning(msg)
+            logger.warning(msg)
             self.start_response('400 Bad Request', [])
 
-            return [msg]
+            return [_encode_body(msg)]
+
+        application = self.application
+        path = environ['PATH_INFO']
+
+        app_settings_for = getattr(application, 'app_settings', None)
+        app_settings = app_settings_for(path) if app_settings_for else {}
+
+        app_route = getattr(application, 'app_route', None)
+        route = app_route(path) if app_route else None
+
+        # Reject before anything is allocated for the connection
+        rejected = self.admission.admit(
+            route, app_settings.get('max_connections'))
+
+        if rejected is not None:
+            msg, retry_after = rejected
+
+            logger.debug(msg)
+            self.close_connection = True
+            self.start_response('503 Service Unavailable', [
+                ('Retry-After', str(retry_after))])
+
+            return [_encode_body(msg)]
+
+        self.admitted = True
+        self.admitted_route = route
 
         # Check for WebSocket Protocols
-        requested_protocols = self.environ.get(
-            'HTTP_SEC_WEBSOCKET_PROTOCOL', '')
+        requested_protocols = environ.get('HTTP_SEC_WEBSOCKET_PROTOCOL')
+        app_protocol = getattr(application, 'app_protocol', None)
         protocol = None
 
-        if hasattr(self.application, 'app_protocol'):
-            allowed_protocol = self.application.app_protocol(
-                self.environ['PATH_INFO'])
+        if requested_protocols and app_protocol:
+            allowed_protocol = app_protocol(path)
 
             if allowed_protocol and allowed_protocol in requested_protocols:
                 protocol = allowed_protocol
-                self.logger.debug("Protocol allowed: {0}".format(protocol))
+                logger.debug("Protocol allowed: %s", protocol)
 
-        extensions = self.environ.get('HTTP_SEC_WEBSOCKET_EXTENSIONS')
+        extensions = environ.get('HTTP_SEC_WEBSOCKET_EXTENSIONS')
         if extensions:
-            extensions = {extension.split(";")[0].strip() for extension in extensions.split(",")}
-            do_compress = "permessage-deflate" in extensions
+            permessage_deflate = negotiate(
+                extensions,
+                max_window_bits=self.get_setting(
+                    'deflate_max_window_bits', app_settings),
+                mem_level=self.get_setting(
+                    'deflate_mem_level', app_settings),
+                no_context_takeover=self.get_setting(
+                    'deflate_no_context_takeover', app_settings))
         else:
-            do_compress = False
+            permessage_deflate = None
+
+        websocket = self.websocket = self.websocket_class(
+            environ, Stream(self), self, permessage_deflate or False)
+        websocket.metrics = getattr(self.server, 'metrics', None)
+        websocket.max_frame_size = self.get_setting(
+            'max_frame_size', app_settings)
+        websocket.max_message_size = self.get_setting(
+            'max_message_size', app_settings)
 
-        self.websocket = self.websocket_class(self.environ, Stream(self), self, do_compress)
-        self.environ.update({
-            'wsgi.websocket_version': version,
-            'wsgi.websocket': self.websocket
-        })
+        if permessage_deflate:
+            websocket.compression.policy = self.get_setting(
+                'compression_policy', app_settings)
+
+        environ['wsgi.websocket_version'] = version
+        environ['wsgi.websocket'] = websocket
 
         if PY3:
             accept = base64.b64encode(
@@ -229,30 +448,63 @@ class WebSocketHandler(WSGIHandler):
             accept = base64.b64encode(hashlib.sha1(key + self.GUID).digest())
 
         headers = [
-            ("Upgrade", "websocket"),
-            ("Connection", "Upgrade"),
+            UPGRADE_HEADER,
+            CONNECTION_HEADER,
             ("Sec-WebSocket-Accept", accept)
         ]
 
-        if do_compress:
-            headers.append(("Sec-WebSocket-Extensions", "permessage-deflate"))
+        if permessage_deflate:
+            headers.append(("Sec-WebSocket-Extensions",
+                            permessage_deflate.response()))
 
         if protocol:
             headers.append(("Sec-WebSocket-Protocol", protocol))
 
-        self.logger.debug("WebSocket request accepted, switching protocols")
+        logger.debug("WebSocket request accepted, switching protocols")
         self.start_response("101 Switching Protocols", headers)
 
+    def get_setting(self, name, app_settings):
+        """
+        :returns: The value of setting `name` for the current connection,
+            taken from the route, the server or this handler, in that order.
+        """
+        value = app_settings.get(name)
+
+        if value is None:
+            value = getattr(self.server, name, None)
+
+        if value is None:
+            value = getattr(self, name)
+
+        return value
+
+    @property
+    def admission(self):
+        # In case WebSocketServer is not used
+        if not hasattr(self.server, 'admission'):
+            self.server.admission = Admission(
+                self.get_setting('max_connections', {}),
+                self.get_setting('max_handshake_rate', {}),
+                self.get_setting('handshake_burst', {}))
+
+        return self.server.admission
+
     @property
     def logger(self):
-        if not hasattr(self.server, 'logger'):
+        try:
+            return self.server.logger
+        except AttributeError:
+            # In case WebSocketServer is not used
             self.server.logger = create_logger(__name__)
 
-        return self.server.logger
+            return self.server.logger
 
     def log_request(self):
         if '101' not in str(self.status):
-            self.logger.info(self.format_request())
+            logger = self.logger
+
+            if logger.isEnabledFor(INFO):
+                logger.info(self.format_request())
 
     @property
     def active_client(self):
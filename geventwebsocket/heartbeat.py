@@ -0,0 +1,246 @@
+"""
+Server-wide heartbeat: pings every connection on an interval, measures the
+round trip time from the pongs and evicts peers that stopped responding.
+
+All connections are served by a single greenlet. Their next check is kept in
+a `TimerWheel`, so that (un)scheduling a connection is O(1) and a tick only
+touches the connections that are due. The pings of a tick are written by a
+single greenlet of a bounded pool.
+"""
+import struct
+
+import gevent
+from gevent.pool import Pool
+
+from ._compat import monotonic
+from .exceptions import WebSocketError
+
+__all__ = ('Heartbeat', 'TimerWheel')
+
+# The close code evicted peers are sent, going away
+CLOSE_CODE = 1001
+
+# Seconds to try sending the close frame to an evicted peer for
+CLOSE_TIMEOUT = 1
+
+# The number of ticks whose pings can be written at the same time. A batch
+# is held up by peers whose socket is backed up, once this many are the
+# pings of further ticks are skipped
+PING_BATCHES = 16
+
+MSG_PONG_TIMEOUT = "Ping timeout"
+MSG_READ_TIMEOUT = "Read timeout"
+
+_pack_Q = struct.Struct('!Q').pack
+
+
+class TimerWheel(object):
+    """
+    A hashed timing wheel of `size` slots of `resolution` seconds each.
+
+    Timers further out than a full turn of the wheel stay in their slot for
+    as many rounds as needed.
+    """
+
+    __slots__ = ('resolution', 'slots', 'position', 'timers')
+
+    def __init__(self, resolution=1.0, size=512):
+        self.resolution = resolution
+        # item -> rounds left, per slot
+        self.slots = [{} for _ in range(size)]
+        self.position = 0
+        # item -> slot
+        self.timers = {}
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __contains__(self, item):
+        return item in self.timers
+
+    def schedule(self, item, delay):
+        """
+        Have `item` expire in `delay` seconds, rounded up to the resolution.
+        Replaces the previous timer of `item`, if any.
+        """
+        self.cancel(item)
+
+        ticks = max(1, -int(-delay // self.resolution))
+        size = len(self.slots)
+        index = (self.position + ticks) % size
+
+        self.slots[index][item] = (ticks - 1) // size
+        self.timers[item] = index
+
+    def cancel(self, item):
+        index = self.timers.pop(item, None)
+
+        if index is not None:
+            del self.slots[index][item]
+
+    def tick(self):
+        """
+        Advance the wheel by one slot.
+
+        :returns: A list of the items that expired.
+        """
+        self.position = (self.position + 1) % len(self.slots)
+        slot = self.slots[self.position]
+        expired = []
+
+        for item, rounds in list(slot.items()):
+            if rounds:
+                slot[item] = rounds - 1
+            else:
+                del slot[item]
+                del self.timers[item]
+                expired.append(item)
+
+        return expired
+
+
+class Heartbeat(object):
+    """
+    Pings connections every `interval` seconds and closes those that missed
+    `max_missed_pongs` pongs in a row, or that didn't send anything at all
+    for `read_timeout` seconds.
+
+    The round trip time of the last answered ping is kept in `WebSocket.rtt`.
+
+    Pongs, like all incoming frames, are only read while the application
+    waits in `WebSocket.receive`. Connections are only judged while it does:
+    one the application just sends to is pinged, but never evicted. Its
+    dead peers show when sending to them fails.
+
+    :param interval: Seconds in between pings, `None` to not send any.
+    :param read_timeout: Seconds a connection may go without receiving a
+        frame, `None` for no limit.
+    :param resolution: The granularity of the timers in seconds.
+    """
+
+    __slots__ = ('interval', 'max_missed_pongs', 'read_timeout', 'wheel',
+                 'greenlet', 'sequence', 'pool')
+
+    def __init__(self, interval=30, max_missed_pongs=2, read_timeout=None,
+                 resolution=1.0):
+        self.interval = interval
+        self.max_missed_pongs = max_missed_pongs
+        self.read_timeout = read_timeout
+        self.wheel = TimerWheel(resolution)
+        self.greenlet = None
+        # Ping payloads are unique, so that late pongs can't be mistaken for
+        # the answer to the current ping
+        self.sequence = 0
+        self.pool = Pool(PING_BATCHES)
+
+    @property
+    def check_interval(self):
+        if self.interval is None:
+            return self.read_timeout
+
+        if self.read_timeout is None:
+            return self.interval
+
+        return min(self.interval, self.read_timeout)
+
+    def add(self, ws):
+        """
+        Start checking on `ws`.
+        """
+        ws.last_read = monotonic()
+        self.wheel.schedule(ws, self.check_interval)
+
+        if self.greenlet is None:
+            self.greenlet = gevent.spawn(self._run)
+
+    def remove(self, ws):
+        """
+        Stop checking on `ws`.
+        """
+        self.wheel.cancel(ws)
+
+    def stop(self):
+        if self.greenlet is not None:
+            self.greenlet.kill(block=False)
+            self.greenlet = None
+
+        self.pool.kill(block=False)
+
+    def _run(self):
+        resolution = self.wheel.resolution
+        next_tick = monotonic() + resolution
+
+        while True:
+            gevent.sleep(max(0, next_tick - monotonic()))
+            next_tick += resolution
+
+            pings = [ws for ws in self.wheel.tick() if self.check(ws)]
+
+            if pings:
+                self.ping(pings)
+
+    def check(self, ws):
+        """
+        Evict `ws` if it timed out and schedule its next check.
+
+        :returns: Whether to ping it.
+        """
+        if ws.closed:
+            return False
+
+        now = monotonic()
+        reading = ws.reading
+
+        if not reading:
+            # Nothing could have been read, whatever the peer sent
+            ws.last_read = now
+        elif (self.read_timeout is not None and
+                now - ws.last_read >= self.read_timeout):
+            self.evict(ws, MSG_READ_TIMEOUT)
+            return False
+
+        if self.interval is not None:
+            if ws.ping_payload is not None and reading:
+                ws.missed_pongs += 1
+
+                if ws.missed_pongs >= self.max_missed_pongs:
+                    self.evict(ws, MSG_PONG_TIMEOUT)
+                    return False
+
+        self.wheel.schedule(ws, self.check_interval)
+
+        return self.interval is not None
+
+    def ping(self, connections):
+        """
+        Ping `connections` from a greenlet of the pool, so that sockets that
+        are backed up don't hold up the ticks.
+        """
+        if self.pool.full():
+            return
+
+        now = monotonic()
+        pings = []
+
+        for ws in connections:
+            self.sequence += 1
+            ws.ping_payload = _pack_Q(self.sequence)
+            ws.ping_sent = now
+            pings.append((ws, ws.ping_payload))
+
+        self.pool.spawn(_ping_all, pings)
+
+    def evict(self, ws, reason):
+        # Don't wait for long on a peer that doesn't read either
+        gevent.spawn_raw(ws.evict, CLOSE_CODE, reason, CLOSE_TIMEOUT)
+
+
+def _ping_all(pings):
+    for ws, payload in pings:
+        if ws.closed:
+            continue
+
+        try:
+            ws.write_frame(True, ws.OPCODE_PING, payload)
+        except WebSocketError:
+            pass
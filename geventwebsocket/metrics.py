@@ -0,0 +1,356 @@
+"""
+Counters and histograms of a `WebSocketServer`.
+
+Everything is aggregated as it happens: updating a metric is an integer
+addition or two, and reading them out costs the same whether the server has
+ten connections or fifty thousand. `Metrics.snapshot` returns them as a dict,
+`MetricsApp` serves them in the Prometheus text format::
+
+    metrics = Metrics()
+    server = WebSocketServer(('', 8000), Resource(OrderedDict([
+        ('^/metrics$', MetricsApp(metrics)),
+        ('^/chat', ChatApplication)])), metrics=metrics)
+"""
+from bisect import bisect_left
+
+from ._compat import iteritems
+
+__all__ = ('Metrics', 'MetricsApp', 'Histogram')
+
+# Upper bounds of the handshake latency buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10)
+
+# Upper bounds of the message size buckets, in octets
+SIZE_BUCKETS = tuple(64 * 4 ** i for i in range(10))
+
+OPCODE_NAMES = {
+    0x0: 'continuation',
+    0x1: 'text',
+    0x2: 'binary',
+    0x8: 'close',
+    0x9: 'ping',
+    0xA: 'pong',
+}
+
+OPCODES = dict((name, opcode) for opcode, name in iteritems(OPCODE_NAMES))
+
+# Close code used when a close frame doesn't contain one, see RFC 6455 7.4.1
+NO_STATUS_CODE = 1005
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram(object):
+    """
+    Counts observations in buckets by their upper bound, like a Prometheus
+    histogram. The counts aren't cumulative, observations larger than the
+    last bound go in an extra bucket.
+    """
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, snapshot):
+        """
+        Add the observations of a `snapshot` of a histogram with the same
+        buckets.
+        """
+        for index, (_, count) in enumerate(snapshot['buckets']):
+            self.counts[index] += count
+
+        self.sum += snapshot['sum']
+        self.count += snapshot['count']
+
+    def snapshot(self):
+        return {
+            'buckets': list(zip(self.buckets + (float('inf'),), self.counts)),
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+class Metrics(object):
+    """
+    The metrics of a server, `WebSocketServer.metrics`.
+
+    Frames and octets are counted per opcode, octets being the payload as
+    sent over the wire, compressed or not.
+
+    :ivar connections: The number of open websocket connections.
+    :ivar handshakes_accepted: The number of successful upgrades.
+    :ivar handshakes_rejected: The number of upgrades refused, for being
+        invalid or over a limit.
+    """
+
+    __slots__ = ('connections', 'handshakes_accepted', 'handshakes_rejected',
+                 'frames_in', 'frames_out', 'bytes_in', 'bytes_out',
+                 'deflate_in', 'deflate_out', 'inflate_in', 'inflate_out',
+                 'close_codes_in', 'close_codes_out', 'handshake_latency',
+                 'message_size_in', 'message_size_out')
+
+    def __init__(self):
+        self.connections = 0
+        self.handshakes_accepted = 0
+        self.handshakes_rejected = 0
+
+        # By opcode
+        self.frames_in = [0] * 16
+        self.frames_out = [0] * 16
+        self.bytes_in = [0] * 16
+        self.bytes_out = [0] * 16
+
+        # Octets before and after compression of outgoing messages, and
+        # before and after decompression of incoming ones
+        self.deflate_in = 0
+        self.deflate_out = 0
+        self.inflate_in = 0
+        self.inflate_out = 0
+
+        # By close code
+        self.close_codes_in = {}
+        self.close_codes_out = {}
+
+        self.handshake_latency = Histogram(LATENCY_BUCKETS)
+        self.message_size_in = Histogram(SIZE_BUCKETS)
+        self.message_size_out = Histogram(SIZE_BUCKETS)
+
+    def frame_in(self, opcode, size):
+        self.frames_in[opcode] += 1
+        self.bytes_in[opcode] += size
+
+    def frame_out(self, opcode, size):
+        self.frames_out[opcode] += 1
+        self.bytes_out[opcode] += size
+
+    def deflated(self, size, compressed_size):
+        self.deflate_in += size
+        self.deflate_out += compressed_size
+
+    def inflated(self, compressed_size, size):
+        self.inflate_in += compressed_size
+        self.inflate_out += size
+
+    def close_in(self, code):
+        codes = self.close_codes_in
+        codes[code] = codes.get(code, 0) + 1
+
+    def close_out(self, code):
+        codes = self.close_codes_out
+        codes[code] = codes.get(code, 0) + 1
+
+    def snapshot(self):
+        """
+        :returns: All metrics as a dict of plain values.
+        """
+        return {
+            'connections': self.connections,
+            'handshakes': {
+                'accepted': self.handshakes_accepted,
+                'rejected': self.handshakes_rejected,
+            },
+            'frames': {
+                'in': _by_opcode(self.frames_in),
+                'out': _by_opcode(self.frames_out),
+            },
+            'bytes': {
+                'in': _by_opcode(self.bytes_in),
+                'out': _by_opcode(self.bytes_out),
+            },
+            'compression': {
+                'deflate_in': self.deflate_in,
+                'deflate_out': self.deflate_out,
+                'inflate_in': self.inflate_in,
+                'inflate_out': self.inflate_out,
+            },
+            'close_codes': {
+                'in': dict(self.close_codes_in),
+                'out': dict(self.close_codes_out),
+            },
+            'handshake_latency': self.handshake_latency.snapshot(),
+            'message_size': {
+                'in': self.message_size_in.snapshot(),
+                'out': self.message_size_out.snapshot(),
+            },
+        }
+
+    def merge(self, snapshot):
+        """
+        Add the values of a `snapshot`, e.g. of a `Metrics` in another
+        process, see `PreforkServer`. It may have been through JSON.
+        """
+        self.connections += snapshot['connections']
+        self.handshakes_accepted += snapshot['handshakes']['accepted']
+        self.handshakes_rejected += snapshot['handshakes']['rejected']
+
+        for name, counts_in, counts_out in (
+                ('frames', self.frames_in, self.frames_out),
+                ('bytes', self.bytes_in, self.bytes_out)):
+            for direction, counts in (('in', counts_in), ('out', counts_out)):
+                for opcode, value in iteritems(snapshot[name][direction]):
+                    counts[_opcode(opcode)] += value
+
+        compression = snapshot['compression']
+        self.deflate_in += compression['deflate_in']
+        self.deflate_out += compression['deflate_out']
+        self.inflate_in += compression['inflate_in']
+        self.inflate_out += compression['inflate_out']
+
+        for direction, codes in (('in', self.close_codes_in),
+                                 ('out', self.close_codes_out)):
+            for code, value in iteritems(snapshot['close_codes'][direction]):
+                code = int(code)
+                codes[code] = codes.get(code, 0) + value
+
+        self.handshake_latency.merge(snapshot['handshake_latency'])
+        self.message_size_in.merge(snapshot['message_size']['in'])
+        self.message_size_out.merge(snapshot['message_size']['out'])
+
+    def prometheus(self, prefix='geventwebsocket'):
+        """
+        :returns: All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+
+        def metric(name, kind, help, samples):
+            name = prefix + '_' + name
+            lines.append('# HELP {0} {1}'.format(name, help))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+
+            for suffix, labels, value in samples:
+                lines.append('{0}{1}{2} {3}'.format(
+                    name, suffix, _labels(labels), _value(value)))
+
+        metric('connections', 'gauge', 'Open websocket connections.',
+               [('', (), self.connections)])
+
+        metric('handshakes_total', 'counter', 'Websocket upgrades.', [
+            ('', (('result', 'accepted'),), self.handshakes_accepted),
+            ('', (('result', 'rejected'),), self.handshakes_rejected)])
+
+        for name, help, counts_in, counts_out in (
+                ('frames_total', 'Frames by opcode.',
+                 self.frames_in, self.frames_out),
+                ('bytes_total', 'Frame payload octets by opcode.',
+                 self.bytes_in, self.bytes_out)):
+            samples = []
+
+            for direction, counts in (('in', counts_in), ('out', counts_out)):
+                for opcode, value in sorted(iteritems(_by_opcode(counts))):
+                    samples.append(('', (('direction', direction),
+                                         ('opcode', opcode)), value))
+
+            metric(name, 'counter', help, samples)
+
+        metric('compression_bytes_total', 'counter',
+               'Octets of compressed messages before and after '
+               '(de)compression.', [
+                   ('', (('direction', 'out'), ('stage', 'uncompressed')),
+                    self.deflate_in),
+                   ('', (('direction', 'out'), ('stage', 'compressed')),
+                    self.deflate_out),
+                   ('', (('direction', 'in'), ('stage', 'compressed')),
+                    self.inflate_in),
+                   ('', (('direction', 'in'), ('stage', 'uncompressed')),
+                    self.inflate_out)])
+
+        samples = []
+
+        for direction, codes in (('in', self.close_codes_in),
+                                 ('out', self.close_codes_out)):
+            for code, value in sorted(iteritems(codes)):
+                samples.append(('', (('direction', direction),
+                                     ('code', code)), value))
+
+        metric('close_codes_total', 'counter', 'Close frames by code.',
+               samples)
+
+        metric('handshake_duration_seconds', 'histogram',
+               'Time from the start of the request to the upgrade.',
+               _histogram(self.handshake_latency, ()))
+
+        metric('message_size_bytes', 'histogram', 'Message sizes.',
+               _histogram(self.message_size_in, (('direction', 'in'),)) +
+               _histogram(self.message_size_out, (('direction', 'out'),)))
+
+        lines.append('')
+
+        return '\n'.join(lines)
+
+
+class MetricsApp(object):
+    """
+    A WSGI application serving `metrics` in the Prometheus text format, to be
+    mounted in a `Resource` or any other WSGI router.
+
+    :param metrics: A `Metrics`, or a callable returning the `Metrics` to
+        serve, e.g. the added up metrics of `PreforkServer`.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def __call__(self, environ, start_response):
+        metrics = self.metrics
+
+        if callable(metrics):
+            metrics = metrics()
+
+        body = metrics.prometheus().encode('utf-8')
+
+        start_response('200 OK', [
+            ('Content-Type', CONTENT_TYPE),
+            ('Content-Length', str(len(body)))])
+
+        return [body]
+
+
+def _by_opcode(counts):
+    return dict((OPCODE_NAMES.get(opcode, str(opcode)), value)
+                for opcode, value in enumerate(counts) if value)
+
+
+def _opcode(name):
+    opcode = OPCODES.get(name)
+
+    return int(name) if opcode is None else opcode
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+
+    return '{' + ','.join('{0}="{1}"'.format(name, value)
+                          for name, value in labels) + '}'
+
+
+def _value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _histogram(histogram, labels):
+    samples = []
+    total = 0
+
+    for bound, count in zip(histogram.buckets + (float('inf'),),
+                            histogram.counts):
+        total += count
+        samples.append(('_bucket', labels + (('le', _value(bound)),), total))
+
+    samples.append(('_sum', labels, histogram.sum))
+    samples.append(('_count', labels, histogram.count))
+
+    return samples
@@ -0,0 +1,454 @@
+"""
+Pre-fork multi-process mode of `WebSocketServer`.
+
+A master process forks `workers` processes that each run a `WebSocketServer`
+of their own. Where the OS supports ``SO_REUSEPORT`` every worker binds its
+own listening socket to the same port, so that the kernel spreads incoming
+connections across them, otherwise they accept from one inherited socket.
+Workers can be pinned to a CPU each. The master restarts workers that exit
+and adds up the `Metrics` they report::
+
+    server = PreforkServer(('', 8000), app, workers=8, pin_cpus=True,
+                           metrics_listener=('127.0.0.1', 9100))
+    server.serve_forever()
+
+Connections aren't shared between workers, so the number of connections and
+handshakes per second a box can serve grows with its cores. State kept in
+the server, like `WebSocketServer.clients`, is per worker. With
+``backplane=True`` the master runs a `Broker` that the workers attach to, so
+that `WebSocketServer.broadcast` and WAMP channels reach the clients of all
+workers.
+"""
+import json
+import logging
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import traceback
+from functools import partial
+
+import gevent
+from gevent import socket
+from gevent.event import Event
+from gevent.queue import Queue
+from gevent.os import fork_and_watch, make_nonblocking, nb_read, nb_write
+from gevent.pywsgi import WSGIServer
+
+from ._compat import monotonic, string_types
+from .metrics import Metrics, MetricsApp
+from .server import WebSocketServer
+
+__all__ = ('PreforkServer',)
+
+logger = logging.getLogger(__name__)
+
+REUSE_PORT = hasattr(socket, 'SO_REUSEPORT')
+
+BACKLOG = 1024
+
+# Seconds between the metrics reports of workers
+METRICS_INTERVAL = 1.0
+
+# Workers that exit within `MIN_UPTIME` seconds of being started are
+# restarted after `RESTART_DELAY` seconds, rather than right away
+MIN_UPTIME = 1.0
+RESTART_DELAY = 1.0
+
+# Seconds between checks of a worker whether the master is still alive
+PARENT_CHECK_INTERVAL = 1.0
+
+signal_handler = getattr(gevent, 'signal_handler', None) or gevent.signal
+
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+
+
+def available_cpus():
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return None
+
+
+def create_listener(address, reuse_port=False, listen=True, backlog=BACKLOG):
+    family = socket.AF_INET6 if ':' in address[0] else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+        sock.bind(address)
+
+        if listen:
+            sock.listen(backlog)
+    except Exception:
+        sock.close()
+        raise
+
+    return sock
+
+
+class Worker(object):
+    """
+    The master's view of a worker process.
+    """
+
+    __slots__ = ('index', 'cpu', 'pid', 'started', 'snapshot', 'reader')
+
+    def __init__(self, index, cpu=None):
+        self.index = index
+        self.cpu = cpu
+        self.pid = None
+        self.started = None
+        # The last metrics report, and the greenlet reading them
+        self.snapshot = None
+        self.reader = None
+
+
+class PreforkServer(object):
+    """
+    Serves `application` from `workers` processes.
+
+    :param listener: The ``(host, port)`` to listen on, port 0 picks a free
+        one, see `address`.
+    :param workers: The number of worker processes, by default one per
+        available CPU.
+    :param pin_cpus: Whether to pin every worker to a CPU of its own, or a
+        list of CPUs to pin the workers to in turn. Ignored where the OS
+        doesn't support it.
+    :param reuse_port: Whether workers bind their own sockets with
+        ``SO_REUSEPORT``, by default where available.
+    :param metrics_listener: The ``(host, port)`` the master serves the
+        added up metrics of the workers on, in the Prometheus text format.
+    :param backplane: Whether to run a `Broker` in the master and attach the
+        servers of the workers to it with a `UnixBackplane`, or the path of
+        the broker's socket. By default it goes in a temporary directory.
+    :param server_class: The server the workers run.
+    :param kwargs: Passed on to `server_class`.
+    """
+
+    def __init__(self, listener, application, workers=None, pin_cpus=False,
+                 reuse_port=None, metrics_listener=None, backplane=False,
+                 server_class=WebSocketServer,
+                 metrics_interval=METRICS_INTERVAL, **kwargs):
+        self.application = application
+        self.server_class = server_class
+        self.kwargs = kwargs
+        self.metrics_interval = metrics_interval
+
+        if reuse_port is None:
+            reuse_port = REUSE_PORT
+
+        self.reuse_port = reuse_port
+
+        # With SO_REUSEPORT the master only holds on to the port, otherwise
+        # the workers accept from its socket
+        self.socket = create_listener(listener, reuse_port,
+                                      listen=not reuse_port)
+        self.address = self.socket.getsockname()
+
+        if pin_cpus is True:
+            pin_cpus = available_cpus()
+
+        cpus = list(pin_cpus or ()) if hasattr(os, 'sched_setaffinity') \
+            else []
+
+        self.workers = [
+            Worker(index, cpus[index % len(cpus)] if cpus else None)
+            for index in range(workers or cpu_count())]
+
+        # The metrics of workers that exited, their connections excepted
+        self.retired = Metrics()
+
+        self.metrics_listener = metrics_listener
+        self.metrics_server = None
+
+        # The workers only keep metrics for the master to serve
+        if metrics_listener is not None:
+            kwargs.setdefault('metrics', True)
+
+        self.broker = None
+        self.broker_dir = None
+
+        if backplane is True:
+            self.broker_dir = tempfile.mkdtemp(prefix='geventwebsocket-')
+            backplane = os.path.join(self.broker_dir, 'backplane.sock')
+
+        if isinstance(backplane, string_types):
+            from .backplane import Broker
+            self.broker = Broker(backplane)
+
+        self.master_pid = None
+        self.signal_handlers = []
+        # Workers to restart, see `serve_forever`
+        self.restarts = Queue()
+        self.stopping = False
+        self.stopped = Event()
+
+    @property
+    def server_port(self):
+        return self.address[1]
+
+    @property
+    def metrics(self):
+        """
+        :returns: The `Metrics` of all workers added up, as last reported.
+        """
+        metrics = Metrics()
+        metrics.merge(self.retired.snapshot())
+
+        for worker in self.workers:
+            if worker.snapshot is not None:
+                metrics.merge(worker.snapshot)
+
+        return metrics
+
+    def start(self):
+        """
+        Fork the workers and return. Workers are only restarted by
+        `serve_forever`.
+        """
+        self.master_pid = os.getpid()
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            self.signal_handlers.append(signal_handler(signum, self.stop))
+
+        if self.metrics_listener is not None:
+            self.metrics_server = WSGIServer(
+                self.metrics_listener, MetricsApp(lambda: self.metrics),
+                log=None)
+            self.metrics_server.start()
+
+        if self.broker is not None:
+            self.broker.start()
+
+        for worker in self.workers:
+            self.spawn(worker)
+
+    def serve_forever(self):
+        """
+        Start the workers and supervise them until `stop` is called, or the
+        master receives ``SIGTERM`` or ``SIGINT``.
+
+        Workers are forked from the greenlet calling this, and greenlets
+        spawned before carry on running in them as well. It should be called
+        from the main greenlet, before anything else is spawned.
+        """
+        if self.master_pid is None:
+            self.start()
+
+        while True:
+            worker = self.restarts.get()
+
+            if worker is None:
+                break
+
+            self.spawn(worker)
+
+        self.stopped.wait()
+
+    def stop(self, timeout=10):
+        """
+        Stop the workers, giving them `timeout` seconds to close their
+        connections before they are killed.
+        """
+        if self.stopping:
+            return
+
+        self.stopping = True
+        self.restarts.put(None)
+
+        for handler in self.signal_handlers:
+            handler.cancel()
+
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+
+        self.kill_workers(signal.SIGTERM)
+
+        deadline = monotonic() + timeout
+
+        while self.running() and monotonic() < deadline:
+            gevent.sleep(0.05)
+
+        self.kill_workers(signal.SIGKILL)
+
+        while self.running():
+            gevent.sleep(0.05)
+
+        if self.broker is not None:
+            self.broker.stop()
+
+        if self.broker_dir is not None:
+            shutil.rmtree(self.broker_dir, ignore_errors=True)
+
+        self.socket.close()
+        self.stopped.set()
+
+    def running(self):
+        return any(worker.pid is not None for worker in self.workers)
+
+    def kill_workers(self, signum):
+        for worker in self.workers:
+            if worker.pid is not None:
+                try:
+                    os.kill(worker.pid, signum)
+                except OSError:
+                    pass
+
+    def spawn(self, worker):
+        if self.stopping:
+            return
+
+        read_fd, write_fd = os.pipe()
+        pid = fork_and_watch(partial(self.worker_exited, worker))
+
+        if not pid:
+            os.close(read_fd)
+            self.run_worker(worker, write_fd)
+
+        os.close(write_fd)
+        make_nonblocking(read_fd)
+
+        worker.pid = pid
+        worker.started = monotonic()
+        worker.snapshot = None
+        worker.reader = gevent.spawn(self.read_reports, worker, pid, read_fd)
+
+        logger.debug("Started worker %d (pid %d)", worker.index, pid)
+
+    def worker_exited(self, worker, watcher):
+        status = watcher.rstatus
+        uptime = monotonic() - worker.started
+
+        # The counters of the worker keep counting, its connections are gone
+        if worker.snapshot is not None:
+            worker.snapshot['connections'] = 0
+            self.retired.merge(worker.snapshot)
+
+        worker.pid = None
+        worker.snapshot = None
+        worker.reader = None
+
+        if self.stopping:
+            return
+
+        if os.WIFSIGNALED(status):
+            logger.warning("Worker %d (pid %d) was killed by signal %d, "
+                           "restarting it", worker.index, watcher.rpid,
+                           os.WTERMSIG(status))
+        else:
+            logger.warning("Worker %d (pid %d) exited with code %d, "
+                           "restarting it", worker.index, watcher.rpid,
+                           os.WEXITSTATUS(status))
+
+        if uptime < MIN_UPTIME:
+            gevent.spawn_later(RESTART_DELAY, self.restarts.put, worker)
+        else:
+            self.restarts.put(worker)
+
+    def read_reports(self, worker, pid, fd):
+        buf = b''
+
+        try:
+            # Until the worker exits and the pipe is closed
+            while True:
+                data = nb_read(fd, 65536)
+
+                if not data:
+                    return
+
+                buf += data
+
+                # Only the latest complete report matters, and only as long
+                # as the worker runs
+                if b'\n' in buf and worker.pid == pid:
+                    lines = buf.split(b'\n')
+                    buf = lines[-1]
+                    worker.snapshot = json.loads(lines[-2].decode('utf-8'))
+        finally:
+            os.close(fd)
+
+    def run_worker(self, worker, report_fd):
+        """
+        The body of a worker process, never returns.
+        """
+        status = 0
+
+        try:
+            # The greenlets and signal handlers of the master were inherited
+            # with its event loop
+            for handler in self.signal_handlers:
+                handler.cancel()
+
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+            gevent.killall([other.reader for other in self.workers
+                            if other.reader is not None])
+
+            if self.metrics_server is not None:
+                self.metrics_server.close()
+
+            kwargs = dict(self.kwargs)
+
+            if self.broker is not None:
+                from .backplane import UnixBackplane
+                self.broker.close()
+                kwargs['backplane'] = UnixBackplane(self.broker.path)
+
+            if worker.cpu is not None:
+                os.sched_setaffinity(0, [worker.cpu])
+
+            if self.reuse_port:
+                self.socket.close()
+                listener = create_listener(self.address, True)
+            else:
+                listener = self.socket
+
+            server = self.server_class(listener, self.application, **kwargs)
+
+            signal_handler(signal.SIGTERM, server.stop)
+            gevent.spawn(self.watch_master, server)
+
+            if getattr(server, 'metrics', None) is not None:
+                make_nonblocking(report_fd)
+                gevent.spawn(self.report, server.metrics, report_fd)
+
+            server.serve_forever()
+        except SystemExit as error:
+            status = error.code or 0
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(status)
+
+    def watch_master(self, server):
+        # Stop if the master died without stopping its workers
+        while os.getppid() == self.master_pid:
+            gevent.sleep(PARENT_CHECK_INTERVAL)
+
+        server.stop()
+
+    def report(self, metrics, fd):
+        while True:
+            data = json.dumps(metrics.snapshot()).encode('utf-8') + b'\n'
+
+            while data:
+                data = data[nb_write(fd, data):]
+
+            gevent.sleep(self.metrics_interval)
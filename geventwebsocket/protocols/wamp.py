@@ -11,8 +11,8 @@ except ImportError:
     except ImportError:
         import json
 
-from .._compat import range_type, string_types
-from ..exceptions import WebSocketError
+from .._compat import iteritems, range_type, string_types
+from ..websocket import PreparedMessage
 from .base import BaseProtocol
 
 
@@ -74,44 +74,371 @@ class RemoteProcedures(object):
             raise Exception("no such uri '{}'".format(uri))
 
 
+# The backplane topics events are published to other processes on: one per
+# topic with subscribers, and one per prefix channel with wildcard subscribers
+BACKPLANE_TOPIC = 'geventwebsocket.wamp {0}'
+BACKPLANE_PREFIX_TOPIC = 'geventwebsocket.wamp* {0}'
+
+# Subscriptions to a URI ending in this receive the events of every topic
+# starting with the rest of it
+WILDCARD = '*'
+
+# The trie keys of a prefix channel, and of the wildcard subscribers, whose
+# URI ends at a node. No character is longer than one.
+_PREFIX_CHANNEL = ''
+_SUBSCRIBERS = 'subscribers'
+
+
 class Channels(object):
-    def __init__(self):
+    """
+    The WAMP pubsub channels of a server.
+
+    The subscribers of a channel are kept by session id, so that
+    subscribing and unsubscribing take constant time, and the `exclude` and
+    `eligible` session ids of an event are looked up rather than searched.
+
+    A channel created with `prefix_matching` accepts subscriptions to any
+    topic its URI is a prefix of. Within those, a subscription to a URI
+    ending in ``*`` receives the events of every topic starting with the
+    rest of it. Both are indexed in a trie of URIs, so that they are found
+    in time proportional to the length of a topic, whatever the number of
+    channels.
+
+    Given a backplane, events are published to the other processes attached
+    to it as well, see `geventwebsocket.backplane`. A process subscribes to
+    the backplane topic of every topic its clients subscribed to, and to the
+    topic of every prefix channel its clients subscribed to wildcards of, so
+    that it only receives the events it delivers.
+    """
+
+    def __init__(self, backplane=None):
+        # uri -> {session id: client}
         self.channels = {}
+        # The URIs of the channels created rather than subscribed to under a
+        # prefix channel, which stay when their last subscriber leaves
+        self.created = set()
+        self.trie = {}
+        # session id -> subscribed URIs
+        self.sessions = {}
+        self.backplane = backplane
+        # backplane topic -> the number of subscriptions it is kept for
+        self.backplane_topics = {}
 
     def create(self, uri, prefix_matching=False):
-        if uri not in self.channels:
-            self.channels[uri] = []
+        if prefix_matching:
+            self._node(uri, True)[_PREFIX_CHANNEL] = True
+        elif uri not in self.created:
+            self.created.add(uri)
+            self.channels.setdefault(uri, {})
+
+    def is_allowed(self, uri):
+        """
+        :returns: Whether `uri` may be subscribed to, as a topic or a
+            wildcard.
+        """
+        if uri in self.created:
+            return True
+
+        node = self.trie
+
+        for char in uri:
+            if _PREFIX_CHANNEL in node:
+                return True
+
+            node = node.get(char)
+
+            if node is None:
+                return False
+
+        return _PREFIX_CHANNEL in node
+
+    def subscribe(self, uri, client, session_id=None):
+        """
+        Subscribe `client` to the topic `uri`, or to all topics it is a
+        prefix of if it ends in ``*``.
+
+        :param session_id: The WAMP session id of the client, which
+            `exclude` and `eligible` refer to. The client itself if `None`.
+        :returns: Whether the channel exists.
+        """
+        if not self.is_allowed(uri):
+            return False
+
+        key = client if session_id is None else session_id
+
+        if uri.endswith(WILDCARD):
+            subscribers = self._node(uri[:-1], True).setdefault(
+                _SUBSCRIBERS, {})
+            topic = self._prefix_topic(uri[:-1])
+        else:
+            subscribers = self.channels.setdefault(uri, {})
+            # Kept while the channel has subscribers
+            topic = None if subscribers else BACKPLANE_TOPIC.format(uri)
+
+        if key not in subscribers and topic is not None:
+            self._attach(topic)
+
+        subscribers[key] = client
+        self.sessions.setdefault(key, set()).add(uri)
+
+        return True
+
+    def unsubscribe(self, uri, client, session_id=None):
+        key = client if session_id is None else session_id
+        uris = self.sessions.get(key)
+
+        if uris is not None:
+            uris.discard(uri)
 
-        # TODO: implement prefix matching
+            if not uris:
+                del self.sessions[key]
 
-    def subscribe(self, uri, client):
-        if uri in self.channels:
-            self.channels[uri].append(client)
+        self._remove(uri, key)
+
+    def unsubscribe_all(self, client, session_id=None):
+        """
+        Unsubscribe `client` from every topic, e.g. when it disconnects.
+        """
+        key = client if session_id is None else session_id
+
+        for uri in self.sessions.pop(key, ()):
+            self._remove(uri, key)
+
+    def _remove(self, uri, key):
+        if not uri.endswith(WILDCARD):
+            subscribers = self.channels.get(uri)
+
+            if subscribers is not None and key in subscribers:
+                del subscribers[key]
+
+                if not subscribers:
+                    self._detach(BACKPLANE_TOPIC.format(uri))
+
+                    if uri not in self.created:
+                        del self.channels[uri]
 
-    def unsubscribe(self, uri, client):
-        if uri not in self.channels:
             return
 
-        client_index = self.channels[uri].index(client)
-        self.channels[uri].pop(client_index)
+        # Remove the subscriber, and the nodes it leaves empty
+        prefix = uri[:-1]
+        path = [self.trie]
 
-        if len(self.channels[uri]) == 0:
-            del self.channels[uri]
+        for char in prefix:
+            node = path[-1].get(char)
 
-    def publish(self, uri, event, exclude=None, eligible=None):
-        if uri not in self.channels:
+            if node is None:
+                return
+
+            path.append(node)
+
+        subscribers = path[-1].get(_SUBSCRIBERS)
+
+        if subscribers is None or key not in subscribers:
+            return
+
+        del subscribers[key]
+        topic = self._prefix_topic(prefix)
+
+        if topic is not None:
+            self._detach(topic)
+
+        if not subscribers:
+            del path[-1][_SUBSCRIBERS]
+
+        for depth in range_type(len(prefix), 0, -1):
+            if path[depth]:
+                break
+
+            del path[depth - 1][prefix[depth - 1]]
+
+    def _node(self, prefix, create=False):
+        node = self.trie
+
+        for char in prefix:
+            child = node.get(char)
+
+            if child is None:
+                if not create:
+                    return None
+
+                child = node[char] = {}
+
+            node = child
+
+        return node
+
+    def _prefix_channels(self, uri):
+        """
+        :returns: The URIs of the prefix channels `uri` starts with, shortest
+            first.
+        """
+        found = []
+        node = self.trie
+
+        for index, char in enumerate(uri):
+            if _PREFIX_CHANNEL in node:
+                found.append(uri[:index])
+
+            node = node.get(char)
+
+            if node is None:
+                return found
+
+        if _PREFIX_CHANNEL in node:
+            found.append(uri)
+
+        return found
+
+    def _prefix_topic(self, prefix):
+        """
+        :returns: The backplane topic of the wildcard subscriptions to
+            `prefix`, that of the shortest prefix channel it starts with.
+        """
+        channels = self._prefix_channels(prefix)
+
+        if channels:
+            return BACKPLANE_PREFIX_TOPIC.format(channels[0])
+
+        return None
+
+    def _attach(self, topic):
+        if self.backplane is None:
             return
 
-        # TODO: exclude & eligible
+        count = self.backplane_topics.get(topic, 0)
+        self.backplane_topics[topic] = count + 1
+
+        if not count:
+            self.backplane.subscribe(topic, self._receive)
+
+    def _detach(self, topic):
+        count = self.backplane_topics.get(topic)
+
+        if count is None:
+            return
+
+        if count > 1:
+            self.backplane_topics[topic] = count - 1
+        else:
+            del self.backplane_topics[topic]
+            self.backplane.unsubscribe(topic, self._receive)
+
+    def publish(self, uri, event, exclude=None, eligible=None):
+        """
+        Send an event to the subscribers of `uri`, in all processes attached
+        to the backplane.
+
+        :param exclude: Session ids not to send the event to.
+        :param eligible: The session ids to send the event to, if not all.
+        """
+        message = serialize([WampProtocol.MSG_EVENT, uri, event])
 
-        msg = [WampProtocol.MSG_EVENT, uri, event]
+        if self.backplane is not None:
+            topics = [BACKPLANE_TOPIC.format(uri)] + [
+                BACKPLANE_PREFIX_TOPIC.format(prefix)
+                for prefix in self._prefix_channels(uri)]
+            # The event is serialized once, the other processes only parse
+            # the envelope
+            payload = serialize(
+                [uri, topics, exclude, eligible, message]).encode('utf-8')
 
-        for client in self.channels[uri]:
-            try:
-                client.ws.send(serialize(msg))
-            except WebSocketError:
-                # Seems someone didn't unsubscribe before disconnecting
-                self.channels[uri].remove(client)
+            for topic in topics:
+                self.backplane.publish(topic, payload, exclude=self._receive)
+
+        return self.deliver(uri, message, exclude, eligible)
+
+    def _receive(self, topic, payload):
+        uri, topics, exclude, eligible, message = json.loads(
+            payload.decode('utf-8'))
+
+        # A process subscribed to more than one of the topics of an event
+        # delivers it for the first
+        for other in topics:
+            if other in self.backplane_topics:
+                if other == topic:
+                    self.deliver(uri, message, exclude, eligible)
+
+                return
+
+    def subscribers(self, uri):
+        """
+        :returns: The ``{session id: client}`` dicts of the subscriptions
+            that match the topic `uri`.
+        """
+        found = []
+        channel = self.channels.get(uri)
+
+        if channel:
+            found.append(channel)
+
+        node = self.trie
+
+        for char in uri:
+            wildcard = node.get(_SUBSCRIBERS)
+
+            if wildcard:
+                found.append(wildcard)
+
+            node = node.get(char)
+
+            if node is None:
+                break
+        else:
+            wildcard = node.get(_SUBSCRIBERS)
+
+            if wildcard:
+                found.append(wildcard)
+
+        return found
+
+    def deliver(self, uri, message, exclude=None, eligible=None):
+        """
+        Queue a serialized event `message` for the subscribers of `uri` in
+        this process, see `Client.enqueue`.
+
+        :returns: The number of clients the event was queued for.
+        """
+        found = self.subscribers(uri)
+
+        if not found:
+            return 0
+
+        if eligible is not None:
+            # Usually a handful of sessions, rather than all subscribers
+            found = [dict((key, subscribers[key]) for key in eligible
+                          if key in subscribers) for subscribers in found]
+
+        excluded = set(exclude) if exclude else ()
+        # A client may match through more than one subscription
+        seen = set() if len(found) > 1 else None
+        msg = None
+        queued = 0
+        dead = []
+
+        for subscribers in found:
+            for key, client in iteritems(subscribers):
+                if key in excluded:
+                    continue
+
+                if seen is not None:
+                    if key in seen:
+                        continue
+
+                    seen.add(key)
+
+                if msg is None:
+                    msg = PreparedMessage(message)
+
+                if client.enqueue(msg):
+                    queued += 1
+                elif client.ws is None or client.ws.closed:
+                    # Seems someone didn't unsubscribe before disconnecting
+                    dead.append(key)
+
+        for key in dead:
+            self.unsubscribe_all(None, key)
+
+        return queued
 
 
 class WampProtocol(BaseProtocol):
@@ -131,7 +458,7 @@ class WampProtocol(BaseProtocol):
         self.procedures = RemoteProcedures()
         self.prefixes = Prefixes()
         self.session_id = ''.join(
-            [random.choice(string.digits + string.letters)
+            [random.choice(string.digits + string.ascii_letters)
                 for i in range_type(16)])
 
         super(WampProtocol, self).__init__(*args, **kwargs)
@@ -144,7 +471,8 @@ class WampProtocol(BaseProtocol):
 
     def register_pubsub(self, *args, **kwargs):
         if not hasattr(self.server, 'channels'):
-            self.server.channels = Channels()
+            self.server.channels = Channels(
+                getattr(self.server, 'backplane', None))
 
         self.server.channels.create(*args, **kwargs)
 
@@ -197,23 +525,39 @@ class WampProtocol(BaseProtocol):
         uri = self.prefixes.resolve(curie_or_uri)
 
         if action == self.MSG_SUBSCRIBE and len(data) == 2:
-            self.server.channels.subscribe(data[1], self.handler.active_client)
+            self.server.channels.subscribe(
+                uri, self.handler.active_client, self.session_id)
 
         elif action == self.MSG_UNSUBSCRIBE and len(data) == 2:
             self.server.channels.unsubscribe(
-                data[1], self.handler.active_client)
+                uri, self.handler.active_client, self.session_id)
 
         elif action == self.MSG_PUBLISH and len(data) >= 3:
             payload = data[2] if len(data) >= 3 else None
             exclude = data[3] if len(data) >= 4 else None
             eligible = data[4] if len(data) >= 5 else None
 
+            # Either a list of session ids, or whether to exclude the
+            # publisher
+            if exclude is True:
+                exclude = [self.session_id]
+            elif exclude is False:
+                exclude = None
+
             self.server.channels.publish(uri, payload, exclude, eligible)
 
     def on_open(self):
         self.app.on_open()
         self.do_handshake()
 
+    def on_close(self, reason=None):
+        channels = getattr(self.server, 'channels', None)
+
+        if channels is not None:
+            channels.unsubscribe_all(None, self.session_id)
+
+        super(WampProtocol, self).on_close(reason)
+
     def on_message(self, message):
         data = json.loads(message)
 
@@ -1,8 +1,8 @@
-import re
 import warnings
 
 from .protocols.base import BaseProtocol
 from .exceptions import WebSocketError
+from .routing import Router
 
 try:
     from collections import OrderedDict
@@ -14,6 +14,18 @@ except ImportError:
 class WebSocketApplication(object):
     protocol_class = BaseProtocol
 
+    # Per route overrides of the `WebSocketHandler` settings, see
+    # `Resource.app_settings`
+    max_frame_size = None
+    max_message_size = None
+    deflate_max_window_bits = None
+    deflate_mem_level = None
+    deflate_no_context_takeover = None
+    compression_policy = None
+    # The number of concurrent connections to the route, on top of the
+    # server's `max_connections`
+    max_connections = None
+
     def __init__(self, ws):
         self.protocol = self.protocol_class(self)
         self.ws = ws
@@ -45,6 +57,9 @@ class WebSocketApplication(object):
 
 
 class Resource(object):
+    # The number of path lookups the router remembers, see `Router`
+    route_cache_size = 1024
+
     def __init__(self, apps=None):
         self.apps = apps if apps else []
 
@@ -54,7 +69,38 @@ class Resource(object):
                               "app list is discouraged and may lead to "
                               "undefined behavior.", UserWarning)
 
-            self.apps = apps.items()
+            self.apps = list(apps.items())
+
+        self._router = None
+        # The routes `_router` was compiled from
+        self._routes = None
+
+    @property
+    def router(self):
+        # Compiled on first use, and again once `apps` changed. Unless it
+        # did, its items are the very same objects as the copy's, which
+        # makes the comparison cheap
+        apps = self._current_routes()
+
+        if self._router is None or apps != self._routes:
+            self._routes = apps[:]
+            self._router = Router(self._routes, self.route_cache_size)
+
+        return self._router
+
+    @router.setter
+    def router(self, router):
+        self._router = router
+        self._routes = self._current_routes()[:]
+
+    def _current_routes(self):
+        apps = self.apps
+
+        if isinstance(apps, (list, tuple)):
+            return apps
+
+        # E.g. the items of a dict assigned after `__init__`
+        return list(apps)
 
     # An app can either be a standard WSGI application (an object we call with
     # __call__(self, environ, start_response)) or a class we instantiate
@@ -64,13 +110,25 @@ class Resource(object):
     def _is_websocket_app(self, app):
         return isinstance(app, type) and issubclass(app, WebSocketApplication)
 
+    def _route_by_path(self, environ_path, is_websocket_request):
+        # Which route matched the current path?
+        if is_websocket_request:
+            accept = self._is_websocket_app
+        else:
+            accept = self._is_wsgi_app
+
+        return self.router.match(environ_path, is_websocket_request, accept)
+
+    def _is_wsgi_app(self, app):
+        return not self._is_websocket_app(app)
+
     def _app_by_path(self, environ_path, is_websocket_request):
-        # Which app matched the current path?
-        for path, app in self.apps:
-            if re.match(path, environ_path):
-                if is_websocket_request == self._is_websocket_app(app):
-                    return app
-        return None
+        return self._route_by_path(environ_path, is_websocket_request)[1]
+
+    def app_route(self, path):
+        # The route websocket connections to path are counted against, see
+        # `WebSocketApplication.max_connections`
+        return self._route_by_path(path, True)[0]
 
     def app_protocol(self, path):
         # app_protocol will only be called for websocket apps
@@ -81,6 +139,25 @@ class Resource(object):
         else:
             return ''
 
+    # The handler settings an app can override for its route
+    app_setting_names = ('max_frame_size', 'max_message_size',
+                         'deflate_max_window_bits', 'deflate_mem_level',
+                         'deflate_no_context_takeover', 'compression_policy',
+                         'max_connections')
+
+    def app_settings(self, path):
+        # app_settings will only be called for websocket apps
+        app = self._app_by_path(path, True)
+        settings = {}
+
+        for name in self.app_setting_names:
+            value = getattr(app, name, None)
+
+            if value is not None:
+                settings[name] = value
+
+        return settings
+
     def __call__(self, environ, start_response):
         environ = environ
         is_websocket_call = 'wsgi.websocket' in environ
@@ -0,0 +1,148 @@
+"""
+Path routing for `Resource`.
+
+Routes are regular expressions matched against the start of the path, in
+order. Instead of trying every one of them on every request, `Router`
+compiles the patterns once and indexes them in a trie by their literal
+prefix, so that a lookup only tries the routes that can possibly match.
+The results of recent lookups are kept in an LRU cache, the handshake and
+the application call of a connection look up the same path.
+"""
+import re
+
+from ._compat import string_types
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
+
+__all__ = ('Router', 'literal_prefix')
+
+_SPECIAL = frozenset('.^$*+?{}[]\\|()')
+_QUANTIFIERS = frozenset('?*{')
+
+# The trie key of the routes whose prefix ends at a node, no character is
+# empty
+_ROUTES = ''
+
+
+def literal_prefix(pattern):
+    """
+    :returns: The literal text every string matched by `pattern` (with
+        `re.match`) starts with, possibly empty.
+    """
+    if not isinstance(pattern, string_types) or '|' in pattern:
+        # Alternatives may not share a prefix
+        return ''
+
+    prefix = []
+    i = 1 if pattern.startswith('^') else 0
+    length = len(pattern)
+
+    while i < length:
+        char = pattern[i]
+        width = 1
+
+        if char == '\\':
+            char = pattern[i + 1:i + 2]
+            width = 2
+
+            # Character classes, anchors and back references
+            if not char or char.isalnum():
+                break
+        elif char in _SPECIAL:
+            break
+
+        # The character is optional
+        if pattern[i + width:i + width + 1] in _QUANTIFIERS:
+            break
+
+        prefix.append(char)
+        i += width
+
+    return ''.join(prefix)
+
+
+class Router(object):
+    """
+    Finds the first of a list of ``(pattern, app)`` routes that matches a
+    path, and for which `accept(app)` is true.
+
+    :param cache_size: The number of lookups to remember.
+    """
+
+    __slots__ = ('routes', 'trie', 'cache', 'cache_size')
+
+    def __init__(self, routes, cache_size=1024):
+        # (compiled pattern, pattern, app) in order
+        self.routes = []
+        self.trie = {}
+        self.cache = OrderedDict() if OrderedDict is not None else None
+        self.cache_size = cache_size
+
+        for index, (pattern, app) in enumerate(routes):
+            self.routes.append((re.compile(pattern), pattern, app))
+
+            node = self.trie
+
+            for char in literal_prefix(pattern):
+                node = node.setdefault(char, {})
+
+            node.setdefault(_ROUTES, []).append(index)
+
+    def candidates(self, path):
+        """
+        :returns: The indexes of the routes whose literal prefix `path`
+            starts with, in order.
+        """
+        node = self.trie
+        found = list(node.get(_ROUTES, ()))
+
+        for char in path:
+            node = node.get(char)
+
+            if node is None:
+                break
+
+            found.extend(node.get(_ROUTES, ()))
+
+        found.sort()
+
+        return found
+
+    def match(self, path, key=None, accept=None):
+        """
+        :param key: Distinguishes lookups of the same path with a different
+            `accept`, in the cache.
+        :returns: The ``(pattern, app)`` of the first matching route, or
+            ``(None, None)``.
+        """
+        cache = self.cache
+        cache_key = (path, key)
+
+        if cache is not None:
+            result = cache.pop(cache_key, None)
+
+            if result is not None:
+                # Most recently used
+                cache[cache_key] = result
+                return result
+
+        result = None, None
+        routes = self.routes
+
+        for index in self.candidates(path):
+            compiled, pattern, app = routes[index]
+
+            if compiled.match(path) and (accept is None or accept(app)):
+                result = pattern, app
+                break
+
+        if cache is not None:
+            cache[cache_key] = result
+
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+        return result
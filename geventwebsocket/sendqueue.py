@@ -0,0 +1,249 @@
+"""
+Buffered sending with watermarks, see `WebSocket.enable_buffering`.
+"""
+from collections import deque
+
+import gevent
+from gevent.event import Event
+
+from .exceptions import WebSocketError
+
+__all__ = ('SendQueue', 'BLOCK', 'DROP_OLDEST', 'DROP_NEWEST', 'CLOSE')
+
+# What to do with a message that would take the queue past its high
+# watermark
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+CLOSE = 'close'
+
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, CLOSE)
+
+MSG_OVERFLOW = "Send queue overflow"
+MSG_CLOSED = "Connection closed"
+
+# The close code of the `CLOSE` policy, policy violation
+CLOSE_CODE = 1008
+
+
+class SendQueue(object):
+    """
+    Queues the outgoing messages of a connection, a writer greenlet sends
+    them in order.
+
+    The queue holds (uncompressed) messages rather than frames, so that
+    dropping one never leaves the peer with a gap in its compression
+    context. A message is accounted for until it has been written.
+
+    :param high_water: The number of octets of payload, and...
+    :param high_water_messages: ... the number of messages queued, above
+        which `policy` applies. `None` means unlimited.
+    :param low_water: The number of octets of payload, and...
+    :param low_water_messages: ... the number of messages the queue must be
+        back to for blocked senders, and `wait_drained`, to continue.
+        Default to a quarter of the high watermarks.
+    :param policy: What to do with a message that doesn't fit: `BLOCK` the
+        sender until the queue is below its low watermarks, drop the oldest
+        queued messages (`DROP_OLDEST`), drop the new message
+        (`DROP_NEWEST`), or close the connection with code 1008 (`CLOSE`).
+
+    :ivar buffered_amount: The number of octets of payload queued.
+    :ivar dropped: The number of messages dropped by the policy.
+    """
+
+    __slots__ = ('ws', 'high_water', 'low_water', 'high_water_messages',
+                 'low_water_messages', 'policy', 'items', 'buffered_amount',
+                 'messages', 'dropped', 'drained', 'empty', 'ready', 'writer',
+                 'closing')
+
+    def __init__(self, ws, high_water=1024 * 1024, low_water=None,
+                 high_water_messages=None, low_water_messages=None,
+                 policy=BLOCK):
+        if policy not in POLICIES:
+            raise ValueError("Unknown policy {0!r}".format(policy))
+
+        if low_water is None and high_water is not None:
+            low_water = high_water // 4
+
+        if low_water_messages is None and high_water_messages is not None:
+            low_water_messages = high_water_messages // 4
+
+        self.ws = ws
+        self.high_water = high_water
+        self.low_water = low_water
+        self.high_water_messages = high_water_messages
+        self.low_water_messages = low_water_messages
+        self.policy = policy
+
+        # (function, args, size) to write queued messages with
+        self.items = deque()
+        self.buffered_amount = 0
+        self.messages = 0
+        self.dropped = 0
+
+        # Set while the queue is below its low watermarks
+        self.drained = Event()
+        self.drained.set()
+
+        # Set while all messages have been written
+        self.empty = Event()
+        self.empty.set()
+
+        # Set while there are items for the writer
+        self.ready = Event()
+
+        # Why nothing can be queued anymore, if so
+        self.closing = None
+
+        self.writer = gevent.spawn(self._write)
+
+    def __len__(self):
+        return self.messages
+
+    def is_full(self, size):
+        if not self.messages:
+            # Too large a message must still be sent
+            return False
+
+        if (self.high_water is not None and
+                self.buffered_amount + size > self.high_water):
+            return True
+
+        return (self.high_water_messages is not None and
+                self.messages + 1 > self.high_water_messages)
+
+    def is_drained(self):
+        if (self.low_water is not None and
+                self.buffered_amount > self.low_water):
+            return False
+
+        return (self.low_water_messages is None or
+                self.messages <= self.low_water_messages)
+
+    def put(self, func, args, size):
+        """
+        Queue a message of `size` octets, `func(*args)` writes it.
+
+        :returns: Whether the message was queued, `False` if it was dropped.
+        :raises WebSocketError: If the connection is closed or closing.
+        """
+        if self.closing:
+            raise WebSocketError(self.closing)
+
+        if self.is_full(size):
+            if self.policy == BLOCK:
+                while self.is_full(size) and not self.closing:
+                    # A large message may not fit until the queue is empty
+                    if self.is_drained():
+                        self.empty.wait()
+                    else:
+                        self.drained.wait()
+
+                if self.closing:
+                    raise WebSocketError(self.closing)
+
+            elif self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return False
+
+            elif self.policy == DROP_OLDEST:
+                while self.items and self.is_full(size):
+                    self._remove(self.items.popleft()[2])
+                    self.dropped += 1
+
+            else:
+                # Whatever is queued won't be read anyway. The writer is
+                # likely stuck on the peer, a close frame queued behind it
+                # would never go out.
+                self.dropped += 1
+                self.closing = MSG_OVERFLOW
+                self.stop()
+                gevent.spawn(self.ws.evict, CLOSE_CODE, MSG_OVERFLOW)
+                raise WebSocketError(MSG_OVERFLOW)
+
+        self._append(func, args, size)
+
+        return True
+
+    def _append(self, func, args, size):
+        self.items.append((func, args, size))
+        self.buffered_amount += size
+        self.messages += 1
+
+        if not self.is_drained():
+            self.drained.clear()
+
+        self.empty.clear()
+        self.ready.set()
+
+    def _remove(self, size):
+        self.buffered_amount -= size
+        self.messages -= 1
+
+        if self.is_drained():
+            self.drained.set()
+
+        if not self.messages:
+            self.empty.set()
+
+    def _clear(self):
+        while self.items:
+            self._remove(self.items.popleft()[2])
+            self.dropped += 1
+
+    def _write(self):
+        items = self.items
+        ws = self.ws
+
+        while not ws.closed:
+            if not items:
+                self.ready.clear()
+                self.ready.wait()
+                continue
+
+            func, args, size = items.popleft()
+
+            try:
+                func(*args)
+            except WebSocketError:
+                # The connection is gone
+                break
+            finally:
+                self._remove(size)
+
+        self.stop()
+
+    def wait_drained(self, timeout=None):
+        """
+        Wait until the queue is below its low watermarks.
+
+        :returns: Whether it is, `False` if `timeout` expired first.
+        """
+        return self.drained.wait(timeout)
+
+    def wait_empty(self, timeout=None):
+        """
+        Wait until every queued message has been written.
+
+        :returns: Whether it has, `False` if `timeout` expired first.
+        """
+        return self.empty.wait(timeout)
+
+    def stop(self):
+        """
+        Stop the writer, messages still queued are discarded.
+        """
+        if not self.closing:
+            self.closing = MSG_CLOSED
+
+        self._clear()
+
+        # Wake up everyone waiting, the queue won't drain anymore
+        self.drained.set()
+        self.empty.set()
+
+        writer = self.writer
+        self.writer = None
+
+        if writer is not None and writer is not gevent.getcurrent():
+            writer.kill(block=False)
@@ -1,7 +1,20 @@
+import struct
+
 from gevent.pywsgi import WSGIServer
 
+from .admission import Admission
 from .handler import WebSocketHandler
+from .heartbeat import Heartbeat
 from .logging import create_logger
+from .metrics import Metrics
+from .websocket import PreparedMessage, WebSocket
+
+# The backplane topic of `WebSocketServer.broadcast`
+BROADCAST_TOPIC = 'geventwebsocket.broadcast'
+
+# Broadcasts are published as their opcode and payload
+_pack_B = struct.Struct('!B').pack
+_BINARY = _pack_B(WebSocket.OPCODE_BINARY)
 
 
 class WebSocketServer(WSGIServer):
@@ -16,11 +29,106 @@ class WebSocketServer(WSGIServer):
     def __init__(self, *args, **kwargs):
         self.debug = kwargs.pop('debug', False)
         self.pre_start_hook = kwargs.pop('pre_start_hook', None)
+        self.max_frame_size = kwargs.pop('max_frame_size', None)
+        self.max_message_size = kwargs.pop('max_message_size', None)
+        self.deflate_max_window_bits = kwargs.pop(
+            'deflate_max_window_bits', None)
+        self.deflate_mem_level = kwargs.pop('deflate_mem_level', None)
+        self.deflate_no_context_takeover = kwargs.pop(
+            'deflate_no_context_takeover', None)
+        self.compression_policy = kwargs.pop('compression_policy', None)
+        self.outbound_queue_size = kwargs.pop('outbound_queue_size', None)
+
+        # Ping every `heartbeat_interval` seconds and evict connections that
+        # miss `max_missed_pongs` pongs, or receive nothing for
+        # `read_timeout` seconds
+        heartbeat_interval = kwargs.pop('heartbeat_interval', None)
+        max_missed_pongs = kwargs.pop('max_missed_pongs', 2)
+        read_timeout = kwargs.pop('read_timeout', None)
+
+        if heartbeat_interval is not None or read_timeout is not None:
+            self.heartbeat = Heartbeat(
+                heartbeat_interval, max_missed_pongs, read_timeout)
+        else:
+            self.heartbeat = None
+
+        # Limits on the websocket connections and handshakes, see
+        # `WebSocketHandler`
+        self.admission = Admission(
+            kwargs.pop('max_connections', None),
+            kwargs.pop('max_handshake_rate', None),
+            kwargs.pop('handshake_burst', None))
+
+        # Counters and histograms, see `Metrics`. Off by default, pass `True`
+        # to keep them or an instance to share it with a `MetricsApp`
+        metrics = kwargs.pop('metrics', None)
+
+        if metrics is True:
+            metrics = Metrics()
+
+        self.metrics = metrics or None
+
+        # Shares broadcasts and WAMP channels with other processes, see
+        # `geventwebsocket.backplane`
+        self.backplane = kwargs.pop('backplane', None)
+
+        if self.backplane is not None:
+            self.backplane.subscribe(BROADCAST_TOPIC, self._receive_broadcast)
+
         self._logger = None
         self.clients = {}
 
         super(WebSocketServer, self).__init__(*args, **kwargs)
 
+    def broadcast(self, message, filter=None, binary=None):
+        """
+        Send `message` to all connected clients, or those for which
+        `filter(client)` is true.
+
+        The message is encoded once and queued for every client, see
+        `Client.enqueue`, so this returns without waiting for any of them.
+        Without a `filter` it is published to the other processes attached
+        to the `backplane` as well, which do the same for their clients.
+
+        :param message: A `PreparedMessage`, or a message as accepted by
+            `WebSocket.send`.
+        :param binary: Whether to send a binary or a text message, see
+            `PreparedMessage`.
+        :returns: The number of clients of this server the message was
+            queued for.
+        """
+        if not isinstance(message, PreparedMessage):
+            message = PreparedMessage(message, binary)
+
+        if self.backplane is not None and filter is None:
+            self.backplane.publish(
+                BROADCAST_TOPIC, _pack_B(message.opcode) + message.payload,
+                exclude=self._receive_broadcast)
+
+        return self._broadcast(message, filter)
+
+    def _receive_broadcast(self, topic, payload):
+        self._broadcast(PreparedMessage(payload[1:], payload[:1] == _BINARY))
+
+    def _broadcast(self, message, filter=None):
+        queued = 0
+
+        for client in list(self.clients.values()):
+            if filter is None or filter(client):
+                queued += client.enqueue(message)
+
+        return queued
+
+    def stop(self, *args, **kwargs):
+        if self.heartbeat is not None:
+            self.heartbeat.stop()
+
+        if self.backplane is not None:
+            self.backplane.unsubscribe(BROADCAST_TOPIC,
+                                       self._receive_broadcast)
+
+        super(WebSocketServer, self).stop(*args, **kwargs)
+
     def handle(self, socket, address):
         handler = self.handler_class(socket, address, self)
         handler.handle()
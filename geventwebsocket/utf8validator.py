@@ -1,3 +1,5 @@
+import codecs
+
 from ._compat import PY3
 
 ###############################################################################
@@ -30,7 +32,7 @@ from ._compat import PY3
 # "Flexible and Economical UTF-8 Decoder" by Bjoern Hoehrmann
 # bjoern@hoehrmann.de, http://bjoern.hoehrmann.de/utf-8/decoder/dfa/
 
-__all__ = ("Utf8Validator",)
+__all__ = ("Utf8Validator", "BACKEND", "BACKENDS")
 
 
 # DFA transitions
@@ -54,171 +56,248 @@ UTF8VALIDATOR_DFA = (
 UTF8_ACCEPT = 0
 UTF8_REJECT = 1
 
+_utf8_decoder = codecs.getincrementaldecoder('utf-8')
+
 
 # use Cython implementation of UTF8 validator if available
 #
 try:
-    from wsaccel.utf8validator import Utf8Validator
+    from wsaccel.utf8validator import Utf8Validator as WsaccelUtf8Validator
 
 except ImportError:
-    #
-    # Fallback to pure Python implementation - also for PyPy.
-    #
-    # Do NOT touch this code unless you know what you are doing!
-    # https://github.com/oberstet/scratchbox/tree/master/python/utf8
-    #
+    WsaccelUtf8Validator = None
+
+#
+# Pure Python implementation - also for PyPy.
+#
+# Do NOT touch this code unless you know what you are doing!
+# https://github.com/oberstet/scratchbox/tree/master/python/utf8
+#
+
+if PY3:
 
-    if PY3:
+    # Python 3 and above
 
-        # Python 3 and above
+    # convert DFA table to bytes (performance)
+    UTF8VALIDATOR_DFA_S = bytes(UTF8VALIDATOR_DFA)
 
-        # convert DFA table to bytes (performance)
-        UTF8VALIDATOR_DFA_S = bytes(UTF8VALIDATOR_DFA)
+    class DfaUtf8Validator(object):
+        """
+        Incremental UTF-8 validator with constant memory consumption (minimal state).
 
-        class Utf8Validator(object):
+        Implements the algorithm "Flexible and Economical UTF-8 Decoder" by
+        Bjoern Hoehrmann (http://bjoern.hoehrmann.de/utf-8/decoder/dfa/).
+        """
+
+        def __init__(self):
+            self.reset()
+
+        def decode(self, b):
             """
-            Incremental UTF-8 validator with constant memory consumption (minimal state).
+            Eat one UTF-8 octet, and validate on the fly.
+
+            Returns ``UTF8_ACCEPT`` when enough octets have been consumed, in which case
+            ``self.codepoint`` contains the decoded Unicode code point.
 
-            Implements the algorithm "Flexible and Economical UTF-8 Decoder" by
-            Bjoern Hoehrmann (http://bjoern.hoehrmann.de/utf-8/decoder/dfa/).
+            Returns ``UTF8_REJECT`` when invalid UTF-8 was encountered.
+
+            Returns some other positive integer when more octets need to be eaten.
+            """
+            tt = UTF8VALIDATOR_DFA_S[b]
+            if self.state != UTF8_ACCEPT:
+                self.codepoint = (b & 0x3f) | (self.codepoint << 6)
+            else:
+                self.codepoint = (0xff >> tt) & b
+            self.state = UTF8VALIDATOR_DFA_S[256 + self.state * 16 + tt]
+            return self.state
+
+        def reset(self):
+            """
+            Reset validator to start new incremental UTF-8 decode/validation.
             """
+            self.state = UTF8_ACCEPT  # the empty string is valid UTF8
+            self.codepoint = 0
+            self.i = 0
 
-            def __init__(self):
-                self.reset()
-
-            def decode(self, b):
-                """
-                Eat one UTF-8 octet, and validate on the fly.
-
-                Returns ``UTF8_ACCEPT`` when enough octets have been consumed, in which case
-                ``self.codepoint`` contains the decoded Unicode code point.
-
-                Returns ``UTF8_REJECT`` when invalid UTF-8 was encountered.
-
-                Returns some other positive integer when more octets need to be eaten.
-                """
-                tt = UTF8VALIDATOR_DFA_S[b]
-                if self.state != UTF8_ACCEPT:
-                    self.codepoint = (b & 0x3f) | (self.codepoint << 6)
-                else:
-                    self.codepoint = (0xff >> tt) & b
-                self.state = UTF8VALIDATOR_DFA_S[256 + self.state * 16 + tt]
-                return self.state
-
-            def reset(self):
-                """
-                Reset validator to start new incremental UTF-8 decode/validation.
-                """
-                self.state = UTF8_ACCEPT  # the empty string is valid UTF8
-                self.codepoint = 0
-                self.i = 0
-
-            def validate(self, ba):
-                """
-                Incrementally validate a chunk of bytes provided as string.
-
-                Will return a quad ``(valid?, endsOnCodePoint?, currentIndex, totalIndex)``.
-
-                As soon as an octet is encountered which renders the octet sequence
-                invalid, a quad with ``valid? == False`` is returned. ``currentIndex`` returns
-                the index within the currently consumed chunk, and ``totalIndex`` the
-                index within the total consumed sequence that was the point of bail out.
-                When ``valid? == True``, currentIndex will be ``len(ba)`` and ``totalIndex`` the
-                total amount of consumed bytes.
-                """
-                #
-                # The code here is written for optimal JITting in PyPy, not for best
-                # readability by your grandma or particular elegance. Do NOT touch!
-                #
-                l = len(ba)
-                i = 0
-                state = self.state
-                while i < l:
-                    # optimized version of decode(), since we are not interested in actual code points
-                    state = UTF8VALIDATOR_DFA_S[256 + (state << 4) + UTF8VALIDATOR_DFA_S[ba[i]]]
-                    if state == UTF8_REJECT:
-                        self.state = state
-                        self.i += i
-                        return False, False, i, self.i
-                    i += 1
-                self.state = state
-                self.i += l
-                return True, state == UTF8_ACCEPT, l, self.i
-
-    else:
-
-        # convert DFA table to string (performance)
-        UTF8VALIDATOR_DFA_S = ''.join([chr(c) for c in UTF8VALIDATOR_DFA])
-
-        class Utf8Validator(object):
+        def validate(self, ba):
             """
-            Incremental UTF-8 validator with constant memory consumption (minimal state).
+            Incrementally validate a chunk of bytes provided as string.
 
-            Implements the algorithm "Flexible and Economical UTF-8 Decoder" by
-            Bjoern Hoehrmann (http://bjoern.hoehrmann.de/utf-8/decoder/dfa/).
+            Will return a quad ``(valid?, endsOnCodePoint?, currentIndex, totalIndex)``.
+
+            As soon as an octet is encountered which renders the octet sequence
+            invalid, a quad with ``valid? == False`` is returned. ``currentIndex`` returns
+            the index within the currently consumed chunk, and ``totalIndex`` the
+            index within the total consumed sequence that was the point of bail out.
+            When ``valid? == True``, currentIndex will be ``len(ba)`` and ``totalIndex`` the
+            total amount of consumed bytes.
+            """
+            #
+            # The code here is written for optimal JITting in PyPy, not for best
+            # readability by your grandma or particular elegance. Do NOT touch!
+            #
+            l = len(ba)
+            i = 0
+            state = self.state
+            while i < l:
+                # optimized version of decode(), since we are not interested in actual code points
+                state = UTF8VALIDATOR_DFA_S[256 + (state << 4) + UTF8VALIDATOR_DFA_S[ba[i]]]
+                if state == UTF8_REJECT:
+                    self.state = state
+                    self.i += i
+                    return False, False, i, self.i
+                i += 1
+            self.state = state
+            self.i += l
+            return True, state == UTF8_ACCEPT, l, self.i
+
+else:
+
+    # convert DFA table to string (performance)
+    UTF8VALIDATOR_DFA_S = ''.join([chr(c) for c in UTF8VALIDATOR_DFA])
+
+    class DfaUtf8Validator(object):
+        """
+        Incremental UTF-8 validator with constant memory consumption (minimal state).
+
+        Implements the algorithm "Flexible and Economical UTF-8 Decoder" by
+        Bjoern Hoehrmann (http://bjoern.hoehrmann.de/utf-8/decoder/dfa/).
+        """
+
+        def __init__(self):
+            self.reset()
+
+        def decode(self, b):
+            """
+            Eat one UTF-8 octet, and validate on the fly.
+
+            Returns ``UTF8_ACCEPT`` when enough octets have been consumed, in which case
+            ``self.codepoint`` contains the decoded Unicode code point.
+
+            Returns ``UTF8_REJECT`` when invalid UTF-8 was encountered.
+
+            Returns some other positive integer when more octets need to be eaten.
             """
+            tt = ord(UTF8VALIDATOR_DFA_S[b])
+            if self.state != UTF8_ACCEPT:
+                self.codepoint = (b & 0x3f) | (self.codepoint << 6)
+            else:
+                self.codepoint = (0xff >> tt) & b
+            self.state = ord(UTF8VALIDATOR_DFA_S[256 + self.state * 16 + tt])
+            return self.state
+
+        def reset(self):
+            """
+            Reset validator to start new incremental UTF-8 decode/validation.
+            """
+            self.state = UTF8_ACCEPT  # the empty string is valid UTF8
+            self.codepoint = 0
+            self.i = 0
+
+        def validate(self, ba):
+            """
+            Incrementally validate a chunk of bytes provided as string.
+
+            Will return a quad ``(valid?, endsOnCodePoint?, currentIndex, totalIndex)``.
 
-            def __init__(self):
-                self.reset()
-
-            def decode(self, b):
-                """
-                Eat one UTF-8 octet, and validate on the fly.
-
-                Returns ``UTF8_ACCEPT`` when enough octets have been consumed, in which case
-                ``self.codepoint`` contains the decoded Unicode code point.
-
-                Returns ``UTF8_REJECT`` when invalid UTF-8 was encountered.
-
-                Returns some other positive integer when more octets need to be eaten.
-                """
-                tt = ord(UTF8VALIDATOR_DFA_S[b])
-                if self.state != UTF8_ACCEPT:
-                    self.codepoint = (b & 0x3f) | (self.codepoint << 6)
-                else:
-                    self.codepoint = (0xff >> tt) & b
-                self.state = ord(UTF8VALIDATOR_DFA_S[256 + self.state * 16 + tt])
-                return self.state
-
-            def reset(self):
-                """
-                Reset validator to start new incremental UTF-8 decode/validation.
-                """
-                self.state = UTF8_ACCEPT  # the empty string is valid UTF8
-                self.codepoint = 0
-                self.i = 0
-
-            def validate(self, ba):
-                """
-                Incrementally validate a chunk of bytes provided as string.
-
-                Will return a quad ``(valid?, endsOnCodePoint?, currentIndex, totalIndex)``.
-
-                As soon as an octet is encountered which renders the octet sequence
-                invalid, a quad with ``valid? == False`` is returned. ``currentIndex`` returns
-                the index within the currently consumed chunk, and ``totalIndex`` the
-                index within the total consumed sequence that was the point of bail out.
-                When ``valid? == True``, currentIndex will be ``len(ba)`` and ``totalIndex`` the
-                total amount of consumed bytes.
-                """
-                #
-                # The code here is written for optimal JITting in PyPy, not for best
-                # readability by your grandma or particular elegance. Do NOT touch!
-                #
-                l = len(ba)
-                i = 0
-                state = self.state
-                while i < l:
-                    # optimized version of decode(), since we are not interested in actual code points
-                    try:
-                        state = ord(UTF8VALIDATOR_DFA_S[256 + (state << 4) + ord(UTF8VALIDATOR_DFA_S[ba[i]])])
-                    except:
-                        import ipdb; ipdb.set_trace() 
-                    if state == UTF8_REJECT:
-                        self.state = state
-                        self.i += i
-                        return False, False, i, self.i
-                    i += 1
-                self.state = state
-                self.i += l
-                return True, state == UTF8_ACCEPT, l, self.i
+            As soon as an octet is encountered which renders the octet sequence
+            invalid, a quad with ``valid? == False`` is returned. ``currentIndex`` returns
+            the index within the currently consumed chunk, and ``totalIndex`` the
+            index within the total consumed sequence that was the point of bail out.
+            When ``valid? == True``, currentIndex will be ``len(ba)`` and ``totalIndex`` the
+            total amount of consumed bytes.
+            """
+            #
+            # The code here is written for optimal JITting in PyPy, not for best
+            # readability by your grandma or particular elegance. Do NOT touch!
+            #
+            l = len(ba)
+            i = 0
+            state = self.state
+            while i < l:
+                # optimized version of decode(), since we are not interested in actual code points
+                try:
+                    state = ord(UTF8VALIDATOR_DFA_S[256 + (state << 4) + ord(UTF8VALIDATOR_DFA_S[ba[i]])])
+                except:
+                    import ipdb; ipdb.set_trace() 
+                if state == UTF8_REJECT:
+                    self.state = state
+                    self.i += i
+                    return False, False, i, self.i
+                i += 1
+            self.state = state
+            self.i += l
+            return True, state == UTF8_ACCEPT, l, self.i
+
+
+class CodecsUtf8Validator(object):
+    """
+    Incremental UTF-8 validator on top of the strict incremental UTF-8
+    decoder of the `codecs` module, which does the work in C.
+
+    Has the same ``validate`` contract, including the error offsets, as the
+    DFA based validators.
+    """
+
+    def __init__(self):
+        self.decoder = _utf8_decoder()
+        self.reset()
+
+    def reset(self):
+        """
+        Reset validator to start new incremental UTF-8 decode/validation.
+        """
+        self.decoder.reset()
+        self.valid = True
+        self.i = 0
+
+    def _reject(self, i):
+        self.valid = False
+        self.i += i
+        return False, False, i, self.i
+
+    def validate(self, ba):
+        """
+        Incrementally validate a chunk of bytes provided as string.
+
+        Will return a quad ``(valid?, endsOnCodePoint?, currentIndex, totalIndex)``,
+        see ``DfaUtf8Validator.validate``.
+        """
+        if not self.valid:
+            return self._reject(0)
+
+        pending = len(self.decoder.getstate()[0])
+
+        try:
+            self.decoder.decode(ba)
+        except UnicodeDecodeError as e:
+            # Report the octet the DFA would have rejected: the start of the
+            # sequence if it can't start one, else its first bad continuation
+            if e.reason == 'invalid start byte':
+                return self._reject(e.start - pending)
+
+            return self._reject(e.end - pending)
+
+        pending = self.decoder.getstate()[0]
+
+        if len(pending) == 2 and pending[0] == 0xed and pending[1] >= 0xa0:
+            # The start of a surrogate, which the decoder only rejects once
+            # the sequence is complete
+            return self._reject(len(ba) - 1)
+
+        self.i += len(ba)
+        return True, not pending, len(ba), self.i
+
+
+# Every validator that can be used in this interpreter, preferred last. The
+# codec outruns even wsaccel, but the UTF-8 codec of Python 2 accepts
+# surrogates, so it can't be used there.
+BACKENDS = [('dfa', DfaUtf8Validator)]
+
+if WsaccelUtf8Validator is not None:
+    BACKENDS.append(('wsaccel', WsaccelUtf8Validator))
+
+if PY3:
+    BACKENDS.append(('codecs', CodecsUtf8Validator))
+
+BACKEND, Utf8Validator = BACKENDS[-1]
@@ -1,11 +1,20 @@
+import codecs
 import socket
 import struct
 import zlib
 
-from ._compat import string_types, range_type, text_type
+import gevent
+from gevent.lock import Semaphore
+
+from ._compat import PY2, string_types, range_type, text_type, monotonic
 from .exceptions import ProtocolError
 from .exceptions import WebSocketError
 from .exceptions import FrameTooLargeException
+from .deflate import (PerMessageDeflate, CompressionTracker,
+                      COMPRESSION_LEVEL, DEFAULT_POLICY)
+from .masking import mask
+from .metrics import NO_STATUS_CODE
+from .sendqueue import SendQueue, BLOCK
 from .utf8validator import Utf8Validator
 
 
@@ -13,6 +22,48 @@ MSG_SOCKET_DEAD = "Socket is dead"
 MSG_ALREADY_CLOSED = "Connection is already closed"
 MSG_CLOSED = "Connection closed"
 
+# Size of the per-connection buffer incoming frames are decoded from
+READ_BUFFER_SIZE = 16 * 1024
+
+# Maximum size of the chunks a `MessageStream` inflates a frame in to
+INFLATE_CHUNK_SIZE = 64 * 1024
+
+# Default payload size of the frames sent by `WebSocket.send_stream`
+FRAGMENT_SIZE = 64 * 1024
+
+# Payloads smaller than this are cheaper to copy behind the frame header than
+# to hand to the kernel as a separate buffer
+WRITEV_MIN_SIZE = 4096
+
+# A `PreparedMessage` smaller than this is compressed on its own for a
+# connection with context takeover whose compressor has a history: that is
+# cheaper than the new compressor its next message needs after the shared
+# frame, and keeps the context
+PREPARED_CONTEXT_SIZE = 4096
+
+# In corked mode frames are flushed early once this many octets are held back
+CORK_BUFFER_SIZE = 64 * 1024
+
+# Seconds `WebSocket.evict` tries to send the close frame for
+CLOSE_TIMEOUT = 1
+
+_unpack_H = struct.Struct('!H').unpack_from
+_unpack_Q = struct.Struct('!Q').unpack_from
+_pack_BB = struct.Struct('!BB').pack
+_pack_BBH = struct.Struct('!BBH').pack
+_pack_BBQ = struct.Struct('!BBQ').pack
+_utf8_decoder = codecs.getincrementaldecoder('utf-8')
+
+
+class MockApp(object):
+    # The `current_app` of servers whose application doesn't have one, for
+    # backwards compatibility reasons
+    def on_close(self, *args):
+        pass
+
+
+_mock_app = MockApp()
+
 
 class WebSocket(object):
     """
@@ -22,11 +73,22 @@ class WebSocket(object):
     :ivar closed: Whether this connection is closed/closing.
     :ivar stream: The underlying file like object that will be read from /
         written to by this WebSocket object.
+    :ivar permessage_deflate: The negotiated `PerMessageDeflate` parameters,
+        or `None` if the connection isn't compressed.
+    :ivar compression: The `CompressionTracker` that decides which outgoing
+        messages are compressed, `None` if the connection isn't.
+    :ivar rtt: The round trip time in seconds of the last ping answered, or
+        `None`. The server pings its connections if it has a `Heartbeat`.
     """
 
     __slots__ = ('utf8validator', 'utf8validate_last', 'environ', 'closed',
-                 'stream', 'raw_write', 'raw_read', 'handler',
-                 'do_compress', 'compressor', 'decompressor')
+                 'stream', 'raw_write', 'raw_writev', 'raw_read', 'reader',
+                 'handler', 'max_frame_size', 'max_message_size',
+                 'do_compress', 'permessage_deflate', 'compression',
+                 'compressor', 'compressor_level', 'decompressor',
+                 'message_lock', 'write_lock', 'send_queue', 'cork_buffer',
+                 'flush_scheduled', 'reading', 'last_read', 'ping_payload',
+                 'ping_sent', 'missed_pongs', 'rtt', 'metrics')
 
     OPCODE_CONTINUATION = 0x00
     OPCODE_TEXT = 0x01
@@ -35,6 +97,9 @@ class WebSocket(object):
     OPCODE_PING = 0x09
     OPCODE_PONG = 0x0a
 
+    # The size of the buffer incoming frames are decoded from
+    read_buffer_size = READ_BUFFER_SIZE
+
     def __init__(self, environ, stream, handler, do_compress):
         self.environ = environ
         self.closed = False
@@ -42,15 +107,67 @@ class WebSocket(object):
         self.stream = stream
 
         self.raw_write = stream.write
+        self.raw_writev = getattr(stream, 'writev', None)
         self.raw_read = stream.read
 
+        # Streams that can read in to a buffer are decoded by a `FrameReader`
+        if getattr(stream, 'recv_into', None):
+            self.reader = FrameReader(stream, self.read_buffer_size)
+        else:
+            self.reader = None
+
         self.utf8validator = Utf8Validator()
         self.handler = handler
 
-        self.do_compress = do_compress
-        if do_compress:
-            self.compressor = zlib.compressobj(7, zlib.DEFLATED, -zlib.MAX_WBITS)
-            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        # Limits on the payload size of incoming frames/messages, if any
+        self.max_frame_size = None
+        self.max_message_size = None
+
+        # `do_compress` is either the negotiated `PerMessageDeflate`
+        # parameters or a flag to use the defaults
+        if do_compress and not isinstance(do_compress, PerMessageDeflate):
+            do_compress = PerMessageDeflate()
+
+        self.do_compress = bool(do_compress)
+        self.permessage_deflate = do_compress or None
+
+        # The zlib state is only allocated once it is needed, see
+        # `get_compressor` and `get_decompressor`
+        self.compressor = None
+        self.compressor_level = None
+        self.decompressor = None
+
+        # Only compressed connections need one, the handler sets the policy
+        if self.do_compress:
+            self.compression = CompressionTracker(DEFAULT_POLICY)
+        else:
+            self.compression = None
+
+        # Messages sent by different greenlets must not interleave. Held
+        # while a data message is compressed and written, and while a single
+        # frame is written, as control frames may go in between fragments.
+        self.message_lock = Semaphore()
+        self.write_lock = Semaphore()
+
+        # Data messages are queued here in buffered mode, see
+        # `enable_buffering`
+        self.send_queue = None
+
+        # Frames are held back here in corked mode, see `enable_corking`
+        self.cork_buffer = None
+        self.flush_scheduled = False
+
+        # Liveness, see `Heartbeat`. Control frames are only read while
+        # someone waits for a message, `reading` tells if that's the case.
+        self.reading = False
+        self.last_read = monotonic()
+        self.ping_payload = None
+        self.ping_sent = None
+        self.missed_pongs = 0
+        self.rtt = None
+
+        # The server's `Metrics`, if it keeps any
+        self.metrics = None
 
     def __del__(self):
         try:
@@ -111,15 +228,8 @@ class WebSocket(object):
 
     @property
     def current_app(self):
-        if hasattr(self.handler.server.application, 'current_app'):
-            return self.handler.server.application.current_app
-        else:
-            # For backwards compatibility reasons
-            class MockApp():
-                def on_close(self, *args):
-                    pass
-
-            return MockApp()
+        return getattr(self.handler.server.application, 'current_app',
+                       _mock_app)
 
     @property
     def origin(self):
@@ -161,6 +271,9 @@ class WebSocket(object):
         :param payload: The bytestring payload associated with the close frame.
         """
         if not payload:
+            if self.metrics is not None:
+                self.metrics.close_in(NO_STATUS_CODE)
+
             self.close(1000, None)
 
             return
@@ -182,82 +295,105 @@ class WebSocket(object):
         if not self._is_valid_close_code(code):
             raise ProtocolError('Invalid close code {0}'.format(code))
 
+        if self.metrics is not None:
+            self.metrics.close_in(code)
+
         self.close(code, payload)
 
     def handle_ping(self, header, payload):
         self.send_frame(payload, self.OPCODE_PONG)
 
     def handle_pong(self, header, payload):
-        pass
+        # Unsolicited pongs and answers to earlier pings are ignored
+        if self.ping_payload is not None and payload == self.ping_payload:
+            self.rtt = monotonic() - self.ping_sent
+            self.ping_payload = None
+            self.missed_pongs = 0
 
-    def read_frame(self):
+    def read_frame(self, max_length=None):
         """
         Block until a full frame has been read from the socket.
 
         This is an internal method as calling this will not cleanup correctly
         if an exception is called. Use `receive` instead.
 
+        The payload of a compressed frame (RSV1 set in `Header.flags`) is
+        returned as is, it is inflated per message by the caller.
+
+        :param max_length: The maximum payload length of a data frame, on top
+            of `max_frame_size`. Larger frames raise `FrameTooLargeException`
+            before their payload is read.
         :return: The header and payload as a tuple.
         """
 
-        header = Header.decode_header(self.stream)
-        flags = header.flags
+        reader = self.reader
 
-        if self.do_compress and (flags & header.RSV0_MASK):
-            flags &= ~header.RSV0_MASK
-            compressed = True
+        if reader is None:
+            header = Header.decode_header(self.stream, self.max_frame_size)
         else:
-            compressed = False
+            header = reader.read_header(self.max_frame_size)
+
+        self.last_read = monotonic()
+
+        if self.metrics is not None:
+            self.metrics.frame_in(header.opcode, header.length)
+
+        if (max_length is not None and header.length > max_length and
+                header.opcode < self.OPCODE_CLOSE):
+            header.raise_too_large(max_length)
+
+        flags = header.flags
 
         if flags:
-            raise ProtocolError
+            # Only the first frame of a compressed message may have RSV1 set
+            if (flags != header.RSV0_MASK or not self.do_compress or
+                    header.opcode not in (self.OPCODE_TEXT,
+                                          self.OPCODE_BINARY)):
+                raise ProtocolError
 
         if not header.length:
             return header, b''
 
-        try:
-            payload = self.raw_read(header.length)
-        except socket.error:
-            payload = b''
-        except Exception:
-            raise WebSocketError('Could not read payload')
-
-        if len(payload) != header.length:
-            raise WebSocketError('Unexpected EOF reading frame payload')
+        if reader is None:
+            try:
+                payload = self.raw_read(header.length)
+            except socket.error:
+                payload = b''
+            except Exception:
+                raise WebSocketError('Could not read payload')
 
-        if header.mask:
-            payload = header.unmask_payload(payload)
+            if len(payload) != header.length:
+                raise WebSocketError('Unexpected EOF reading frame payload')
 
-        if compressed:
-            payload = b''.join((
-                self.decompressor.decompress(payload),
-                self.decompressor.decompress(b'\0\0\xff\xff'),
-                self.decompressor.flush(),
-            ))
+            if header.mask:
+                payload = header.unmask_payload(payload)
+        else:
+            payload = reader.read_payload(header)
 
         return header, payload
 
-    def validate_utf8(self, payload):
-        # Make sure the frames are decodable independently
-        self.utf8validate_last = self.utf8validator.validate(payload)
-
-        if not self.utf8validate_last[0]:
-            raise UnicodeError("Encountered invalid UTF-8 while processing "
-                               "text message at payload octet index "
-                               "{0:d}".format(self.utf8validate_last[3]))
-
-    def read_message(self):
+    def read_message_frame(self, opcode, max_length=None):
         """
-        Return the next text or binary message from the socket.
+        Block until the next data frame of a message has been read from the
+        socket, handling any control frames received in between.
 
         This is an internal method as calling this will not cleanup correctly
         if an exception is called. Use `receive` instead.
-        """
-        opcode = None
-        message = bytearray()
 
+        :param opcode: The opcode of the message being read, or `None` if the
+            frame should start a new message.
+        :param max_length: The maximum payload length of the data frame.
+        :return: The header and payload as a tuple, or `None` if the
+            connection was closed.
+        """
         while True:
-            header, payload = self.read_frame()
+            self.reading = True
+
+            try:
+                header, payload = self.read_frame(max_length)
+            finally:
+                self.reading = False
+
             f_opcode = header.opcode
 
             if f_opcode in (self.OPCODE_TEXT, self.OPCODE_BINARY):
@@ -267,23 +403,19 @@ class WebSocket(object):
                                         "expected to be zero, got "
                                         "{0!r}".format(f_opcode))
 
-                # Start reading a new message, reset the validator
-                self.utf8validator.reset()
-                self.utf8validate_last = (True, True, 0, 0)
-
-                opcode = f_opcode
+                return header, payload
 
             elif f_opcode == self.OPCODE_CONTINUATION:
                 if not opcode:
                     raise ProtocolError("Unexpected frame with opcode=0")
 
+                return header, payload
+
             elif f_opcode == self.OPCODE_PING:
                 self.handle_ping(header, payload)
-                continue
 
             elif f_opcode == self.OPCODE_PONG:
                 self.handle_pong(header, payload)
-                continue
 
             elif f_opcode == self.OPCODE_CLOSE:
                 self.handle_close(header, payload)
@@ -292,20 +424,147 @@ class WebSocket(object):
             else:
                 raise ProtocolError("Unexpected opcode={0!r}".format(f_opcode))
 
+    def inflate(self, payload, fin, max_length=None):
+        """
+        Inflate the payload of a frame of a compressed message.
+
+        :param fin: Whether this is the final frame of the message.
+        :param max_length: The maximum length of the inflated payload, it
+            raises `FrameTooLargeException` as soon as that is exceeded.
+        """
+        decompressor = self.get_decompressor(fin)
+
+        if fin:
+            payload = bytes(payload) + b'\0\0\xff\xff'
+
+        size = len(payload)
+
+        if max_length is None:
+            payload = decompressor.decompress(payload)
+        else:
+            payload = decompressor.decompress(payload, max_length + 1)
+
+            if len(payload) > max_length:
+                raise FrameTooLargeException(
+                    "Inflated payload exceeds the maximum of {0} "
+                    "bytes".format(max_length))
+
+        if self.metrics is not None:
+            self.metrics.inflated(size, len(payload))
+
+        return payload
+
+    def get_decompressor(self, fin):
+        """
+        :returns: The decompressor for the current incoming message.
+        :param fin: Whether this is the final frame of the message. Without
+            client context takeover the decompressor is let go afterwards.
+        """
+        decompressor = self.decompressor
+
+        if decompressor is None:
+            decompressor = self.permessage_deflate.decompressobj()
+            self.decompressor = decompressor
+
+        if fin and self.permessage_deflate.client_no_context_takeover:
+            self.decompressor = None
+
+        return decompressor
+
+    def validate_utf8(self, payload):
+        # Make sure the frames are decodable independently
+        self.utf8validate_last = self.utf8validator.validate(payload)
+
+        if not self.utf8validate_last[0]:
+            raise UnicodeError("Encountered invalid UTF-8 while processing "
+                               "text message at payload octet index "
+                               "{0:d}".format(self.utf8validate_last[3]))
+
+    def read_message(self):
+        """
+        Return the next text or binary message from the socket.
+
+        This is an internal method as calling this will not cleanup correctly
+        if an exception is called. Use `receive` instead.
+        """
+        opcode = None
+        message = bytearray()
+        max_length = self.max_message_size
+
+        # Text is validated and decoded in a single pass, frame by frame
+        decoder = None
+        text = []
+        size = 0
+        metrics = self.metrics
+
+        while True:
+            frame = self.read_message_frame(opcode, max_length)
+
+            if frame is None:
+                return
+
+            header, payload = frame
+
+            if not opcode:
+                opcode = header.opcode
+                compressed = bool(header.flags)
+
+                if PY2 and opcode == self.OPCODE_TEXT:
+                    # Python 2 decodes surrogates, validate separately
+                    self.utf8validator.reset()
+                    self.utf8validate_last = (True, True, 0, 0)
+
+            if compressed:
+                payload = self.inflate(payload, header.fin, max_length)
+
             if opcode == self.OPCODE_TEXT:
-                self.validate_utf8(payload)
+                if PY2:
+                    self.validate_utf8(payload)
 
-            message += payload
+                if decoder is None:
+                    if header.fin:
+                        # The whole message is in a single frame
+                        if metrics is not None:
+                            metrics.message_size_in.observe(len(payload))
+
+                        return payload.decode('utf-8')
+
+                    decoder = _utf8_decoder()
+
+                text.append(decoder.decode(payload, header.fin))
+            else:
+                message += payload
+
+            size += len(payload)
+
+            if max_length is not None:
+                max_length -= len(payload)
 
             if header.fin:
                 break
 
+        if metrics is not None:
+            metrics.message_size_in.observe(size)
+
         if opcode == self.OPCODE_TEXT:
-            self.validate_utf8(message)
-            return self._decode_bytes(message)
+            return ''.join(text)
         else:
             return message
 
+    def close_on_error(self, error):
+        """
+        Close the connection after `error` was raised while reading from it.
+        """
+        if isinstance(error, UnicodeError):
+            self.close(1007)
+        elif isinstance(error, FrameTooLargeException):
+            self.close(1009)
+        elif isinstance(error, ProtocolError):
+            self.close(1002)
+        else:
+            self.close()
+            self.current_app.on_close(MSG_CLOSED)
+
     def receive(self):
         """
         Read and return a message from the stream. If `None` is returned, then
@@ -318,19 +577,38 @@ class WebSocket(object):
 
         try:
             return self.read_message()
-        except UnicodeError:
-            self.close(1007)
-        except ProtocolError:
-            self.close(1002)
-        except socket.timeout:
-            self.close()
-            self.current_app.on_close(MSG_CLOSED)
-        except socket.error:
-            self.close()
-            self.current_app.on_close(MSG_CLOSED)
+        except (UnicodeError, socket.error) as error:
+            self.close_on_error(error)
 
         return None
 
+    def receive_stream(self):
+        """
+        Read the next message from the stream frame by frame, instead of
+        buffering the whole message like `receive` does. `max_frame_size`
+        and `max_message_size` apply, the connection is closed with 1009
+        once the message exceeds the latter.
+
+        The returned `MessageStream` must be exhausted before the next message
+        can be received. If `None` is returned, then the socket is considered
+        closed/errored.
+        """
+
+        if self.closed:
+            self.current_app.on_close(MSG_ALREADY_CLOSED)
+            raise WebSocketError(MSG_ALREADY_CLOSED)
+
+        try:
+            frame = self.read_message_frame(None, self.max_message_size)
+        except (UnicodeError, socket.error) as error:
+            self.close_on_error(error)
+            return None
+
+        if frame is None:
+            return None
+
+        return MessageStream(self, *frame)
+
     def send_frame(self, message, opcode, do_compress=False):
         """
         Send a frame over the websocket with message as its payload
@@ -345,24 +623,123 @@ class WebSocket(object):
         if opcode in (self.OPCODE_TEXT, self.OPCODE_PING):
             message = self._encode_bytes(message)
         elif opcode == self.OPCODE_BINARY:
-            message = bytes(message)
+            if not isinstance(message, (bytes, bytearray)):
+                message = bytes(message)
 
-        if do_compress and self.do_compress:
-            message = self.compressor.compress(message)
-            message += self.compressor.flush(zlib.Z_SYNC_FLUSH)
-            if message.endswith(b'\x00\x00\xff\xff'):
-                message = message[:-4]
-            flags = Header.RSV0_MASK
+        if opcode >= self.OPCODE_CLOSE:
+            self.write_frame(True, opcode, message)
+            return
+
+        if self.metrics is not None:
+            self.metrics.message_size_out.observe(len(message))
+
+        if self.send_queue is not None:
+            self.send_queue.put(self.write_message,
+                                (message, opcode, do_compress), len(message))
         else:
-            flags = 0
+            self.write_message(message, opcode, do_compress)
+
+    def write_message(self, message, opcode, do_compress=False):
+        """
+        Write a data message, which must already be encoded, to the socket
+        in a single frame.
+        """
+        with self.message_lock:
+            if do_compress and self.do_compress:
+                level = self.compression.level(opcode, len(message))
+            else:
+                level = 0
+
+            if level:
+                size = len(message)
+                message = self.deflate(message, True, level)
+                self.compression.record(opcode, size, len(message))
+                flags = Header.RSV0_MASK
+
+                if self.metrics is not None:
+                    self.metrics.deflated(size, len(message))
+            else:
+                flags = 0
+
+            self.write_frame(True, opcode, message, flags)
 
-        header = Header.encode_header(True, opcode, b'', len(message), flags)
+    def write_frame(self, fin, opcode, payload, flags=0):
+        """
+        Write a single frame with `payload`, which must already be encoded
+        (and compressed), to the socket.
+        """
+        header, payload = self.encode_frame(fin, opcode, payload, flags)
+
+        if self.metrics is not None:
+            self.metrics.frame_out(opcode, len(payload))
+
+        if self.cork_buffer is not None:
+            self.cork(header, payload, opcode == self.OPCODE_CLOSE)
+            return
 
         try:
-            self.raw_write(header + message)
+            with self.write_lock:
+                if (self.raw_writev is not None and
+                        len(payload) >= WRITEV_MIN_SIZE):
+                    self.raw_writev((header, payload))
+                else:
+                    self.raw_write(header + payload)
         except socket.error:
             raise WebSocketError(MSG_SOCKET_DEAD)
 
+    def encode_frame(self, fin, opcode, payload, flags=0):
+        """
+        :returns: The header and payload of a frame as written to the socket.
+            A server doesn't mask its frames.
+        """
+        return Header.encode_header(fin, opcode, b'', len(payload),
+                                    flags), payload
+
+    def deflate(self, payload, fin, level=COMPRESSION_LEVEL):
+        """
+        Compress the payload of a frame of a compressed message.
+
+        :param fin: Whether this is the final frame of the message.
+        :param level: The zlib level to compress the message with.
+        """
+        compressor = self.get_compressor(fin, level)
+
+        if not fin:
+            # Whatever zlib holds back goes out with a later fragment
+            return compressor.compress(payload)
+
+        payload = compressor.compress(payload)
+        payload += compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        if payload.endswith(b'\x00\x00\xff\xff'):
+            payload = memoryview(payload)[:-4]
+
+        return payload
+
+    def get_compressor(self, fin, level=COMPRESSION_LEVEL):
+        """
+        :returns: The compressor for the current outgoing message.
+        :param fin: Whether this is the final frame of the message. Without
+            server context takeover the compressor is let go afterwards.
+        :param level: The zlib level to compress the message with, if a new
+            compressor is needed.
+        """
+        compressor = self.compressor
+
+        if compressor is None:
+            compressor = self.permessage_deflate.compressobj(level)
+            self.compressor = compressor
+            self.compressor_level = level
+
+        # Otherwise the compressor keeps its level: with context takeover a
+        # new one would lose the context, and zlib can't change the level of
+        # an existing one
+
+        if fin and self.permessage_deflate.server_no_context_takeover:
+            self.compressor = None
+
+        return compressor
+
     def send(self, message, binary=None, do_compress=True):
         """
         Send a frame over the websocket with message as its payload
@@ -378,6 +755,263 @@ class WebSocket(object):
             self.current_app.on_close(MSG_SOCKET_DEAD)
             raise WebSocketError(MSG_SOCKET_DEAD)
 
+    def send_stream(self, stream, binary=True, fragment_size=FRAGMENT_SIZE,
+                    do_compress=True):
+        """
+        Send the contents of `stream` as a single fragmented message, without
+        reading all of it in to memory first. Data messages sent by other
+        greenlets meanwhile wait until it is complete, as RFC 6455 doesn't
+        allow them in between fragments. Control frames do go in between.
+
+        :param stream: A file like object that will be read from in chunks of
+            `fragment_size`, or an iterable of chunks. Chunks larger than
+            `fragment_size` are split over several frames.
+        :param binary: Whether to send a binary or a text message.
+        :param fragment_size: The maximum size of the payload of a frame,
+            before compression.
+        :param do_compress: Whether to compress the frames if the
+            connection negotiated compression.
+        """
+        if self.closed:
+            self.current_app.on_close(MSG_ALREADY_CLOSED)
+            raise WebSocketError(MSG_ALREADY_CLOSED)
+
+        if self.send_queue is not None:
+            # Queued messages go first
+            self.send_queue.wait_empty()
+
+        with self.message_lock:
+            self._send_stream(stream, binary, fragment_size, do_compress)
+
+    def _send_stream(self, stream, binary, fragment_size, do_compress):
+        opcode = message_opcode = (
+            self.OPCODE_BINARY if binary else self.OPCODE_TEXT)
+
+        chunks = _iter_fragments(stream, fragment_size)
+        next_chunk = next(chunks, None)
+        level = 0
+
+        if do_compress and self.do_compress:
+            # The size of the message isn't known up front
+            level = self.compression.level(opcode)
+
+        flags = Header.RSV0_MASK if level else 0
+        size = compressed_size = total = 0
+
+        try:
+            while True:
+                chunk = next_chunk if next_chunk is not None else b''
+                next_chunk = next(chunks, None)
+                fin = next_chunk is None
+
+                if not binary:
+                    chunk = self._encode_bytes(chunk)
+
+                total += len(chunk)
+
+                if level:
+                    size += len(chunk)
+                    chunk = self.deflate(chunk, fin, level)
+                    compressed_size += len(chunk)
+
+                    if not chunk and not fin:
+                        continue
+
+                self.write_frame(fin, opcode, chunk, flags)
+
+                if fin:
+                    break
+
+                # Only the first frame carries the opcode and RSV1 bit
+                opcode = self.OPCODE_CONTINUATION
+                flags = 0
+
+                # Let other greenlets (and control frames) through in between
+                gevent.sleep(0)
+        except WebSocketError:
+            self.current_app.on_close(MSG_SOCKET_DEAD)
+            raise WebSocketError(MSG_SOCKET_DEAD)
+
+        if level:
+            self.compression.record(message_opcode, size, compressed_size)
+
+        if self.metrics is not None:
+            self.metrics.message_size_out.observe(total)
+
+            if level:
+                self.metrics.deflated(size, compressed_size)
+
+    def send_prepared(self, message):
+        """
+        Send a `PreparedMessage`. The frame is only encoded (and compressed)
+        for the first connection it is sent to with the same parameters, the
+        others are sent the very same bytes.
+        """
+        if self.closed:
+            self.current_app.on_close(MSG_ALREADY_CLOSED)
+            raise WebSocketError(MSG_ALREADY_CLOSED)
+
+        if self.metrics is not None:
+            self.metrics.message_size_out.observe(len(message.payload))
+
+        try:
+            if self.send_queue is not None:
+                self.send_queue.put(self.write_prepared, (message,),
+                                    len(message.payload))
+            else:
+                self.write_prepared(message)
+        except WebSocketError:
+            self.current_app.on_close(MSG_SOCKET_DEAD)
+            raise WebSocketError(MSG_SOCKET_DEAD)
+
+    def write_prepared(self, message):
+        """
+        Write the frame of a `PreparedMessage` to the socket.
+        """
+        if (self.compressor is not None and
+                len(message.payload) < PREPARED_CONTEXT_SIZE):
+            self.write_message(message.payload, message.opcode, True)
+            return
+
+        try:
+            with self.message_lock:
+                frame = message.get_frame(self)
+
+                if self.cork_buffer is not None:
+                    self.cork(b'', frame)
+                    return
+
+                with self.write_lock:
+                    self.raw_write(frame)
+        except socket.error:
+            raise WebSocketError(MSG_SOCKET_DEAD)
+
+    def enable_corking(self):
+        """
+        Switch to corked mode: frames aren't written right away, but held back
+        until the sending greenlet yields (or `flush` is called) and then
+        written all at once. Many small messages sent in a row then take a
+        single system call, and fewer TCP segments.
+        """
+        if self.cork_buffer is None:
+            self.cork_buffer = bytearray()
+
+    def cork(self, header, payload=b'', flush=False):
+        """
+        Hold back a frame in corked mode.
+
+        Payloads of at least `WRITEV_MIN_SIZE` octets aren't copied, they
+        are written right away together with whatever is held back.
+
+        :param flush: Whether to flush right away, e.g. for a close frame.
+        """
+        buf = self.cork_buffer
+
+        if self.raw_writev is not None and len(payload) >= WRITEV_MIN_SIZE:
+            self.cork_buffer = bytearray()
+            buffers = (buf, header, payload) if buf else (header, payload)
+
+            try:
+                with self.write_lock:
+                    self.raw_writev(buffers)
+            except socket.error:
+                raise WebSocketError(MSG_SOCKET_DEAD)
+
+            return
+
+        buf += header
+        buf += payload
+
+        if flush or len(buf) >= CORK_BUFFER_SIZE:
+            self.flush()
+        elif not self.flush_scheduled:
+            # Starts once the current greenlet yields to the hub
+            self.flush_scheduled = True
+            gevent.spawn(self._scheduled_flush)
+
+    def flush(self):
+        """
+        Write the frames held back in corked mode.
+        """
+        buf = self.cork_buffer
+
+        if not buf:
+            return
+
+        # Frames corked while this is written go out with the next flush
+        self.cork_buffer = bytearray()
+
+        try:
+            with self.write_lock:
+                self.raw_write(buf)
+        except socket.error:
+            raise WebSocketError(MSG_SOCKET_DEAD)
+
+    def _scheduled_flush(self):
+        self.flush_scheduled = False
+
+        try:
+            self.flush()
+        except WebSocketError as error:
+            # There is no sender to report to, close the connection so that
+            # the next send raises rather than its frames going missing
+            self.close_on_error(error)
+
+    def enable_buffering(self, high_water=1024 * 1024, low_water=None,
+                         high_water_messages=None, low_water_messages=None,
+                         policy=BLOCK):
+        """
+        Switch to buffered mode: data messages are queued and written by a
+        greenlet of their own, so that sending doesn't wait for the client
+        (unless it falls behind and `policy` is ``'block'``).
+
+        Control frames, and the close frame in particular, skip the queue.
+        Use `wait_empty` before `close` to have queued messages go first.
+
+        See `SendQueue` for the watermarks and overflow policies
+        (``'block'``, ``'drop_oldest'``, ``'drop_newest'`` or ``'close'``).
+
+        :returns: The `SendQueue`.
+        """
+        if self.send_queue is None:
+            self.send_queue = SendQueue(
+                self, high_water, low_water, high_water_messages,
+                low_water_messages, policy)
+
+        return self.send_queue
+
+    @property
+    def buffered_amount(self):
+        """
+        The number of octets of payload queued to be sent, in buffered mode.
+        """
+        if self.send_queue is None:
+            return 0
+
+        return self.send_queue.buffered_amount
+
+    def wait_drained(self, timeout=None):
+        """
+        Wait until the send queue is below its low watermarks.
+
+        :returns: Whether it is, `False` if `timeout` expired first.
+        """
+        if self.send_queue is None:
+            return True
+
+        return self.send_queue.wait_drained(timeout)
+
+    def wait_empty(self, timeout=None):
+        """
+        Wait until all queued messages have been written.
+
+        :returns: Whether they have, `False` if `timeout` expired first.
+        """
+        if self.send_queue is None:
+            return True
+
+        return self.send_queue.wait_empty(timeout)
+
     def close(self, code=1000, message=b''):
         """
         Close the websocket and connection, sending the specified code and
@@ -387,6 +1021,8 @@ class WebSocket(object):
 
         if self.closed:
             self.current_app.on_close(MSG_ALREADY_CLOSED)
+        elif self.metrics is not None:
+            self.metrics.close_out(code)
 
         try:
             message = self._encode_bytes(message)
@@ -404,26 +1040,478 @@ class WebSocket(object):
 
             self.stream = None
             self.raw_write = None
+            self.raw_writev = None
             self.raw_read = None
+            self.reader = None
+            self.compressor = None
+            self.decompressor = None
+
+            if self.send_queue is not None:
+                self.send_queue.stop()
+
+            self.cork_buffer = None
 
             self.environ = None
 
             #self.current_app.on_close(MSG_ALREADY_CLOSED)
 
+    def evict(self, code, message=b'', timeout=CLOSE_TIMEOUT):
+        """
+        Close the connection to a peer that may have stopped reading: the
+        close frame is given up on after `timeout` seconds, and the socket is
+        shut down either way, which wakes up the greenlet reading from it.
+        """
+        handler = self.handler
+
+        if not self.closed:
+            with gevent.Timeout(timeout, False):
+                try:
+                    self.close(code, message)
+                except WebSocketError:
+                    pass
+
+        try:
+            handler.socket.shutdown(socket.SHUT_RDWR)
+        except (socket.error, AttributeError):
+            pass
+
+
+def _iter_fragments(stream, size):
+    """
+    Yield the chunks of at most `size` to send of a file like object or an
+    iterable of chunks.
+    """
+    read = getattr(stream, 'read', None)
+
+    if read is not None:
+        while True:
+            chunk = read(size)
+
+            if not chunk:
+                return
+
+            yield chunk
+
+    for chunk in stream:
+        if len(chunk) <= size:
+            if chunk:
+                yield chunk
+        else:
+            for start in range_type(0, len(chunk), size):
+                yield chunk[start:start + size]
+
+
+class MessageStream(object):
+    """
+    Iterates over the payload of a single message as its frames arrive, see
+    `WebSocket.receive_stream`.
+
+    Text messages yield unicode chunks, binary messages byte strings. UTF-8
+    is validated and compressed frames are inflated incrementally, so memory
+    use is bounded by the frame size rather than the message size.
+
+    If the message turns out to be invalid, or larger than the connection's
+    `max_message_size`, the connection is closed and a `WebSocketError` is
+    raised.
+
+    :ivar opcode: The opcode of the message.
+    """
+
+    __slots__ = ('ws', 'opcode', 'chunks')
+
+    def __init__(self, ws, header, payload):
+        self.ws = ws
+        self.opcode = header.opcode
+        self.chunks = self._read_chunks(header.fin, bool(header.flags), payload)
+
+    @property
+    def binary(self):
+        return self.opcode == WebSocket.OPCODE_BINARY
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.chunks)
+        except (UnicodeError, socket.error) as error:
+            if not self.ws.closed:
+                self.ws.close_on_error(error)
+
+            raise WebSocketError(MSG_CLOSED)
+
+    next = __next__
+
+    def _inflate(self, payload, fin):
+        # Limit the output per chunk, a small frame may inflate to a lot
+        decompressor = self.ws.get_decompressor(fin)
+
+        if fin:
+            payload = bytes(payload) + b'\0\0\xff\xff'
+
+        metrics = self.ws.metrics
+        chunk = decompressor.decompress(payload, INFLATE_CHUNK_SIZE)
+
+        if metrics is not None:
+            metrics.inflated(len(payload), 0)
+
+        while chunk:
+            if metrics is not None:
+                metrics.inflated(0, len(chunk))
+
+            yield chunk
+            chunk = decompressor.decompress(
+                decompressor.unconsumed_tail, INFLATE_CHUNK_SIZE)
+
+    def _read_chunks(self, fin, compressed, payload):
+        ws = self.ws
+        text = self.opcode == WebSocket.OPCODE_TEXT
+        # What is left of `max_message_size`, if any
+        remaining = ws.max_message_size
+
+        if text:
+            decoder = _utf8_decoder()
+
+            if PY2:
+                ws.utf8validator.reset()
+
+        while True:
+            chunks = self._inflate(payload, fin) if compressed else (payload,)
+
+            for chunk in chunks:
+                if remaining is not None:
+                    remaining -= len(chunk)
+
+                    if remaining < 0:
+                        raise FrameTooLargeException(
+                            "Message exceeds the maximum of {0} "
+                            "bytes".format(ws.max_message_size))
+
+                if text:
+                    if PY2:
+                        # Python 2 decodes surrogates, validate separately
+                        ws.validate_utf8(chunk)
+
+                    chunk = decoder.decode(chunk)
+                elif not isinstance(chunk, bytes):
+                    chunk = bytes(chunk)
+
+                if chunk:
+                    yield chunk
+
+            if fin:
+                break
+
+            frame = ws.read_message_frame(self.opcode, remaining)
+
+            if frame is None:
+                raise WebSocketError(MSG_CLOSED)
+
+            header, payload = frame
+            fin = header.fin
+
+        if text:
+            # Raises if the message ends halfway a code point
+            decoder.decode(b'', True)
+
+
+class PreparedMessage(object):
+    """
+    A message to send to many connections, e.g. to broadcast an event, with
+    `WebSocket.send_prepared`.
+
+    The message is encoded once. Its frame is built once for uncompressed
+    connections, and once for every combination of compression level and
+    window size the compressed connections use. A message compressed on its
+    own doesn't refer back to earlier ones, so it is also valid for
+    connections with context takeover. Those whose compressor already has a
+    history compress small messages themselves instead, as other messages
+    would. For larger ones they are sent the shared frame, and start over
+    with a fresh compressor for their next message, so that they don't
+    refer back to a message their compressor hasn't seen.
+
+    :param message: The message, text is encoded to UTF-8. Byte strings are
+        sent as is, so for a text message they must be valid UTF-8 already.
+    :param binary: Whether to send a binary or a text message, by default
+        binary unless `message` is a (unicode) string.
+    """
+
+    __slots__ = ('opcode', 'payload', 'frames')
+
+    def __init__(self, message, binary=None):
+        if binary is None:
+            binary = not isinstance(message, string_types)
+
+        if isinstance(message, text_type):
+            message = message.encode('utf-8')
+        elif not isinstance(message, bytes):
+            message = bytes(message) if binary else \
+                text_type(message).encode('utf-8')
+
+        self.opcode = WebSocket.OPCODE_BINARY if binary else \
+            WebSocket.OPCODE_TEXT
+        self.payload = message
+
+        # (frame, compressed payload size) by compression parameters, `None`
+        # for the uncompressed frame
+        self.frames = {}
+
+    def get_frame(self, ws):
+        """
+        :returns: The frame to send to `ws`.
+        """
+        if ws.do_compress:
+            level = ws.compression.level(self.opcode, len(self.payload))
+        else:
+            level = 0
+
+        if level:
+            params = ws.permessage_deflate
+            key = (level, params.server_max_window_bits, params.mem_level)
+        else:
+            key = None
+
+        frame = self.frames.get(key)
+
+        if frame is None:
+            frame = self.frames[key] = self.encode(ws, level)
+
+        if level:
+            ws.compression.record(self.opcode, len(self.payload), frame[1])
+            # The client's window now holds the message, the compressor's
+            # doesn't
+            ws.compressor = None
+
+        metrics = ws.metrics
+
+        if metrics is not None:
+            if level:
+                metrics.deflated(len(self.payload), frame[1])
+                metrics.frame_out(self.opcode, frame[1])
+            else:
+                metrics.frame_out(self.opcode, len(self.payload))
+
+        return frame[0]
+
+    def encode(self, ws, level):
+        payload = self.payload
+
+        if not level:
+            return Header.encode_header(
+                True, self.opcode, b'', len(payload), 0) + payload, None
+
+        compressor = ws.permessage_deflate.compressobj(level)
+        payload = compressor.compress(payload)
+        payload += compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        if payload.endswith(b'\x00\x00\xff\xff'):
+            payload = payload[:-4]
+
+        return Header.encode_header(
+            True, self.opcode, b'', len(payload), Header.RSV0_MASK) + \
+            payload, len(payload)
+
 
 class Stream(object):
     """
     Wraps the handler's socket/rfile attributes and makes it in to a file like
     object that can be read from/written to by the lower level websocket api.
+
+    `recv_into` first hands out whatever the rfile buffered while parsing the
+    HTTP request and then reads from the socket directly. It is `None` if the
+    rfile can't be peeked in to (Python 2).
+
+    `writev` writes a sequence of buffers with `sendmsg`, without joining
+    them first. It is `None` if the socket doesn't support `sendmsg`.
     """
 
-    __slots__ = ('handler', 'read', 'write')
+    __slots__ = ('handler', 'read', 'write', 'recv_into', 'writev')
 
     def __init__(self, handler):
         self.handler = handler
         self.read = handler.rfile.read
         self.write = handler.socket.sendall
 
+        if hasattr(handler.rfile, 'peek'):
+            self.recv_into = self._recv_into_buffered
+        else:
+            self.recv_into = None
+
+        # SSL sockets have a sendmsg method but refuse to use it
+        if (hasattr(handler.socket, 'sendmsg') and
+                not hasattr(handler.socket, 'getpeercert')):
+            self.writev = self._sendmsg_all
+        else:
+            self.writev = None
+
+    def _recv_into_buffered(self, buf):
+        rfile = self.handler.rfile
+        data = rfile.peek()
+        size = min(len(data), len(buf))
+
+        buf[:size] = data[:size]
+        rfile.read(size)
+
+        if size == len(data):
+            # The rfile buffer is drained, skip it from now on
+            self.recv_into = self.handler.socket.recv_into
+
+        return size
+
+    def _sendmsg_all(self, buffers):
+        sendmsg = self.handler.socket.sendmsg
+        buffers = list(buffers)
+
+        while True:
+            sent = sendmsg(buffers)
+
+            # Drop what has been sent and retry with the remainder
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers.pop(0))
+
+            if not buffers:
+                return
+
+            if sent:
+                buffers[0] = memoryview(buffers[0])[sent:]
+
+
+class FrameReader(object):
+    """
+    Decodes frames from a reusable per-connection read buffer.
+
+    Every read fills as much of the buffer as the socket has available, so
+    many small frames are decoded from a single read. The same `Header`
+    instance is returned for every frame, it is only valid until the next
+    call to `read_header`.
+    """
+
+    __slots__ = ('stream', 'buffer', 'view', 'start', 'end', 'header')
+
+    def __init__(self, stream, size=READ_BUFFER_SIZE):
+        self.stream = stream
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.header = Header()
+
+    def _fill(self, size, eof_message):
+        """
+        Block until at least `size` bytes are buffered.
+
+        `size` must not exceed the size of the buffer.
+        """
+        start = self.start
+        available = self.end - start
+
+        if available >= size:
+            return
+
+        if start + size > len(self.buffer):
+            # Move the partial frame to the front to make room for the rest
+            self.view[:available] = self.view[start:self.end]
+            self.start = 0
+            self.end = available
+
+        while self.end - self.start < size:
+            read = self.stream.recv_into(self.view[self.end:])
+
+            if not read:
+                raise WebSocketError(eof_message)
+
+            self.end += read
+
+    def read_header(self, max_length=None):
+        """
+        Decode the next frame header from the buffer.
+
+        :param max_length: The maximum payload length of a data frame to
+            accept, a larger frame raises `FrameTooLargeException`.
+        :returns: The reused `Header` instance.
+        """
+        if self.start == self.end:
+            self.start = self.end = 0
+
+        self._fill(2, "Unexpected EOF while decoding header")
+
+        buf = self.buffer
+        start = self.start
+        first_byte = buf[start]
+        second_byte = buf[start + 1]
+
+        header = self.header
+        header.fin = first_byte & Header.FIN_MASK == Header.FIN_MASK
+        header.opcode = first_byte & Header.OPCODE_MASK
+        header.flags = first_byte & Header.HEADER_FLAG_MASK
+        header.length = length = second_byte & Header.LENGTH_MASK
+
+        if header.opcode > 0x07:
+            header.check_control_frame(bytes(buf[start:start + 2]))
+
+        if length == 126:
+            size = 4
+        elif length == 127:
+            size = 10
+        else:
+            size = 2
+
+        has_mask = second_byte & Header.MASK_MASK == Header.MASK_MASK
+
+        if has_mask:
+            size += 4
+
+        if size > 2:
+            self._fill(size, "Unexpected EOF while decoding header")
+            start = self.start
+
+            if length == 126:
+                header.length = _unpack_H(buf, start + 2)[0]
+            elif length == 127:
+                header.length = _unpack_Q(buf, start + 2)[0]
+
+        # Control frames are limited to 125 octets regardless
+        if (max_length is not None and header.length > max_length and
+                header.opcode < WebSocket.OPCODE_CLOSE):
+            header.raise_too_large(max_length)
+
+        header.mask = bytes(buf[start + size - 4:start + size]) if has_mask else ''
+        self.start = start + size
+
+        return header
+
+    def read_payload(self, header):
+        """
+        Read and unmask the payload of the frame described by `header`.
+
+        :returns: The payload, which is not backed by the read buffer.
+        """
+        length = header.length
+
+        if length <= len(self.buffer):
+            self._fill(length, 'Unexpected EOF reading frame payload')
+            payload = self.view[self.start:self.start + length]
+            self.start += length
+        else:
+            # Read frames larger than the buffer in to a buffer of their own
+            available = self.end - self.start
+            payload = memoryview(bytearray(length))
+            payload[:available] = self.view[self.start:self.end]
+            self.start = self.end = 0
+
+            while available < length:
+                read = self.stream.recv_into(payload[available:])
+
+                if not read:
+                    raise WebSocketError('Unexpected EOF reading frame payload')
+
+                available += read
+
+        if header.mask:
+            return mask(header.mask, payload)
+
+        return payload.tobytes()
+
 
 class Header(object):
     __slots__ = ('fin', 'mask', 'opcode', 'flags', 'length')
@@ -448,17 +1536,32 @@ class Header(object):
         self.length = length
 
     def mask_payload(self, payload):
-        payload = bytearray(payload)
-        mask = bytearray(self.mask)
-
-        for i in range_type(self.length):
-            payload[i] ^= mask[i % 4]
-
-        return payload
+        return mask(self.mask, payload)
 
     # it's the same operation
     unmask_payload = mask_payload
 
+    def check_control_frame(self, data):
+        """
+        Validate the header of a control frame.
+
+        :param data: The first two bytes of the header, for error reporting.
+        """
+        if not self.fin:
+            raise ProtocolError(
+                "Received fragmented control frame: {0!r}".format(data))
+
+        # Control frames MUST have a payload length of 125 bytes or less
+        if self.length > 125:
+            raise ProtocolError(
+                "Control frame cannot be larger than 125 bytes: "
+                "{0!r}".format(data))
+
+    def raise_too_large(self, max_length):
+        raise FrameTooLargeException(
+            "Frame payload of {0} bytes exceeds the maximum of {1} "
+            "bytes".format(self.length, max_length))
+
     def __repr__(self):
         opcodes = {
             0: 'continuation(0)',
@@ -484,11 +1587,13 @@ class Header(object):
         )
 
     @classmethod
-    def decode_header(cls, stream):
+    def decode_header(cls, stream, max_length=None):
         """
         Decode a WebSocket header.
 
         :param stream: A file like object that can be 'read' from.
+        :param max_length: The maximum payload length of a data frame to
+            accept, a larger frame raises `FrameTooLargeException`.
         :returns: A `Header` instance.
         """
         read = stream.read
@@ -508,15 +1613,7 @@ class Header(object):
         has_mask = second_byte & cls.MASK_MASK == cls.MASK_MASK
 
         if header.opcode > 0x07:
-            if not header.fin:
-                raise ProtocolError(
-                    "Received fragmented control frame: {0!r}".format(data))
-
-            # Control frames MUST have a payload length of 125 bytes or less
-            if header.length > 125:
-                raise FrameTooLargeException(
-                    "Control frame cannot be larger than 125 bytes: "
-                    "{0!r}".format(data))
+            header.check_control_frame(data)
 
         if header.length == 126:
             # 16 bit length
@@ -535,6 +1632,11 @@ class Header(object):
 
             header.length = struct.unpack('!Q', data)[0]
 
+        # Control frames are limited to 125 octets regardless
+        if (max_length is not None and header.length > max_length and
+                header.opcode < WebSocket.OPCODE_CLOSE):
+            header.raise_too_large(max_length)
+
         if has_mask:
             mask = read(4)
 
@@ -557,43 +1659,54 @@ class Header(object):
         :param flags: The RSV* flags.
         :return: A bytestring encoded header.
         """
-        first_byte = opcode
-        second_byte = 0
-        extra = b""
-        result = bytearray()
+        first_byte = opcode | (flags & cls.HEADER_FLAG_MASK)
 
         if fin:
             first_byte |= cls.FIN_MASK
 
-        if flags & cls.RSV0_MASK:
-            first_byte |= cls.RSV0_MASK
+        if mask:
+            second_byte = cls.MASK_MASK
+        else:
+            if length < 126:
+                headers = _SHORT_HEADERS.get(first_byte)
 
-        if flags & cls.RSV1_MASK:
-            first_byte |= cls.RSV1_MASK
+                if headers is not None:
+                    return headers[length]
 
-        if flags & cls.RSV2_MASK:
-            first_byte |= cls.RSV2_MASK
+            second_byte = 0
 
-        # now deal with length complexities
         if length < 126:
-            second_byte += length
+            header = _pack_BB(first_byte, second_byte | length)
         elif length <= 0xffff:
-            second_byte += 126
-            extra = struct.pack('!H', length)
+            header = _pack_BBH(first_byte, second_byte | 126, length)
         elif length <= 0xffffffffffffffff:
-            second_byte += 127
-            extra = struct.pack('!Q', length)
+            header = _pack_BBQ(first_byte, second_byte | 127, length)
         else:
             raise FrameTooLargeException
 
         if mask:
-            second_byte |= cls.MASK_MASK
+            header += mask
+
+        return header
 
-        result.append(first_byte)
-        result.append(second_byte)
-        result.extend(extra)
 
-        if mask:
-            result.extend(mask)
+def _build_short_headers():
+    """
+    Precompute the 2 byte headers of unmasked frames shorter than 126 bytes
+    for every opcode, with and without the FIN and RSV1 bits.
+    """
+    headers = {}
+
+    for opcode in (WebSocket.OPCODE_CONTINUATION, WebSocket.OPCODE_TEXT,
+                   WebSocket.OPCODE_BINARY, WebSocket.OPCODE_CLOSE,
+                   WebSocket.OPCODE_PING, WebSocket.OPCODE_PONG):
+        for fin in (0, Header.FIN_MASK):
+            for flags in (0, Header.RSV0_MASK):
+                first_byte = fin | flags | opcode
+                headers[first_byte] = tuple(
+                    _pack_BB(first_byte, length) for length in range_type(126))
+
+    return headers
+
 
-        return result
+_SHORT_HEADERS = _build_short_headers()
@@ -0,0 +1,85 @@
+"""
+Helpers shared by the tests.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from geventwebsocket import WebSocketServer  # noqa: E402
+from geventwebsocket.masking import mask  # noqa: E402
+from geventwebsocket.websocket import Header  # noqa: E402
+
+MASK_KEY = b'\x01\x02\x03\x04'
+
+
+def serve(test, app, **kwargs):
+    """
+    Start a `WebSocketServer` for `app` on a free port, which is stopped
+    when `test` ends.
+
+    :returns: The server and its ``ws://`` URL.
+    """
+    server = WebSocketServer(('127.0.0.1', 0), app, log=None,
+                             error_log=None, **kwargs)
+    server.start()
+    test.addCleanup(server.stop)
+
+    return server, 'ws://127.0.0.1:{0:d}/'.format(server.server_port)
+
+
+def echo_app(environ, start_response):
+    ws = environ['wsgi.websocket']
+
+    while True:
+        message = ws.receive()
+
+        if message is None:
+            break
+
+        ws.send(message)
+
+    return []
+
+
+def client_frame(opcode, payload, fin=True, flags=0, key=MASK_KEY):
+    """
+    :returns: A frame as a client sends it, masked with `key`.
+    """
+    return Header.encode_header(fin, opcode, key, len(payload), flags) + \
+        bytes(mask(key, payload))
+
+
+class ChunkedStream(object):
+    """
+    A stream that hands out `data` in the given chunks, one per call to
+    `recv_into`.
+    """
+
+    def __init__(self, data, sizes):
+        self.chunks = []
+        self.reads = 0
+
+        for size in sizes:
+            self.chunks.append(data[:size])
+            data = data[size:]
+
+        if data:
+            self.chunks.append(data)
+
+    def recv_into(self, buf):
+        if not self.chunks:
+            return 0
+
+        chunk = self.chunks[0]
+        size = min(len(chunk), len(buf))
+        buf[:size] = chunk[:size]
+
+        if size == len(chunk):
+            self.chunks.pop(0)
+        else:
+            self.chunks[0] = chunk[size:]
+
+        self.reads += 1
+
+        return size
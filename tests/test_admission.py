@@ -0,0 +1,170 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gevent  # noqa: E402
+from gevent import socket  # noqa: E402
+
+from geventwebsocket import WebSocketServer  # noqa: E402
+from geventwebsocket.client import connect  # noqa: E402
+from geventwebsocket.exceptions import HandshakeError  # noqa: E402
+from geventwebsocket.handler import WebSocketHandler  # noqa: E402
+from geventwebsocket.websocket import WebSocket  # noqa: E402
+
+
+class BrokenWebSocket(WebSocket):
+    broken = True
+
+    def __init__(self, *args, **kwargs):
+        if BrokenWebSocket.broken:
+            raise RuntimeError("Broken websocket class")
+
+        super(BrokenWebSocket, self).__init__(*args, **kwargs)
+
+
+class BrokenHandler(WebSocketHandler):
+    websocket_class = BrokenWebSocket
+
+
+class AdmissionTest(unittest.TestCase):
+    def test_failed_upgrade_releases_slot(self):
+        def app(environ, start_response):
+            ws = environ['wsgi.websocket']
+            ws.receive()
+            return []
+
+        server = WebSocketServer(('127.0.0.1', 0), app, max_connections=1,
+                                 handler_class=BrokenHandler, log=None,
+                                 error_log=None)
+        server.start()
+        self.addCleanup(server.stop)
+        url = 'ws://127.0.0.1:{0:d}/'.format(server.server_port)
+
+        BrokenWebSocket.broken = True
+        self.addCleanup(setattr, BrokenWebSocket, 'broken', True)
+
+        for _ in range(3):
+            self.assertRaises(HandshakeError, connect, url, timeout=5)
+
+        self.assertEqual(server.admission.connections, 0)
+
+        BrokenWebSocket.broken = False
+        ws = connect(url, timeout=5)
+        self.assertEqual(server.admission.connections, 1)
+
+        ws.close()
+
+        with gevent.Timeout(5):
+            while server.admission.connections:
+                gevent.sleep(0.01)
+
+
+class DeferringHandler(WebSocketHandler):
+    """
+    Serves the websocket itself after the upgrade, as Socket.IO does.
+    """
+
+    prevent_wsgi_call = True
+
+    def run_application(self):
+        super(DeferringHandler, self).run_application()
+
+        ws = getattr(self, 'websocket', None)
+
+        if ws is not None:
+            ws.receive()
+
+
+class PreventWsgiCallTest(unittest.TestCase):
+    def test_released_on_close(self):
+        def app(environ, start_response):
+            raise AssertionError("The handler serves the websocket")
+
+        server = WebSocketServer(('127.0.0.1', 0), app, max_connections=1,
+                                 handler_class=DeferringHandler, log=None,
+                                 error_log=None)
+        server.start()
+        self.addCleanup(server.stop)
+        url = 'ws://127.0.0.1:{0:d}/'.format(server.server_port)
+
+        ws = connect(url, timeout=5)
+        self.addCleanup(ws.handler.close)
+
+        with gevent.Timeout(5):
+            while not server.admission.connections:
+                gevent.sleep(0.01)
+
+        gevent.sleep(0.05)
+        self.assertEqual(server.admission.connections, 1)
+        self.assertRaises(HandshakeError, connect, url, timeout=5)
+
+        ws.close()
+
+        with gevent.Timeout(5):
+            while server.admission.connections:
+                gevent.sleep(0.01)
+
+        connect(url, timeout=5).close()
+
+
+class ErrorBodyTest(unittest.TestCase):
+    def request(self, port, headers):
+        sock = socket.create_connection(('127.0.0.1', port))
+        self.addCleanup(sock.close)
+        sock.sendall(
+            b'GET / HTTP/1.1\r\nHost: localhost\r\n'
+            b'Upgrade: websocket\r\nConnection: Upgrade\r\n' +
+            headers + b'\r\n')
+        response = b''
+
+        with gevent.Timeout(5):
+            while b'\r\n\r\n' not in response:
+                response += self.recv(sock)
+
+            head, body = response.split(b'\r\n\r\n', 1)
+            length = int(head.lower().split(
+                b'content-length: ')[1].split(b'\r\n')[0])
+
+            while len(body) < length:
+                body += self.recv(sock)
+
+        return head.split(b'\r\n')[0], body
+
+    def recv(self, sock):
+        data = sock.recv(4096)
+        self.assertTrue(data, "Connection closed")
+
+        return data
+
+    def test_bodies(self):
+        def app(environ, start_response):
+            ws = environ['wsgi.websocket']
+            ws.receive()
+            return []
+
+        server = WebSocketServer(('127.0.0.1', 0), app, max_connections=0,
+                                 log=None, error_log=None)
+        server.start()
+        self.addCleanup(server.stop)
+        port = server.server_port
+
+        self.assertEqual(self.request(port, b''), (
+            b'HTTP/1.1 426 Upgrade Required',
+            b'No Websocket protocol version defined'))
+        self.assertEqual(self.request(port, b'Sec-WebSocket-Version: 1\r\n'), (
+            b'HTTP/1.1 400 Bad Request',
+            b'Unsupported WebSocket Version: 1'))
+        self.assertEqual(self.request(
+            port, b'Sec-WebSocket-Version: 13\r\nSec-WebSocket-Key: \xe9\r\n'),
+            (b'HTTP/1.1 400 Bad Request', b'Invalid key: \xe9'))
+
+        status, body = self.request(
+            port, b'Sec-WebSocket-Version: 13\r\n'
+            b'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n')
+        self.assertEqual(status, b'HTTP/1.1 503 Service Unavailable')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gevent  # noqa: E402
+from gevent import socket  # noqa: E402
+
+from geventwebsocket.backplane import (  # noqa: E402
+    Broker, UnixBackplane, SUBSCRIBE, encode_record)
+
+TOPIC = 'test'
+
+
+class BrokerTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+
+        self.broker = Broker(os.path.join(directory, 'backplane.sock'))
+        self.broker.start()
+        self.addCleanup(self.broker.stop)
+
+    def attach(self):
+        backplane = UnixBackplane(self.broker.path, reconnect_delay=0.05)
+        self.addCleanup(backplane.close)
+        self.assertTrue(backplane.wait_connected(5))
+
+        return backplane
+
+    def wait_subscribers(self, count):
+        with gevent.Timeout(5):
+            while len(self.broker.subscriptions.get(TOPIC, ())) < count:
+                gevent.sleep(0.01)
+
+    def test_stalled_subscriber(self):
+        count = 100
+        payload = b'x' * 70000
+
+        # Subscribes, then never reads
+        stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        stalled.connect(self.broker.path)
+        stalled.sendall(encode_record(SUBSCRIBE, TOPIC))
+        self.addCleanup(stalled.close)
+
+        received = []
+        live = self.attach()
+        live.subscribe(TOPIC, lambda topic, data: received.append(len(data)))
+
+        publisher = self.attach()
+        self.wait_subscribers(2)
+
+        # Publishing doesn't wait for anyone
+        with gevent.Timeout(1):
+            for _ in range(count):
+                publisher.publish(TOPIC, payload)
+
+        with gevent.Timeout(10):
+            while len(received) < count:
+                gevent.sleep(0.01)
+
+        self.assertEqual(received, [len(payload)] * count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import support  # noqa: F401
+
+from geventwebsocket import bench, masking, websocket
+from geventwebsocket.bench import Case, MIN_MESSAGES, __main__ as cli
+from geventwebsocket.server import WebSocketServer
+
+DURATION = 0.01
+
+# The pure Python masking backend, always available
+PURE = masking.BACKENDS[0][0]
+
+
+class BenchTest(unittest.TestCase):
+    def setUp(self):
+        self.server = WebSocketServer(('127.0.0.1', 0), bench.echo, log=None,
+                                      error_log=None)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def test_cases(self):
+        backends = [name for name, _ in masking.BACKENDS]
+        all_cases = list(bench.cases((16, 1024)))
+
+        self.assertEqual(len(all_cases), 2 * 2 * 2 * 2 * len(backends))
+        self.assertEqual(len(set(case.key for case in all_cases)),
+                         len(all_cases))
+        self.assertEqual(
+            set(case.masking for case in bench.cases((16,), [PURE])),
+            set([PURE]))
+
+    def test_payload(self):
+        text = Case(1000).payload()
+        self.assertEqual(len(text), 1000)
+        self.assertEqual(text.decode('utf-8')[:3], u'The')
+        self.assertEqual(len(Case(1000, binary=True).payload()), 1000)
+
+    def test_percentile(self):
+        values = list(range(1, 1001))
+
+        self.assertEqual(bench.percentile(values, 0.5), 500)
+        self.assertEqual(bench.percentile(values, 0.99), 990)
+        self.assertEqual(bench.percentile(values, 0.999), 999)
+        self.assertEqual(bench.percentile([7], 0.999), 7)
+
+    def test_run_case(self):
+        port = self.server.server_port
+
+        for case in [Case(16), Case(5000, binary=True, fragmented=True),
+                     Case(5000, deflate=True, fragmented=True),
+                     Case(100, binary=True, deflate=True, masking=PURE)]:
+            result = bench.run_case(case, port, DURATION)
+
+            self.assertGreaterEqual(result['messages'], MIN_MESSAGES)
+            self.assertGreater(result['messages_per_sec'], 0)
+            self.assertEqual(result['size'], case.size)
+            self.assertEqual(result['deflate'], case.deflate)
+            latency = result['latency_ms']
+            self.assertLessEqual(latency['p50'], latency['p99'])
+            self.assertLessEqual(latency['p99'], latency['p999'])
+
+    def test_masking_backend_restored(self):
+        previous = websocket.mask
+
+        with bench.masking_backend(PURE):
+            self.assertIs(websocket.mask, dict(masking.BACKENDS)[PURE])
+
+        self.assertIs(websocket.mask, previous)
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def main(self, *args):
+        path = os.path.join(self.directory, 'output.txt')
+
+        with open(path, 'w') as out:
+            stdout = sys.stdout
+            sys.stdout = out
+
+            try:
+                cli.main(['--sizes', '16', '--masking', PURE,
+                          '--duration', str(DURATION)] + list(args))
+            finally:
+                sys.stdout = stdout
+
+        with open(path) as f:
+            return f.read().splitlines()
+
+    def test_json_and_compare(self):
+        path = os.path.join(self.directory, 'results.json')
+        lines = self.main('--json', path)
+
+        # A header and a row per case
+        self.assertEqual(len(lines), 1 + 8)
+
+        with open(path) as f:
+            results = json.load(f)
+
+        self.assertEqual(len(results['results']), 8)
+        self.assertEqual(results['duration'], DURATION)
+        self.assertIn('gevent', results['environment'])
+
+        lines = self.main('--compare', path)
+        self.assertTrue(lines[0].endswith('change'))
+        self.assertTrue(all('%' in line for line in lines[1:]))
@@ -0,0 +1,170 @@
+import unittest
+
+import gevent
+from gevent.event import Event
+
+from support import serve
+
+from geventwebsocket import PreparedMessage
+from geventwebsocket.client import connect
+from geventwebsocket.handler import Client
+
+
+def wait_app(environ, start_response):
+    ws = environ['wsgi.websocket']
+
+    while ws.receive() is not None:
+        pass
+
+    return []
+
+
+class FakeWebSocket(object):
+    """
+    Records what is sent to it, sending blocks until `unblocked` is set.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self.sent = []
+        self.unblocked = Event()
+
+    def send_prepared(self, message):
+        self.unblocked.wait()
+        self.sent.append(message.payload)
+
+    def send(self, message):
+        self.unblocked.wait()
+        self.sent.append(message)
+
+
+class ClientTest(unittest.TestCase):
+    def test_enqueue(self):
+        ws = FakeWebSocket()
+        ws.unblocked.set()
+        client = Client(('127.0.0.1', 1), ws)
+        self.addCleanup(client.close)
+
+        self.assertIsNone(client.writer)
+        self.assertTrue(client.enqueue(PreparedMessage(b'prepared')))
+        self.assertTrue(client.enqueue(u'text'))
+        gevent.sleep(0.01)
+
+        self.assertEqual(ws.sent, [b'prepared', u'text'])
+
+    def test_full_queue_drops(self):
+        ws = FakeWebSocket()
+        client = Client(('127.0.0.1', 1), ws, max_queue_size=2)
+        self.addCleanup(client.close)
+
+        self.assertTrue(client.enqueue(b'1'))
+        # The writer takes the first message and blocks sending it
+        gevent.sleep(0.01)
+        self.assertTrue(client.enqueue(b'2'))
+        self.assertTrue(client.enqueue(b'3'))
+        self.assertFalse(client.enqueue(b'4'))
+        self.assertEqual(client.dropped, 1)
+
+        ws.unblocked.set()
+        gevent.sleep(0.01)
+        self.assertEqual(ws.sent, [b'1', b'2', b'3'])
+
+    def test_closed(self):
+        ws = FakeWebSocket()
+        ws.closed = True
+        client = Client(('127.0.0.1', 1), ws)
+
+        self.assertFalse(client.enqueue(b'message'))
+        self.assertIsNone(client.queue)
+
+
+class BroadcastTest(unittest.TestCase):
+    def start(self, count):
+        server, url = serve(self, wait_app)
+        clients = []
+
+        for i in range(count):
+            ws = connect(url)
+            self.addCleanup(ws.close)
+            clients.append(ws)
+
+        with gevent.Timeout(5):
+            while len(server.clients) < count:
+                gevent.sleep(0.01)
+
+        return server, clients
+
+    def test_broadcast(self):
+        server, clients = self.start(3)
+
+        self.assertEqual(server.broadcast(u'hello'), 3)
+        self.assertEqual(server.broadcast(b'\x00\x01'), 3)
+
+        for ws in clients:
+            with gevent.Timeout(5):
+                self.assertEqual(ws.receive(), u'hello')
+                self.assertEqual(ws.receive(), b'\x00\x01')
+
+    def test_filter(self):
+        server, clients = self.start(3)
+        port = clients[0].handler.socket.getsockname()[1]
+
+        def others(client):
+            return client.address[1] != port
+
+        self.assertEqual(server.broadcast(u'hello', filter=others), 2)
+        self.assertEqual(server.broadcast(u'all'), 3)
+
+        with gevent.Timeout(5):
+            self.assertEqual(clients[0].receive(), u'all')
+
+            for ws in clients[1:]:
+                self.assertEqual(ws.receive(), u'hello')
+                self.assertEqual(ws.receive(), u'all')
+
+    def test_encoded_once(self):
+        server, clients = self.start(3)
+        message = PreparedMessage(u'hello')
+
+        self.assertEqual(server.broadcast(message), 3)
+
+        for ws in clients:
+            with gevent.Timeout(5):
+                self.assertEqual(ws.receive(), u'hello')
+
+        self.assertEqual(list(message.frames), [None])
+
+    def test_slow_client_does_not_block(self):
+        server, clients = self.start(2)
+
+        for client in server.clients.values():
+            # Fill the slow client's queue with messages that are never sent
+            if client.address[1] == \
+                    clients[0].handler.socket.getsockname()[1]:
+                client.ws = FakeWebSocket()
+                client.max_queue_size = 1
+
+        with gevent.Timeout(1):
+            for i in range(10):
+                server.broadcast(u'message {0:d}'.format(i))
+
+        with gevent.Timeout(5):
+            for i in range(10):
+                self.assertEqual(clients[1].receive(),
+                                 u'message {0:d}'.format(i))
+
+        slow = [c for c in server.clients.values() if c.dropped]
+        self.assertEqual(len(slow), 1)
+        # Broadcasting doesn't yield to the writer, only one message fits
+        self.assertEqual(slow[0].dropped, 9)
+
+    def test_disconnected_client_removed(self):
+        server, clients = self.start(2)
+
+        clients[0].close()
+
+        with gevent.Timeout(5):
+            while len(server.clients) > 1:
+                gevent.sleep(0.01)
+
+        self.assertEqual(server.broadcast(u'hello'), 1)
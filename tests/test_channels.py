@@ -0,0 +1,202 @@
+import json
+import unittest
+
+import support  # noqa: F401
+
+from geventwebsocket.backplane import InProcessBackplane
+from geventwebsocket.protocols.wamp import (BACKPLANE_PREFIX_TOPIC,
+                                            BACKPLANE_TOPIC, Channels)
+
+PREFIX = 'http://example.com/chat/'
+LOBBY = PREFIX + 'lobby'
+
+
+class FakeWebSocket(object):
+    closed = False
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.ws = FakeWebSocket()
+        self.events = []
+
+    def enqueue(self, message):
+        if self.ws.closed:
+            return False
+
+        self.events.append(json.loads(message.payload.decode('utf-8')))
+        return True
+
+
+class ChannelsTest(unittest.TestCase):
+    def setUp(self):
+        self.channels = Channels()
+        self.channels.create(LOBBY)
+        self.channels.create(PREFIX + 'rooms/', prefix_matching=True)
+        self.clients = dict((session_id, FakeClient())
+                            for session_id in ('a', 'b', 'c'))
+
+    def subscribe(self, uri, *session_ids):
+        for session_id in session_ids:
+            self.assertTrue(self.channels.subscribe(
+                uri, self.clients[session_id], session_id))
+
+    def received(self):
+        """
+        :returns: The session ids that received an event since last asked.
+        """
+        received = sorted(session_id for session_id, client in
+                          self.clients.items() if client.events)
+
+        for client in self.clients.values():
+            del client.events[:]
+
+        return received
+
+    def test_subscribe(self):
+        self.subscribe(LOBBY, 'a', 'b')
+        self.assertFalse(self.channels.subscribe(
+            PREFIX + 'other', self.clients['c'], 'c'))
+
+        self.assertEqual(self.channels.publish(LOBBY, {'n': 1}), 2)
+        self.assertEqual(self.clients['a'].events, [[8, LOBBY, {'n': 1}]])
+        self.assertEqual(self.received(), ['a', 'b'])
+
+        self.channels.unsubscribe(LOBBY, self.clients['a'], 'a')
+        self.channels.publish(LOBBY, None)
+        self.assertEqual(self.received(), ['b'])
+
+        # A created channel stays without subscribers
+        self.channels.unsubscribe_all(self.clients['b'], 'b')
+        self.assertEqual(self.channels.publish(LOBBY, None), 0)
+        self.assertEqual(self.channels.channels, {LOBBY: {}})
+        self.assertEqual(self.channels.sessions, {})
+
+    def test_exclude_and_eligible(self):
+        self.subscribe(LOBBY, 'a', 'b', 'c')
+
+        self.assertEqual(self.channels.publish(LOBBY, None, ['a', 'x']), 2)
+        self.assertEqual(self.received(), ['b', 'c'])
+
+        self.assertEqual(self.channels.publish(LOBBY, None, None,
+                                               ['c', 'x']), 1)
+        self.assertEqual(self.received(), ['c'])
+
+        self.assertEqual(self.channels.publish(LOBBY, None, ['c'],
+                                               ['b', 'c']), 1)
+        self.assertEqual(self.received(), ['b'])
+
+    def test_wildcard(self):
+        rooms = PREFIX + 'rooms/'
+        self.subscribe(rooms + 'x', 'a')
+        self.subscribe(rooms + '*', 'b')
+        self.subscribe(rooms + 'x*', 'a', 'c')
+        self.assertFalse(self.channels.subscribe(
+            PREFIX + '*', self.clients['c'], 'c'))
+
+        # A session matching through several subscriptions gets one event
+        self.assertEqual(self.channels.publish(rooms + 'x', None), 3)
+        self.assertEqual(self.clients['a'].events, [[8, rooms + 'x', None]])
+        self.assertEqual(self.received(), ['a', 'b', 'c'])
+
+        self.channels.publish(rooms + 'y', None)
+        self.assertEqual(self.received(), ['b'])
+
+        self.channels.publish(rooms + 'x', None, ['b'], ['a', 'b'])
+        self.assertEqual(self.received(), ['a'])
+
+        # Topics subscribed to under a prefix channel, and the nodes of
+        # wildcards, go with their last subscriber
+        for session_id in ('a', 'b', 'c'):
+            self.channels.unsubscribe_all(self.clients[session_id],
+                                          session_id)
+
+        self.assertEqual(self.channels.publish(rooms + 'x', None), 0)
+        self.assertNotIn(rooms + 'x', self.channels.channels)
+        self.assertEqual(self.channels.trie, self.fresh_trie())
+
+    def fresh_trie(self):
+        channels = Channels()
+        channels.create(PREFIX + 'rooms/', prefix_matching=True)
+        return channels.trie
+
+    def test_dead_clients_removed(self):
+        self.subscribe(LOBBY, 'a', 'b')
+        self.subscribe(PREFIX + 'rooms/*', 'a')
+        self.clients['a'].ws.closed = True
+
+        self.assertEqual(self.channels.publish(LOBBY, None), 1)
+        self.assertEqual(self.channels.channels[LOBBY],
+                         {'b': self.clients['b']})
+        self.assertNotIn('a', self.channels.sessions)
+        self.assertEqual(self.channels.trie, self.fresh_trie())
+
+
+class BackplaneTest(unittest.TestCase):
+    """
+    `Channels` of two processes, attached to the same backplane.
+    """
+
+    def setUp(self):
+        self.backplane = InProcessBackplane()
+        self.first = self.create()
+        self.second = self.create()
+
+    def create(self):
+        channels = Channels(self.backplane)
+        channels.create(LOBBY)
+        channels.create(PREFIX + 'rooms/', prefix_matching=True)
+        return channels
+
+    def test_topics(self):
+        rooms = PREFIX + 'rooms/'
+        first, second = FakeClient(), FakeClient()
+
+        # Nothing is subscribed to before a client subscribes
+        self.assertEqual(self.backplane.subscribers, {})
+
+        self.first.subscribe(LOBBY, first, 'a')
+        self.second.subscribe(rooms + 'x*', second, 'b')
+        self.second.subscribe(rooms + 'y', second, 'b')
+        self.assertEqual(sorted(self.backplane.subscribers), [
+            BACKPLANE_TOPIC.format(LOBBY),
+            BACKPLANE_TOPIC.format(rooms + 'y'),
+            BACKPLANE_PREFIX_TOPIC.format(rooms)])
+
+        # Events go to the process with subscribers of their topic
+        self.second.publish(LOBBY, 1)
+        self.assertEqual(first.events, [[8, LOBBY, 1]])
+        self.assertEqual(second.events, [])
+
+        self.first.publish(rooms + 'x1', 2, None, ['b'])
+        self.first.publish(rooms + 'z', 3)
+        self.first.publish(rooms + 'y', 4, ['b'])
+        self.assertEqual(second.events, [[8, rooms + 'x1', 2]])
+        self.assertEqual(first.events, [[8, LOBBY, 1]])
+
+        self.second.unsubscribe_all(second, 'b')
+        self.first.unsubscribe(LOBBY, first, 'a')
+        self.assertEqual(self.backplane.subscribers, {})
+
+    def test_delivered_once(self):
+        rooms = PREFIX + 'rooms/'
+        client = FakeClient()
+
+        # Subscribed to the topic and its prefix channel on the backplane
+        self.second.subscribe(rooms + 'x', client, 'a')
+        self.second.subscribe(rooms + '*', client, 'a')
+        self.second.subscribe(rooms + 'x*', client, 'a')
+
+        self.first.publish(rooms + 'x', None)
+        self.assertEqual(client.events, [[8, rooms + 'x', None]])
+
+        # The prefix topic is kept until the last wildcard goes
+        self.second.unsubscribe(rooms + '*', client, 'a')
+        self.assertIn(BACKPLANE_PREFIX_TOPIC.format(rooms),
+                      self.backplane.subscribers)
+
+        self.second.unsubscribe(rooms + 'x*', client, 'a')
+        self.first.publish(rooms + 'x', None)
+        self.assertEqual(len(client.events), 2)
+        self.assertEqual(list(self.backplane.subscribers),
+                         [BACKPLANE_TOPIC.format(rooms + 'x')])
@@ -0,0 +1,267 @@
+import base64
+import hashlib
+import unittest
+
+import gevent
+from gevent.server import StreamServer
+
+from support import echo_app, serve
+
+from geventwebsocket.client import (ClientWebSocket, ConnectionPool,
+                                    accept_response, connect)
+from geventwebsocket.exceptions import HandshakeError, WebSocketError
+from geventwebsocket.masking import mask
+
+GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class FakeServer(object):
+    """
+    Answers the handshake with `respond(request headers)`, then records the
+    first frame the client sends.
+    """
+
+    def __init__(self, test, respond):
+        self.respond = respond
+        self.requests = []
+        self.frames = []
+        self.server = StreamServer(('127.0.0.1', 0), self.handle)
+        self.server.start()
+        test.addCleanup(self.server.stop)
+        self.url = 'ws://127.0.0.1:{0:d}/path?query=1'.format(
+            self.server.server_port)
+
+    def handle(self, sock, address):
+        rfile = sock.makefile('rb')
+        lines = []
+
+        while True:
+            line = rfile.readline().rstrip(b'\r\n')
+
+            if not line:
+                break
+
+            lines.append(line)
+
+        headers = {}
+
+        for line in lines[1:]:
+            name, value = line.split(b':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+        self.requests.append((lines[0], headers))
+        response = self.respond(headers)
+        sock.sendall(response)
+
+        # Without a response the connection is dropped
+        data = rfile.read(2) if response else b''
+
+        if len(data) == 2:
+            first, second = bytearray(data)
+            length = second & 0x7f
+            key = rfile.read(4) if second & 0x80 else b''
+            payload = rfile.read(length)
+            self.frames.append((first, bool(key), bytes(
+                mask(key, payload) if key else payload)))
+
+        rfile.close()
+        sock.close()
+
+
+def accept(headers):
+    return base64.b64encode(hashlib.sha1(
+        headers[b'sec-websocket-key'] + GUID).digest())
+
+
+def switching(*extra):
+    def respond(headers):
+        return (b'HTTP/1.1 101 Switching Protocols\r\n'
+                b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                b'Sec-WebSocket-Accept: ' + accept(headers) + b'\r\n' +
+                b''.join(line + b'\r\n' for line in extra) + b'\r\n')
+
+    return respond
+
+
+class HandshakeTest(unittest.TestCase):
+    def test_request(self):
+        server = FakeServer(self, switching(b'Sec-WebSocket-Protocol: chat'))
+        ws = connect(server.url, protocols=['chat', 'other'],
+                     origin='http://example.com', headers=[('X-Token', 'a')],
+                     compress=True, timeout=5)
+        self.addCleanup(ws.close)
+
+        request_line, headers = server.requests[0]
+        self.assertEqual(request_line, b'GET /path?query=1 HTTP/1.1')
+        self.assertEqual(headers[b'host'], server.url[5:].split('/')[0]
+                         .encode('ascii'))
+        self.assertEqual(headers[b'upgrade'], b'websocket')
+        self.assertEqual(headers[b'sec-websocket-version'], b'13')
+        self.assertEqual(len(base64.b64decode(
+            headers[b'sec-websocket-key'])), 16)
+        self.assertEqual(headers[b'origin'], b'http://example.com')
+        self.assertEqual(headers[b'sec-websocket-protocol'], b'chat, other')
+        self.assertEqual(headers[b'sec-websocket-extensions'],
+                         b'permessage-deflate; client_max_window_bits')
+        self.assertEqual(headers[b'x-token'], b'a')
+
+        self.assertIsInstance(ws, ClientWebSocket)
+        self.assertEqual(ws.protocol, 'chat')
+        self.assertEqual(ws.path, '/path')
+        self.assertIsNone(ws.permessage_deflate)
+
+    def test_frames_masked(self):
+        server = FakeServer(self, switching())
+        ws = connect(server.url, timeout=5)
+        self.addCleanup(ws.close)
+
+        ws.send(u'hello')
+
+        with gevent.Timeout(5):
+            while not server.frames:
+                gevent.sleep(0.01)
+
+        self.assertEqual(server.frames, [(0x81, True, b'hello')])
+
+    def test_refused(self):
+        for respond, message in [
+                (lambda headers: b'HTTP/1.1 404 Not Found\r\n'
+                 b'Content-Length: 0\r\n\r\n', 'refused'),
+                (lambda headers: b'HTTP/1.1 101 Switching Protocols\r\n'
+                 b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                 b'Sec-WebSocket-Accept: d3Jvbmc=\r\n\r\n',
+                 'Sec-WebSocket-Accept'),
+                (switching(b'Sec-WebSocket-Protocol: other'), 'protocol'),
+                (switching(b'Sec-WebSocket-Extensions: permessage-deflate'),
+                 'extension'),
+                (lambda headers: b'', 'closed')]:
+            server = FakeServer(self, respond)
+
+            with self.assertRaises(HandshakeError) as context:
+                connect(server.url, protocols=['chat'], timeout=5)
+
+            self.assertIn(message, str(context.exception))
+
+        self.assertRaises(ValueError, connect, 'http://127.0.0.1/')
+
+    def test_accept_response(self):
+        params = accept_response(
+            'permessage-deflate; server_no_context_takeover; '
+            'client_max_window_bits=10; server_max_window_bits=12')
+
+        # Mirrored: the client compresses with the client parameters
+        self.assertTrue(params.client_no_context_takeover)
+        self.assertFalse(params.server_no_context_takeover)
+        self.assertEqual(params.server_max_window_bits, 10)
+        self.assertEqual(params.client_max_window_bits, 12)
+
+        for header in ('x-webkit-deflate-frame',
+                       'permessage-deflate, permessage-deflate',
+                       'permessage-deflate; client_max_window_bits=8',
+                       'permessage-deflate; server_max_window_bits=99'):
+            self.assertRaises(HandshakeError, accept_response, header)
+
+
+class EchoTest(unittest.TestCase):
+    def setUp(self):
+        server, self.url = serve(self, echo_app)
+
+    def echo(self, ws, messages):
+        for message in messages:
+            ws.send(message)
+
+            with gevent.Timeout(5):
+                self.assertEqual(ws.receive(), message)
+
+    def test_echo(self):
+        ws = connect(self.url)
+        self.addCleanup(ws.close)
+
+        self.echo(ws, [u'h\xe9llo', b'\x00\xff', b'x' * 70000])
+
+        ws.send_stream([b'ab', b'cd'])
+
+        with gevent.Timeout(5):
+            self.assertEqual(ws.receive(), b'abcd')
+
+    def test_compressed(self):
+        for no_context_takeover in (False, True):
+            ws = connect(self.url, compress=True,
+                         deflate_no_context_takeover=no_context_takeover)
+            self.addCleanup(ws.close)
+
+            self.assertIsNotNone(ws.permessage_deflate)
+            self.assertEqual(
+                ws.permessage_deflate.server_no_context_takeover,
+                no_context_takeover)
+            self.echo(ws, [u'hello world ' * 100] * 3)
+
+    def test_close(self):
+        ws = connect(self.url)
+        ws.close()
+
+        self.assertTrue(ws.closed)
+        self.assertRaises(WebSocketError, ws.send, u'closed')
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        server, url = serve(self, echo_app)
+        self.pool = ConnectionPool(url, size=2)
+        self.addCleanup(self.pool.close)
+
+    def test_reuse(self):
+        with self.pool.connection() as first:
+            first.send(u'1')
+
+            with gevent.Timeout(5):
+                self.assertEqual(first.receive(), u'1')
+
+        with self.pool.connection() as second:
+            self.assertIs(second, first)
+
+    def test_size(self):
+        first = self.pool.get()
+        second = self.pool.get()
+        self.assertIsNot(first, second)
+
+        self.assertRaises(WebSocketError, self.pool.get, 0.05)
+
+        # A waiting caller gets the connection that is returned
+        waiter = gevent.spawn(self.pool.get, 5)
+        gevent.sleep(0.01)
+        self.pool.put(first)
+        self.assertIs(waiter.get(timeout=5), first)
+
+        self.pool.put(first)
+        self.pool.put(second)
+
+    def test_closed_connections_dropped(self):
+        with self.pool.connection() as first:
+            pass
+
+        first.close()
+
+        with self.pool.connection() as second:
+            self.assertIsNot(second, first)
+
+        self.assertRaises(ZeroDivisionError, self.use_and_fail)
+        self.assertTrue(second.closed)
+        self.assertEqual(len(self.pool.idle), 0)
+
+    def use_and_fail(self):
+        with self.pool.connection():
+            1 / 0
+
+    def test_max_idle(self):
+        self.pool.max_idle = 0.01
+
+        with self.pool.connection() as first:
+            pass
+
+        gevent.sleep(0.05)
+
+        with self.pool.connection() as second:
+            self.assertIsNot(second, first)
+
+        self.assertTrue(first.closed)
@@ -0,0 +1,132 @@
+import os
+import unittest
+
+import gevent
+
+from support import serve
+
+from geventwebsocket.client import connect
+from geventwebsocket.deflate import CompressionPolicy
+from geventwebsocket.websocket import Header, WebSocket
+
+TEXT = WebSocket.OPCODE_TEXT
+BINARY = WebSocket.OPCODE_BINARY
+
+
+class CompressionPolicyTest(unittest.TestCase):
+    def start(self, policy, compress=True, **kwargs):
+        """
+        Start a server that sends whatever it receives back, and connect to
+        it.
+
+        :returns: The client and the server's end of the connection.
+        """
+        server_sockets = []
+
+        def app(environ, start_response):
+            ws = environ['wsgi.websocket']
+            server_sockets.append(ws)
+
+            while True:
+                message = ws.receive()
+
+                if message is None:
+                    break
+
+                ws.send(message)
+
+            return []
+
+        server, url = serve(self, app, compression_policy=policy, **kwargs)
+        ws = connect(url, compress=compress)
+        self.addCleanup(ws.close)
+
+        ws.send(u'hello')
+        self.assertEqual(ws.receive(), u'hello')
+
+        return ws, server_sockets[0]
+
+    def echo_compressed(self, ws, message):
+        """
+        Send `message` to be echoed.
+
+        :returns: Whether the echo was compressed.
+        """
+        ws.send(message)
+
+        with gevent.Timeout(5):
+            header, payload = ws.read_frame()
+
+        compressed = bool(header.flags & Header.RSV0_MASK)
+
+        if compressed:
+            payload = ws.inflate(payload, header.fin)
+
+        if header.opcode == TEXT:
+            payload = bytes(payload).decode('utf-8')
+
+        self.assertEqual(payload, message)
+
+        return compressed
+
+    def test_uncompressed_connection_has_no_tracker(self):
+        ws, server_ws = self.start(CompressionPolicy(), compress=False)
+
+        self.assertIsNone(server_ws.compression)
+        self.assertIsNone(server_ws.permessage_deflate)
+
+    def test_min_size(self):
+        ws, server_ws = self.start(CompressionPolicy(min_size=100))
+
+        self.assertFalse(self.echo_compressed(ws, u'x' * 99))
+        self.assertTrue(self.echo_compressed(ws, u'x' * 100))
+
+    def test_backs_off_incompressible_data(self):
+        policy = CompressionPolicy(min_size=0, sample_size=10000,
+                                   retry_after=3)
+        ws, server_ws = self.start(policy)
+
+        results = [self.echo_compressed(ws, os.urandom(5000))
+                   for _ in range(7)]
+
+        # Two messages fill the sample, then three are sent as is
+        self.assertEqual(results, [True, True, False, False, False, True,
+                                   True])
+
+        # Text compresses fine, and is tracked separately
+        self.assertTrue(self.echo_compressed(ws, u'text ' * 100))
+
+    def test_level_kept_with_context_takeover(self):
+        policy = CompressionPolicy(min_size=0, level=9, levels={BINARY: 1})
+        ws, server_ws = self.start(policy)
+        compressor = server_ws.compressor
+
+        for _ in range(5):
+            self.assertTrue(self.echo_compressed(ws, b'binary ' * 200))
+            self.assertTrue(self.echo_compressed(ws, u'text ' * 200))
+
+        # Switching opcodes didn't start over with a new compressor
+        self.assertIs(server_ws.compressor, compressor)
+        self.assertEqual(server_ws.compressor_level, 9)
+
+    def test_levels_without_context_takeover(self):
+        policy = CompressionPolicy(min_size=0, level=9, levels={BINARY: 1})
+        ws, server_ws = self.start(policy, deflate_no_context_takeover=True)
+
+        self.assertTrue(self.echo_compressed(ws, b'binary ' * 200))
+        self.assertEqual(server_ws.compressor_level, 1)
+        self.assertTrue(self.echo_compressed(ws, u'text ' * 200))
+        self.assertEqual(server_ws.compressor_level, 9)
+        self.assertIsNone(server_ws.compressor)
+
+    def test_level_zero_disables(self):
+        policy = CompressionPolicy(min_size=0, levels={BINARY: 0})
+        ws, server_ws = self.start(policy)
+
+        self.assertFalse(self.echo_compressed(ws, b'binary ' * 200))
+        self.assertTrue(self.echo_compressed(ws, u'text ' * 200))
+        self.assertFalse(self.echo_compressed(ws, b'binary ' * 200))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import socket
+import unittest
+
+import gevent
+
+from support import serve
+
+from geventwebsocket import PreparedMessage
+from geventwebsocket.client import connect
+from geventwebsocket.exceptions import WebSocketError
+from geventwebsocket.websocket import WRITEV_MIN_SIZE
+
+
+class CorkTest(unittest.TestCase):
+    def setUp(self):
+        server_sockets = []
+
+        def app(environ, start_response):
+            ws = environ['wsgi.websocket']
+            server_sockets.append(ws)
+            ws.receive()
+
+            return []
+
+        server, url = serve(self, app)
+        self.client = connect(url)
+        self.addCleanup(self.client.close)
+
+        with gevent.Timeout(5):
+            while not server_sockets:
+                gevent.sleep(0.01)
+
+        self.ws = ws = server_sockets[0]
+        ws.enable_corking()
+
+        # What is written, one entry per system call
+        self.writes = writes = []
+        raw_write = ws.raw_write
+        raw_writev = ws.raw_writev
+
+        def write(data):
+            writes.append([bytes(data)])
+            raw_write(data)
+
+        def writev(buffers):
+            writes.append([bytes(buf) for buf in buffers])
+            raw_writev(buffers)
+
+        ws.raw_write = write
+
+        if raw_writev is not None:
+            ws.raw_writev = writev
+
+    def receive(self, count):
+        with gevent.Timeout(5):
+            return [self.client.receive() for i in range(count)]
+
+    def test_small_messages_written_at_once(self):
+        for i in range(100):
+            self.ws.send(u'{0:d}'.format(i))
+
+        self.ws.send_prepared(PreparedMessage(u'prepared'))
+        self.assertEqual(self.writes, [])
+
+        self.assertEqual(self.receive(101), [
+            u'{0:d}'.format(i) for i in range(100)] + [u'prepared'])
+        self.assertEqual(len(self.writes), 1)
+
+    def test_flush(self):
+        self.ws.send(u'first')
+        self.ws.send(u'second')
+        self.ws.flush()
+
+        self.assertEqual(len(self.writes), 1)
+        self.assertEqual(self.receive(2), [u'first', u'second'])
+
+    def test_large_payloads_not_copied(self):
+        if self.ws.raw_writev is None:
+            self.skipTest("The socket doesn't support sendmsg")
+
+        large = b'x' * WRITEV_MIN_SIZE
+        self.ws.send(u'before')
+        self.ws.send(large)
+
+        # Written right away, after what was held back
+        self.assertEqual(len(self.writes), 1)
+        self.assertEqual(len(self.writes[0]), 3)
+        self.assertEqual(self.writes[0][2], large)
+        self.assertEqual(len(self.ws.cork_buffer), 0)
+
+        prepared = PreparedMessage(large + b'prepared')
+        self.ws.send(u'between')
+        self.ws.send_prepared(prepared)
+        self.ws.send(u'after')
+
+        self.assertEqual(self.receive(5), [
+            u'before', large, u'between', large + b'prepared', u'after'])
+        self.assertEqual(len(self.writes), 3)
+
+    def test_failed_flush_closes(self):
+        def write(data):
+            raise socket.error("Broken pipe")
+
+        self.ws.raw_write = write
+        self.ws.send(u'lost')
+
+        # The flush fails once this greenlet yields
+        gevent.sleep(0.01)
+        self.assertTrue(self.ws.closed)
+
+        with self.assertRaises(WebSocketError):
+            self.ws.send(u'next')
@@ -0,0 +1,178 @@
+import os
+import unittest
+import zlib
+
+import gevent
+
+from support import serve
+
+from geventwebsocket.client import connect
+from geventwebsocket.deflate import (
+    MAX_WINDOW_BITS, PerMessageDeflate, accept_offer, negotiate,
+    parse_extensions)
+
+
+class ParseExtensionsTest(unittest.TestCase):
+    def test_parse(self):
+        header = ('permessage-deflate; client_max_window_bits; '
+                  'server_max_window_bits="10", x-webkit-deflate-frame, '
+                  'permessage-deflate')
+
+        self.assertEqual(parse_extensions(header), [
+            ('permessage-deflate', [('client_max_window_bits', None),
+                                    ('server_max_window_bits', '10')]),
+            ('x-webkit-deflate-frame', []),
+            ('permessage-deflate', [])])
+
+    def test_empty(self):
+        self.assertEqual(parse_extensions(''), [])
+        self.assertEqual(parse_extensions(' , '), [])
+
+
+class AcceptOfferTest(unittest.TestCase):
+    def test_defaults(self):
+        params = accept_offer([])
+
+        self.assertFalse(params.server_no_context_takeover)
+        self.assertFalse(params.client_no_context_takeover)
+        self.assertEqual(params.server_max_window_bits, MAX_WINDOW_BITS)
+        self.assertEqual(params.client_max_window_bits, MAX_WINDOW_BITS)
+        self.assertEqual(params.response(), 'permessage-deflate')
+
+    def test_client_parameters(self):
+        params = accept_offer([('server_no_context_takeover', None),
+                               ('client_no_context_takeover', None),
+                               ('server_max_window_bits', '10'),
+                               ('client_max_window_bits', '11')])
+
+        self.assertTrue(params.server_no_context_takeover)
+        self.assertTrue(params.client_no_context_takeover)
+        self.assertEqual(params.server_max_window_bits, 10)
+        self.assertEqual(params.client_max_window_bits, 11)
+        self.assertEqual(params.response(), (
+            'permessage-deflate; server_no_context_takeover; '
+            'client_no_context_takeover; server_max_window_bits=10; '
+            'client_max_window_bits=11'))
+
+    def test_server_limits(self):
+        # The client's window is only limited if it said it can be
+        params = accept_offer([], max_window_bits=10,
+                              no_context_takeover=True)
+
+        self.assertEqual(params.server_max_window_bits, 10)
+        self.assertEqual(params.client_max_window_bits, MAX_WINDOW_BITS)
+        self.assertTrue(params.server_no_context_takeover)
+        self.assertTrue(params.client_no_context_takeover)
+
+        params = accept_offer([('client_max_window_bits', None)],
+                              max_window_bits=10, mem_level=4)
+
+        self.assertEqual(params.client_max_window_bits, 10)
+        self.assertEqual(params.mem_level, 4)
+
+    def test_invalid_offers(self):
+        for params in ([('server_max_window_bits', '8')],
+                       [('server_max_window_bits', None)],
+                       [('server_max_window_bits', '16')],
+                       [('server_max_window_bits', '010')],
+                       [('client_max_window_bits', 'x')],
+                       [('server_no_context_takeover', '1')],
+                       [('client_no_context_takeover', None),
+                        ('client_no_context_takeover', None)],
+                       [('unknown', None)]):
+            self.assertRaises(ValueError, accept_offer, params)
+
+
+class NegotiateTest(unittest.TestCase):
+    def test_first_acceptable_offer(self):
+        params = negotiate('x-other, permessage-deflate; '
+                           'server_max_window_bits=8, permessage-deflate; '
+                           'server_max_window_bits=12')
+
+        self.assertEqual(params.server_max_window_bits, 12)
+
+    def test_no_acceptable_offer(self):
+        self.assertIsNone(negotiate('x-other'))
+        self.assertIsNone(negotiate('permessage-deflate; bogus'))
+
+
+class RoundTripTest(unittest.TestCase):
+    def round_trip(self, **server_kwargs):
+        server_sockets = []
+
+        def app(environ, start_response):
+            ws = environ['wsgi.websocket']
+            server_sockets.append(ws)
+
+            while True:
+                message = ws.receive()
+
+                if message is None:
+                    break
+
+                ws.send(message)
+
+            return []
+
+        client_kwargs = server_kwargs.pop('client', {})
+        server, url = serve(self, app, **server_kwargs)
+        ws = connect(url, compress=True, **client_kwargs)
+        self.addCleanup(ws.close)
+
+        self.assertIsNotNone(ws.permessage_deflate)
+
+        messages = [u'hello world ' * 100, os.urandom(5000),
+                    b'repeated ' * 2000, u'caf\xe9 ' * 300, u'tiny',
+                    u'hello world ' * 100]
+
+        with gevent.Timeout(10):
+            for message in messages:
+                ws.send(message)
+                self.assertEqual(ws.receive(), message)
+
+        return ws, server_sockets[0]
+
+    def test_context_takeover(self):
+        ws, server_ws = self.round_trip()
+
+        self.assertFalse(server_ws.permessage_deflate.
+                         server_no_context_takeover)
+        self.assertIsNotNone(server_ws.compressor)
+
+    def test_no_context_takeover_requested_by_client(self):
+        ws, server_ws = self.round_trip(
+            client={'deflate_no_context_takeover': True})
+
+        params = server_ws.permessage_deflate
+        self.assertTrue(params.server_no_context_takeover)
+        self.assertTrue(params.client_no_context_takeover)
+
+        # No zlib state is held in between messages
+        self.assertIsNone(server_ws.compressor)
+        self.assertIsNone(server_ws.decompressor)
+
+    def test_no_context_takeover_imposed_by_server(self):
+        ws, server_ws = self.round_trip(deflate_no_context_takeover=True,
+                                        deflate_max_window_bits=10,
+                                        deflate_mem_level=4)
+
+        params = server_ws.permessage_deflate
+        self.assertTrue(params.server_no_context_takeover)
+        self.assertEqual(params.server_max_window_bits, 10)
+        self.assertEqual(params.mem_level, 4)
+        self.assertIsNone(server_ws.compressor)
+
+
+class PerMessageDeflateTest(unittest.TestCase):
+    def test_small_window_round_trip(self):
+        params = PerMessageDeflate(server_max_window_bits=9,
+                                   client_max_window_bits=9, mem_level=1)
+        data = os.urandom(100) * 50
+        compressor = params.compressobj()
+        compressed = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        self.assertEqual(params.decompressobj().decompress(compressed), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+
+from support import ChunkedStream, client_frame, echo_app, serve
+
+from geventwebsocket.client import connect
+from geventwebsocket.exceptions import FrameTooLargeException, WebSocketError
+from geventwebsocket.websocket import FrameReader, WebSocket
+
+TEXT = WebSocket.OPCODE_TEXT
+BINARY = WebSocket.OPCODE_BINARY
+
+
+def read_all(reader, count):
+    frames = []
+
+    for _ in range(count):
+        header = reader.read_header()
+        payload = reader.read_payload(header)
+        frames.append((header.opcode, header.fin, bytes(payload)))
+
+    return frames
+
+
+class FrameReaderTest(unittest.TestCase):
+    def test_many_frames_per_read(self):
+        payloads = [u'message {0:d}'.format(i).encode('ascii')
+                    for i in range(100)]
+        data = b''.join(client_frame(TEXT, p) for p in payloads)
+        stream = ChunkedStream(data, [len(data)])
+        reader = FrameReader(stream, 16 * 1024)
+
+        frames = read_all(reader, len(payloads))
+
+        self.assertEqual(frames, [(TEXT, True, p) for p in payloads])
+        self.assertEqual(stream.reads, 1)
+
+    def test_frames_split_across_reads(self):
+        payloads = [b'a' * 10, b'b' * 200, b'c' * 70000, b'']
+        data = b''.join(client_frame(BINARY, p) for p in payloads)
+
+        for size in (1, 3, 7, 1000):
+            stream = ChunkedStream(data, [size] * (len(data) // size))
+            reader = FrameReader(stream, 256)
+
+            self.assertEqual(read_all(reader, len(payloads)),
+                             [(BINARY, True, p) for p in payloads])
+
+    def test_frame_larger_than_buffer(self):
+        payload = bytes(bytearray(range(256))) * 100
+        data = client_frame(BINARY, payload) + client_frame(TEXT, b'after')
+        reader = FrameReader(ChunkedStream(data, [100, 5000]), 1024)
+
+        self.assertEqual(read_all(reader, 2), [(BINARY, True, payload),
+                                               (TEXT, True, b'after')])
+
+    def test_payload_outlives_buffer(self):
+        data = client_frame(BINARY, b'first') + client_frame(BINARY, b'x' * 5)
+        reader = FrameReader(ChunkedStream(data, [len(data)]), 64)
+
+        first = reader.read_payload(reader.read_header())
+        reader.read_payload(reader.read_header())
+
+        self.assertEqual(first, b'first')
+
+    def test_max_length(self):
+        data = client_frame(BINARY, b'x' * 100)
+        reader = FrameReader(ChunkedStream(data, []), 64)
+
+        self.assertRaises(FrameTooLargeException, reader.read_header, 99)
+
+    def test_eof(self):
+        data = client_frame(BINARY, b'x' * 100)[:50]
+        reader = FrameReader(ChunkedStream(data, []), 1024)
+        header = reader.read_header()
+
+        self.assertRaises(WebSocketError, reader.read_payload, header)
+
+
+class BufferedReceiveTest(unittest.TestCase):
+    def test_burst_of_messages(self):
+        server, url = serve(self, echo_app)
+        ws = connect(url)
+        self.addCleanup(ws.close)
+
+        # All frames in a single write, the server decodes them from its
+        # read buffer
+        messages = [u'{0:d}'.format(i) * (i % 50 + 1) for i in range(500)]
+        ws.handler.socket.sendall(b''.join(
+            client_frame(TEXT, m.encode('ascii')) for m in messages))
+
+        self.assertEqual([ws.receive() for _ in messages], messages)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+import logging
+import unittest
+
+import gevent
+from gevent import socket
+from gevent.pywsgi import WSGIServer
+
+from support import serve
+
+from geventwebsocket import Resource, WebSocketApplication
+from geventwebsocket.handler import WebSocketHandler
+from geventwebsocket.protocols.base import BaseProtocol
+from geventwebsocket.websocket import _mock_app
+
+# The example of RFC 6455, section 1.3
+KEY = b'dGhlIHNhbXBsZSBub25jZQ=='
+ACCEPT = b's3pPLMBiTxaQ9kYGzzhZRbK+xOo='
+
+HEADERS = (b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+           b'Sec-WebSocket-Version: 13\r\nSec-WebSocket-Key: ' + KEY +
+           b'\r\n')
+
+
+class ChatProtocol(BaseProtocol):
+    PROTOCOL_NAME = 'chat'
+
+
+class ChatApplication(WebSocketApplication):
+    protocol_class = ChatProtocol
+
+    def on_message(self, message):
+        pass
+
+
+def wsgi_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'plain http']
+
+
+class HandshakeTest(unittest.TestCase):
+    def request(self, port, headers=HEADERS, method=b'GET',
+                version=b'HTTP/1.1'):
+        """
+        :returns: The status line and the headers of the response, the
+            header names in lower case.
+        """
+        sock = socket.create_connection(('127.0.0.1', port))
+        self.addCleanup(sock.close)
+        sock.sendall(method + b' / ' + version +
+                     b'\r\nHost: localhost\r\n' + headers + b'\r\n')
+        response = b''
+
+        with gevent.Timeout(5):
+            while b'\r\n\r\n' not in response:
+                data = sock.recv(4096)
+                self.assertTrue(data, "Connection closed")
+                response += data
+
+        lines = response.split(b'\r\n\r\n', 1)[0].split(b'\r\n')
+        headers = {}
+
+        for line in lines[1:]:
+            name, value = line.split(b':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+        return lines[0], headers
+
+    def start(self, app=None):
+        if app is None:
+            app = Resource([('/', ChatApplication), ('/', wsgi_app)])
+
+        server, url = serve(self, app)
+
+        return server.server_port
+
+    def test_accept(self):
+        status, headers = self.request(self.start())
+
+        self.assertEqual(status, b'HTTP/1.1 101 Switching Protocols')
+        self.assertEqual(headers[b'upgrade'], b'websocket')
+        self.assertEqual(headers[b'connection'], b'Upgrade')
+        self.assertEqual(headers[b'sec-websocket-accept'], ACCEPT)
+        self.assertNotIn(b'content-length', headers)
+        self.assertNotIn(b'sec-websocket-protocol', headers)
+        self.assertNotIn(b'sec-websocket-extensions', headers)
+
+    def test_subprotocol(self):
+        port = self.start()
+
+        status, headers = self.request(
+            port, HEADERS + b'Sec-WebSocket-Protocol: chat\r\n')
+        self.assertEqual(status, b'HTTP/1.1 101 Switching Protocols')
+        self.assertEqual(headers[b'sec-websocket-protocol'], b'chat')
+
+        status, headers = self.request(
+            port, HEADERS + b'Sec-WebSocket-Protocol: other\r\n')
+        self.assertEqual(status, b'HTTP/1.1 101 Switching Protocols')
+        self.assertNotIn(b'sec-websocket-protocol', headers)
+
+    def test_invalid_requests(self):
+        port = self.start()
+        upgrade = b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+
+        for headers, expected in [
+                (upgrade, b'426 Upgrade Required'),
+                (upgrade + b'Sec-WebSocket-Version: 12\r\n',
+                 b'400 Bad Request'),
+                (upgrade + b'Sec-WebSocket-Version: 13\r\n',
+                 b'400 Bad Request'),
+                (upgrade + b'Sec-WebSocket-Version: 13\r\n'
+                 b'Sec-WebSocket-Key: not base64!\r\n', b'400 Bad Request'),
+                (upgrade + b'Sec-WebSocket-Version: 13\r\n'
+                 b'Sec-WebSocket-Key: c2hvcnQ=\r\n', b'400 Bad Request')]:
+            status, _ = self.request(port, headers)
+            self.assertEqual(status, b'HTTP/1.1 ' + expected, headers)
+
+        status, _ = self.request(port, version=b'HTTP/1.0')
+        self.assertEqual(status, b'HTTP/1.1 402 Bad Request')
+
+    def test_plain_http_falls_through(self):
+        port = self.start()
+
+        for headers, method in [
+                (b'', b'GET'),
+                (HEADERS, b'POST'),
+                (HEADERS.replace(b'Connection: Upgrade', b'Connection: x'),
+                 b'GET')]:
+            status, headers = self.request(port, headers, method)
+            self.assertEqual(status, b'HTTP/1.1 200 OK')
+
+    def test_without_websocket_server(self):
+        current_apps = []
+
+        def app(environ, start_response):
+            ws = environ['wsgi.websocket']
+            current_apps.append(ws.current_app)
+            ws.receive()
+            return []
+
+        server = WSGIServer(('127.0.0.1', 0), app, log=None,
+                            handler_class=WebSocketHandler)
+        server.start()
+        self.addCleanup(server.stop)
+
+        status, headers = self.request(server.server_port)
+        self.assertEqual(status, b'HTTP/1.1 101 Switching Protocols')
+        self.assertEqual(headers[b'sec-websocket-accept'], ACCEPT)
+
+        # The logger is created once
+        logger = server.logger
+        self.request(server.server_port)
+        self.assertIs(server.logger, logger)
+
+        # An application without `current_app` gets the shared stand-in
+        with gevent.Timeout(5):
+            while len(current_apps) < 2:
+                gevent.sleep(0.01)
+
+        self.assertEqual(current_apps, [_mock_app, _mock_app])
+
+    def test_debug_messages_formatted_lazily(self):
+        server, url = serve(
+            self, Resource([('/', ChatApplication), ('/', wsgi_app)]))
+        port = server.server_port
+        logger = server.logger
+        records = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record)
+
+        handler = Handler()
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(logger.setLevel, logger.level)
+
+        logger.setLevel(logging.DEBUG)
+        self.request(port, HEADERS + b'Sec-WebSocket-Protocol: chat\r\n')
+
+        with gevent.Timeout(5):
+            while not any(record.args for record in records):
+                gevent.sleep(0.01)
+
+        record = [record for record in records if record.args][0]
+        self.assertEqual(record.getMessage(), 'Protocol allowed: chat')
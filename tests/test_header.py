@@ -0,0 +1,108 @@
+import struct
+import unittest
+
+from support import ChunkedStream
+
+from geventwebsocket.exceptions import FrameTooLargeException, ProtocolError
+from geventwebsocket.websocket import FrameReader, Header, WebSocket
+
+OPCODES = (WebSocket.OPCODE_CONTINUATION, WebSocket.OPCODE_TEXT,
+           WebSocket.OPCODE_BINARY, WebSocket.OPCODE_CLOSE,
+           WebSocket.OPCODE_PING, WebSocket.OPCODE_PONG)
+
+LENGTHS = (0, 1, 125, 126, 127, 65535, 65536, 2 ** 32)
+
+
+def encode_reference(fin, opcode, mask, length, flags):
+    """The header encoding as originally implemented."""
+    first_byte = opcode | (flags & Header.HEADER_FLAG_MASK)
+
+    if fin:
+        first_byte |= Header.FIN_MASK
+
+    second_byte = Header.MASK_MASK if mask else 0
+
+    if length < 126:
+        header = struct.pack('!BB', first_byte, second_byte | length)
+    elif length <= 0xffff:
+        header = struct.pack('!BBH', first_byte, second_byte | 126, length)
+    else:
+        header = struct.pack('!BBQ', first_byte, second_byte | 127, length)
+
+    return header + mask
+
+
+class EncodeHeaderTest(unittest.TestCase):
+    def test_matches_reference(self):
+        for opcode in OPCODES:
+            for fin in (False, True):
+                for flags in (0, Header.RSV0_MASK):
+                    for mask in (b'', b'\x01\x02\x03\x04'):
+                        for length in LENGTHS:
+                            args = (fin, opcode, mask, length, flags)
+                            self.assertEqual(Header.encode_header(*args),
+                                             encode_reference(*args), args)
+
+    def test_short_headers_are_shared(self):
+        first = Header.encode_header(True, WebSocket.OPCODE_TEXT, b'', 5, 0)
+        second = Header.encode_header(True, WebSocket.OPCODE_TEXT, b'', 5, 0)
+
+        self.assertIs(first, second)
+
+    def test_too_large(self):
+        self.assertRaises(FrameTooLargeException, Header.encode_header,
+                          True, WebSocket.OPCODE_BINARY, b'', 2 ** 64, 0)
+
+
+class DecodeHeaderTest(unittest.TestCase):
+    def decode_both(self, data):
+        """Decode with both decoders, which must agree."""
+        header = Header.decode_header(ChunkedFile(data))
+        reader = FrameReader(ChunkedStream(data, [1] * len(data)), 64)
+        buffered = reader.read_header()
+
+        self.assertEqual(
+            (header.fin, header.opcode, header.flags, header.length,
+             header.mask),
+            (buffered.fin, buffered.opcode, buffered.flags, buffered.length,
+             buffered.mask))
+
+        return header
+
+    def test_round_trip(self):
+        for opcode in (WebSocket.OPCODE_TEXT, WebSocket.OPCODE_BINARY):
+            for length in LENGTHS:
+                for mask in (b'', b'\x01\x02\x03\x04'):
+                    data = Header.encode_header(True, opcode, mask, length,
+                                                Header.RSV0_MASK)
+                    header = self.decode_both(data)
+
+                    self.assertEqual(header.opcode, opcode)
+                    self.assertEqual(header.length, length)
+                    self.assertEqual(header.flags, Header.RSV0_MASK)
+                    self.assertEqual(bool(header.mask), bool(mask))
+
+    def test_control_frames(self):
+        fragmented = Header.encode_header(False, WebSocket.OPCODE_PING, b'',
+                                          5, 0)
+        too_long = Header.encode_header(True, WebSocket.OPCODE_PING, b'',
+                                        126, 0)
+
+        for data in (fragmented, too_long):
+            self.assertRaises(ProtocolError, Header.decode_header,
+                              ChunkedFile(data))
+            self.assertRaises(ProtocolError, FrameReader(
+                ChunkedStream(data, []), 64).read_header)
+
+
+class ChunkedFile(object):
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, size):
+        data, self.data = self.data[:size], self.data[size:]
+        return data
+
+
+if __name__ == '__main__':
+    unittest.main()
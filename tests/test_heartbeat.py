@@ -0,0 +1,159 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gevent  # noqa: E402
+from gevent.event import Event  # noqa: E402
+
+from geventwebsocket import WebSocketServer  # noqa: E402
+from geventwebsocket.client import connect  # noqa: E402
+from geventwebsocket.heartbeat import Heartbeat, PING_BATCHES  # noqa: E402
+from geventwebsocket.websocket import WebSocket  # noqa: E402
+
+INTERVAL = 0.1
+READ_TIMEOUT = 0.3
+
+
+class HeartbeatTest(unittest.TestCase):
+    def start_server(self, app):
+        server = WebSocketServer(('127.0.0.1', 0), app, log=None,
+                                 error_log=None)
+        server.heartbeat = Heartbeat(INTERVAL, 2, READ_TIMEOUT,
+                                     resolution=0.05)
+        server.start()
+        self.addCleanup(server.stop)
+
+        ws = connect('ws://127.0.0.1:{0:d}/'.format(server.server_port))
+        self.addCleanup(ws.handler.close)
+
+        return ws
+
+    def test_send_only_application(self):
+        count = 40
+        state = {}
+
+        def app(environ, start_response):
+            ws = environ['wsgi.websocket']
+
+            # Several times `read_timeout` and `max_missed_pongs` intervals
+            # without ever calling receive
+            for i in range(count):
+                ws.send(u'{0:d}'.format(i))
+                gevent.sleep(0.05)
+
+            state['closed'] = ws.closed
+            ws.close()
+            return []
+
+        ws = self.start_server(app)
+        received = []
+
+        with gevent.Timeout(10):
+            while True:
+                message = ws.receive()
+
+                if message is None:
+                    break
+
+                received.append(message)
+
+        self.assertEqual(received, [u'{0:d}'.format(i) for i in range(count)])
+        self.assertFalse(state['closed'])
+
+    def test_reading_application_evicts_dead_peer(self):
+        evicted = Event()
+
+        def app(environ, start_response):
+            ws = environ['wsgi.websocket']
+            ws.receive()
+            evicted.set()
+            return []
+
+        # The client never reads, so it never answers the pings
+        self.start_server(app)
+
+        self.assertTrue(evicted.wait(5))
+
+
+class FakeWebSocket(object):
+    """
+    Records the pings written to it, writing blocks until `unblocked` is
+    set.
+    """
+
+    OPCODE_PING = WebSocket.OPCODE_PING
+
+    def __init__(self):
+        self.closed = False
+        self.reading = True
+        self.last_read = None
+        self.ping_payload = None
+        self.ping_sent = None
+        self.missed_pongs = 0
+        self.pings = []
+        self.unblocked = Event()
+        self.unblocked.set()
+
+    def write_frame(self, fin, opcode, payload):
+        self.unblocked.wait()
+        self.pings.append(payload)
+
+
+class PingBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.heartbeat = Heartbeat(INTERVAL, 2, resolution=INTERVAL)
+        self.addCleanup(self.heartbeat.stop)
+
+    def test_tick_pings_all_due_connections(self):
+        connections = [FakeWebSocket() for i in range(100)]
+
+        for ws in connections:
+            self.heartbeat.add(ws)
+
+        gevent.sleep(INTERVAL * 1.5)
+
+        for ws in connections:
+            self.assertEqual(ws.pings, [ws.ping_payload])
+
+        self.assertEqual(len(set(ws.ping_payload for ws in connections)),
+                         100)
+
+    def test_one_greenlet_per_batch(self):
+        connections = [FakeWebSocket() for i in range(100)]
+
+        self.heartbeat.ping(connections)
+        self.assertEqual(len(self.heartbeat.pool), 1)
+
+        gevent.sleep(0)
+        self.assertTrue(all(ws.pings for ws in connections))
+
+    def test_backed_up_sockets_skip_batches(self):
+        stuck = []
+
+        for i in range(PING_BATCHES):
+            ws = FakeWebSocket()
+            ws.unblocked.clear()
+            stuck.append(ws)
+            self.heartbeat.ping([ws])
+
+        gevent.sleep(0)
+        self.assertTrue(self.heartbeat.pool.full())
+
+        ws = FakeWebSocket()
+        self.heartbeat.ping([ws])
+        gevent.sleep(0)
+        self.assertIsNone(ws.ping_payload)
+
+        for each in stuck:
+            each.unblocked.set()
+
+        self.assertTrue(self.heartbeat.pool.join(5))
+        self.heartbeat.ping([ws])
+        gevent.sleep(0)
+        self.assertEqual(ws.pings, [ws.ping_payload])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import struct
+import unittest
+
+import gevent
+
+from support import client_frame, serve
+
+from geventwebsocket.client import connect
+from geventwebsocket.exceptions import WebSocketError
+from geventwebsocket.websocket import WebSocket
+
+TEXT = WebSocket.OPCODE_TEXT
+BINARY = WebSocket.OPCODE_BINARY
+CONTINUATION = WebSocket.OPCODE_CONTINUATION
+
+
+class LimitsTest(unittest.TestCase):
+    def connect(self, app, **kwargs):
+        server, url = serve(self, app, **kwargs)
+        ws = connect(url)
+        self.addCleanup(ws.handler.close)
+
+        return ws
+
+    def read_close_code(self, ws):
+        """
+        :returns: The code of the close frame the server sends.
+        """
+        with gevent.Timeout(5):
+            while True:
+                header, payload = ws.read_frame()
+
+                if header.opcode == WebSocket.OPCODE_CLOSE:
+                    return struct.unpack('!H', bytes(payload[:2]))[0]
+
+    def receive_app(self, results, stream=False):
+        def app(environ, start_response):
+            ws = environ['wsgi.websocket']
+
+            while True:
+                try:
+                    if stream:
+                        message = ws.receive_stream()
+                        message = message and b''.join(message)
+                    else:
+                        message = ws.receive()
+                except WebSocketError:
+                    message = None
+
+                results.append(message)
+
+                if message is None:
+                    break
+
+            return []
+
+        return app
+
+    def test_frame_too_large(self):
+        results = []
+        ws = self.connect(self.receive_app(results), max_frame_size=100)
+
+        ws.send(b'x' * 100)
+        ws.send(b'x' * 101)
+
+        self.assertEqual(self.read_close_code(ws), 1009)
+        self.assertEqual(results, [b'x' * 100, None])
+
+    def test_message_too_large(self):
+        results = []
+        ws = self.connect(self.receive_app(results), max_message_size=100)
+
+        # Every frame is small enough, the message isn't
+        ws.handler.socket.sendall(
+            client_frame(BINARY, b'x' * 60, fin=False) +
+            client_frame(CONTINUATION, b'x' * 60))
+
+        self.assertEqual(self.read_close_code(ws), 1009)
+        self.assertEqual(results, [None])
+
+    def test_streamed_message_too_large(self):
+        results = []
+        ws = self.connect(self.receive_app(results, stream=True),
+                          max_message_size=100)
+
+        ws.handler.socket.sendall(
+            client_frame(BINARY, b'x' * 50, fin=False) +
+            client_frame(CONTINUATION, b'x' * 50))
+        ws.handler.socket.sendall(
+            client_frame(BINARY, b'y' * 50, fin=False) +
+            client_frame(CONTINUATION, b'y' * 40, fin=False) +
+            client_frame(CONTINUATION, b'y' * 40))
+
+        self.assertEqual(self.read_close_code(ws), 1009)
+        self.assertEqual(results, [b'x' * 100, None])
+
+    def test_control_frames_ignore_frame_limit(self):
+        results = []
+        ws = self.connect(self.receive_app(results), max_frame_size=10)
+
+        ws.handler.socket.sendall(
+            client_frame(WebSocket.OPCODE_PING, b'p' * 125) +
+            client_frame(TEXT, b'short'))
+
+        with gevent.Timeout(5):
+            header, payload = ws.read_frame()
+
+        self.assertEqual(header.opcode, WebSocket.OPCODE_PONG)
+        self.assertEqual(bytes(payload), b'p' * 125)
+
+        ws.close()
+
+        with gevent.Timeout(5):
+            while not results or results[-1] is not None:
+                gevent.sleep(0.01)
+
+        self.assertEqual(results, [u'short', None])
+
+
+if __name__ == '__main__':
+    unittest.main()
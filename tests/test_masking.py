@@ -0,0 +1,124 @@
+import importlib
+import os
+import sys
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import geventwebsocket  # noqa: E402
+from geventwebsocket import masking  # noqa: E402
+
+
+KEY = b'\x12\x34\x56\x78'
+
+
+def mask_reference(key, data):
+    key = bytearray(key)
+    data = bytearray(data)
+
+    for i in range(len(data)):
+        data[i] ^= key[i & 3]
+
+    return bytes(data)
+
+
+class FakeXorMasker(object):
+    # The sizes of the payloads masked
+    calls = []
+
+    def __init__(self, key):
+        self.key = key
+
+    def process(self, data):
+        self.calls.append(len(data))
+        return mask_reference(self.key, data)
+
+
+def import_masking(wsaccel, numpy):
+    """
+    Import a fresh copy of the module as if only the given optional
+    dependencies were installed.
+    """
+    saved = dict((name, sys.modules.get(name)) for name in (
+        'geventwebsocket.masking', 'wsaccel', 'wsaccel.xormask', 'numpy'))
+
+    try:
+        del sys.modules['geventwebsocket.masking']
+
+        if wsaccel:
+            package = types.ModuleType('wsaccel')
+            package.xormask = types.ModuleType('wsaccel.xormask')
+            package.xormask.XorMaskerSimple = FakeXorMasker
+            sys.modules['wsaccel'] = package
+            sys.modules['wsaccel.xormask'] = package.xormask
+        else:
+            sys.modules['wsaccel'] = None
+            sys.modules['wsaccel.xormask'] = None
+
+        if not numpy:
+            sys.modules['numpy'] = None
+        elif saved['numpy'] is None:
+            del sys.modules['numpy']
+
+        return importlib.import_module('geventwebsocket.masking')
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+        geventwebsocket.masking = masking
+
+
+class MaskingTest(unittest.TestCase):
+    def test_backends_agree(self):
+        for length in (0, 1, 3, 4, 7, 8, 9, 1023, 1024, 1025, 4099):
+            data = os.urandom(length)
+            expected = mask_reference(KEY, data)
+
+            for name, func in masking.BACKENDS:
+                self.assertEqual(bytes(func(KEY, data)), expected,
+                                 '{0} with {1} octets'.format(name, length))
+
+    def test_numpy_with_wsaccel(self):
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            raise unittest.SkipTest('numpy is not installed')
+
+        module = import_masking(wsaccel=True, numpy=True)
+        self.assertEqual(module.BACKEND, 'numpy')
+
+        # Small payloads go to wsaccel, large ones to numpy
+        del FakeXorMasker.calls[:]
+        small = os.urandom(module.NUMPY_THRESHOLD - 1)
+        large = os.urandom(module.NUMPY_THRESHOLD * 4)
+
+        self.assertEqual(bytes(module.mask(KEY, small)),
+                         mask_reference(KEY, small))
+        self.assertEqual(bytes(module.mask(KEY, large)),
+                         mask_reference(KEY, large))
+        self.assertEqual(FakeXorMasker.calls, [len(small)])
+
+    def test_wsaccel_without_numpy(self):
+        module = import_masking(wsaccel=True, numpy=False)
+        self.assertEqual(module.BACKEND, 'wsaccel')
+
+    def test_numpy_without_wsaccel(self):
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            raise unittest.SkipTest('numpy is not installed')
+
+        module = import_masking(wsaccel=False, numpy=True)
+        self.assertEqual(module.BACKEND, 'numpy')
+
+    def test_pure_python(self):
+        module = import_masking(wsaccel=False, numpy=False)
+        self.assertIn(module.BACKEND, ('int', 'struct'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import json
+import unittest
+
+import gevent
+
+from support import echo_app, serve
+
+from geventwebsocket import Metrics, MetricsApp, WebSocketServer
+from geventwebsocket.client import connect
+from geventwebsocket.exceptions import HandshakeError
+from geventwebsocket.metrics import CONTENT_TYPE, Histogram
+
+
+def wait_for(condition):
+    with gevent.Timeout(5):
+        while not condition():
+            gevent.sleep(0.01)
+
+
+class HistogramTest(unittest.TestCase):
+    def test_observe(self):
+        histogram = Histogram([10, 1, 100])
+
+        for value in (0, 1, 2, 10, 50, 1000):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.snapshot(), {
+            'buckets': [(1, 2), (10, 2), (100, 1), (float('inf'), 1)],
+            'sum': 1063,
+            'count': 6,
+        })
+
+
+class MetricsTest(unittest.TestCase):
+    def test_off_by_default(self):
+        self.assertIsNone(
+            WebSocketServer(('127.0.0.1', 0), echo_app).metrics)
+        self.assertIsNone(
+            WebSocketServer(('127.0.0.1', 0), echo_app, metrics=False).metrics)
+        self.assertIsInstance(
+            WebSocketServer(('127.0.0.1', 0), echo_app, metrics=True).metrics,
+            Metrics)
+
+        metrics = Metrics()
+        self.assertIs(WebSocketServer(('127.0.0.1', 0), echo_app,
+                                      metrics=metrics).metrics, metrics)
+
+    def test_connection(self):
+        metrics = Metrics()
+        server, url = serve(self, echo_app, metrics=metrics,
+                            max_connections=1)
+
+        ws = connect(url)
+        self.addCleanup(ws.close)
+        wait_for(lambda: metrics.connections == 1)
+
+        self.assertRaises(HandshakeError, connect, url)
+
+        ws.send(u'hello')
+        ws.send(b'\x00' * 100)
+
+        with gevent.Timeout(5):
+            self.assertEqual(ws.receive(), u'hello')
+            self.assertEqual(ws.receive(), b'\x00' * 100)
+
+        ws.close(4000)
+        wait_for(lambda: metrics.connections == 0)
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['handshakes'],
+                         {'accepted': 1, 'rejected': 1})
+        self.assertEqual(snapshot['frames']['in'],
+                         {'text': 1, 'binary': 1, 'close': 1})
+        self.assertEqual(snapshot['bytes']['in'],
+                         {'text': 5, 'binary': 100, 'close': 2})
+        self.assertEqual(snapshot['frames']['out']['text'], 1)
+        self.assertEqual(snapshot['bytes']['out']['binary'], 100)
+        self.assertEqual(snapshot['close_codes']['in'], {4000: 1})
+        self.assertEqual(snapshot['message_size']['in']['count'], 2)
+        self.assertEqual(snapshot['message_size']['in']['sum'], 105)
+        self.assertEqual(snapshot['message_size']['out']['sum'], 105)
+        self.assertEqual(snapshot['handshake_latency']['count'], 1)
+
+    def test_compression(self):
+        metrics = Metrics()
+        server, url = serve(self, echo_app, metrics=metrics)
+        ws = connect(url, compress=True)
+        self.addCleanup(ws.close)
+
+        ws.send(u'x' * 1000)
+
+        with gevent.Timeout(5):
+            self.assertEqual(ws.receive(), u'x' * 1000)
+
+        compression = metrics.snapshot()['compression']
+        self.assertEqual(compression['inflate_out'], 1000)
+        self.assertEqual(compression['deflate_in'], 1000)
+        self.assertLess(compression['inflate_in'], 100)
+        self.assertLess(compression['deflate_out'], 100)
+
+    def sample(self):
+        metrics = Metrics()
+        metrics.connections = 2
+        metrics.handshakes_accepted = 3
+        metrics.handshakes_rejected = 1
+        metrics.frame_in(1, 10)
+        metrics.frame_out(2, 20)
+        metrics.frame_out(2, 30)
+        metrics.deflated(100, 10)
+        metrics.inflated(5, 50)
+        metrics.close_in(1000)
+        metrics.close_out(1001)
+        metrics.handshake_latency.observe(0.003)
+        metrics.message_size_in.observe(10)
+        metrics.message_size_out.observe(5000)
+
+        return metrics
+
+    def test_merge(self):
+        metrics = self.sample()
+        total = Metrics()
+
+        # As reported by the workers of a `PreforkServer`
+        for i in range(2):
+            total.merge(json.loads(json.dumps(metrics.snapshot())))
+
+        snapshot = total.snapshot()
+        self.assertEqual(snapshot['connections'], 4)
+        self.assertEqual(snapshot['handshakes'],
+                         {'accepted': 6, 'rejected': 2})
+        self.assertEqual(snapshot['frames'], {
+            'in': {'text': 2}, 'out': {'binary': 4}})
+        self.assertEqual(snapshot['bytes'], {
+            'in': {'text': 20}, 'out': {'binary': 100}})
+        self.assertEqual(snapshot['compression'], {
+            'deflate_in': 200, 'deflate_out': 20,
+            'inflate_in': 10, 'inflate_out': 100})
+        self.assertEqual(snapshot['close_codes'], {
+            'in': {1000: 2}, 'out': {1001: 2}})
+        self.assertEqual(snapshot['handshake_latency']['count'], 2)
+        self.assertAlmostEqual(snapshot['handshake_latency']['sum'], 0.006)
+        self.assertEqual(snapshot['message_size']['out']['buckets'],
+                         [(bound, count * 2) for bound, count in
+                          metrics.snapshot()['message_size']['out'][
+                              'buckets']])
+
+    def test_prometheus(self):
+        lines = self.sample().prometheus().splitlines()
+
+        for line in [
+                '# TYPE geventwebsocket_connections gauge',
+                'geventwebsocket_connections 2',
+                'geventwebsocket_handshakes_total{result="accepted"} 3',
+                'geventwebsocket_handshakes_total{result="rejected"} 1',
+                'geventwebsocket_frames_total{direction="in",opcode="text"} 1',
+                'geventwebsocket_bytes_total'
+                '{direction="out",opcode="binary"} 50',
+                'geventwebsocket_compression_bytes_total'
+                '{direction="out",stage="compressed"} 10',
+                'geventwebsocket_close_codes_total'
+                '{direction="out",code="1001"} 1',
+                '# TYPE geventwebsocket_handshake_duration_seconds histogram',
+                'geventwebsocket_handshake_duration_seconds_bucket'
+                '{le="0.0025"} 0',
+                'geventwebsocket_handshake_duration_seconds_bucket'
+                '{le="0.005"} 1',
+                'geventwebsocket_handshake_duration_seconds_bucket'
+                '{le="+Inf"} 1',
+                'geventwebsocket_handshake_duration_seconds_count 1',
+                'geventwebsocket_message_size_bytes_bucket'
+                '{direction="out",le="4096"} 0',
+                'geventwebsocket_message_size_bytes_bucket'
+                '{direction="out",le="16384"} 1',
+                'geventwebsocket_message_size_bytes_sum{direction="in"} 10']:
+            self.assertIn(line, lines)
+
+        # A single HELP and TYPE line per metric
+        names = [line.split()[2] for line in lines if line.startswith('#')]
+        self.assertEqual(len(names), len(set(names)) * 2)
+
+    def test_app(self):
+        metrics = self.sample()
+        responses = []
+
+        def start_response(status, headers):
+            responses.append((status, dict(headers)))
+
+        for app in (MetricsApp(metrics), MetricsApp(lambda: metrics)):
+            body = b''.join(app({}, start_response))
+            status, headers = responses.pop()
+
+            self.assertEqual(status, '200 OK')
+            self.assertEqual(headers['Content-Type'], CONTENT_TYPE)
+            self.assertEqual(int(headers['Content-Length']), len(body))
+            self.assertEqual(body, metrics.prometheus().encode('utf-8'))
@@ -0,0 +1,201 @@
+import os
+import signal
+import subprocess
+import sys
+import unittest
+
+import gevent
+from gevent import socket
+
+import support  # noqa: F401
+
+from geventwebsocket.client import connect
+from geventwebsocket.prefork import PreforkServer
+
+WORKERS = 3
+
+
+def pid_app(environ, start_response):
+    """
+    Answers every message, and plain requests, with the pid of the worker.
+    """
+    ws = environ.get('wsgi.websocket')
+
+    if ws is None:
+        start_response('200 OK', [])
+        return [str(os.getpid()).encode('ascii')]
+
+    while True:
+        message = ws.receive()
+
+        if message is None:
+            break
+
+        ws.send(str(os.getpid()))
+
+    return []
+
+
+def run_master(reuse_port):
+    """
+    The master process of `PreforkTest`, which writes the ports and the pids
+    of the workers to stdout once they are started.
+    """
+    server = PreforkServer(('127.0.0.1', 0), pid_app, workers=WORKERS,
+                           reuse_port=reuse_port,
+                           metrics_listener=('127.0.0.1', 0),
+                           metrics_interval=0.05, log=None, error_log=None)
+    server.start()
+    sys.stdout.write(' '.join(str(value) for value in [
+        server.server_port, server.metrics_server.server_port] +
+        [worker.pid for worker in server.workers]) + '\n')
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+
+    return True
+
+
+def wait_for(condition, timeout=10):
+    with gevent.Timeout(timeout):
+        while not condition():
+            gevent.sleep(0.05)
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), "Needs fork")
+class PreforkTest(unittest.TestCase):
+    def start(self, reuse_port):
+        master = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), str(int(reuse_port))],
+            stdout=subprocess.PIPE)
+        self.addCleanup(self.kill, master)
+
+        line = master.stdout.readline().split()
+        self.assertEqual(len(line), 2 + WORKERS)
+        self.master = master
+        self.url = 'ws://127.0.0.1:{0:d}/'.format(int(line[0]))
+        self.metrics_port = int(line[1])
+        self.pids = set(int(pid) for pid in line[2:])
+
+    def kill(self, master):
+        if master.poll() is None:
+            master.kill()
+            master.wait()
+
+        master.stdout.close()
+
+        for pid in self.pids:
+            if alive(pid):
+                os.kill(pid, signal.SIGKILL)
+
+    def metrics(self):
+        """
+        :returns: The samples served by the master, by name.
+        """
+        sock = socket.create_connection(('127.0.0.1', self.metrics_port))
+        sock.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+        response = b''
+
+        with gevent.Timeout(5):
+            while True:
+                data = sock.recv(65536)
+
+                if not data:
+                    break
+
+                response += data
+
+        sock.close()
+        body = response.split(b'\r\n\r\n', 1)[1].decode('utf-8')
+
+        return dict(line.rsplit(' ', 1) for line in body.splitlines()
+                    if not line.startswith('#'))
+
+    def worker_pid(self):
+        ws = connect(self.url, timeout=5)
+        ws.send(u'pid')
+
+        with gevent.Timeout(5):
+            pid = int(ws.receive())
+
+        return ws, pid
+
+    def serve(self, reuse_port):
+        self.start(reuse_port)
+        connections = []
+        pids = set()
+
+        # The workers all accept connections
+        while pids != self.pids:
+            ws, pid = self.worker_pid()
+            connections.append(ws)
+            pids.add(pid)
+            self.assertLess(len(connections), 200)
+
+        accepted = 'geventwebsocket_handshakes_total{result="accepted"}'
+
+        # The master adds up the metrics the workers report
+        wait_for(lambda: self.metrics().get(
+            'geventwebsocket_connections') == str(len(connections)))
+        self.assertEqual(self.metrics()[accepted], str(len(connections)))
+
+        # A worker that dies is restarted, and its counters are kept
+        victim = min(self.pids)
+        os.kill(victim, signal.SIGKILL)
+        wait_for(lambda: not alive(victim))
+        wait_for(lambda: int(self.metrics()[
+            'geventwebsocket_connections']) < len(connections))
+        self.assertEqual(self.metrics()[accepted], str(len(connections)))
+
+        def restarted():
+            ws, pid = self.worker_pid()
+            ws.close()
+
+            if pid not in self.pids:
+                self.pids.add(pid)
+                return True
+
+            return False
+
+        wait_for(restarted)
+
+        for ws in connections:
+            ws.close()
+
+        # SIGTERM stops the master and all of its workers
+        self.master.send_signal(signal.SIGTERM)
+        wait_for(lambda: self.master.poll() is not None)
+        self.assertEqual(self.master.returncode, 0)
+
+        for pid in self.pids:
+            wait_for(lambda: not alive(pid))
+
+    @unittest.skipUnless(hasattr(socket, 'SO_REUSEPORT'),
+                         "Needs SO_REUSEPORT")
+    def test_reuse_port(self):
+        self.serve(True)
+
+    def test_shared_socket(self):
+        self.serve(False)
+
+
+class PreforkMetricsTest(unittest.TestCase):
+    def test_metrics_only_with_listener(self):
+        server = PreforkServer(('127.0.0.1', 0), pid_app, workers=1)
+        server.socket.close()
+        self.assertNotIn('metrics', server.kwargs)
+
+        server = PreforkServer(('127.0.0.1', 0), pid_app, workers=1,
+                               metrics_listener=('127.0.0.1', 0))
+        server.socket.close()
+        self.assertIs(server.kwargs['metrics'], True)
+
+
+if __name__ == '__main__':
+    run_master(sys.argv[1] == '1')
@@ -0,0 +1,140 @@
+import binascii
+import os
+import unittest
+
+import gevent
+
+from support import serve
+
+from geventwebsocket import PreparedMessage
+from geventwebsocket.client import connect
+from geventwebsocket.websocket import Header, PREPARED_CONTEXT_SIZE
+
+
+class PreparedMessageTest(unittest.TestCase):
+    def start(self, **kwargs):
+        """
+        Start a server whose connections wait for the client to close.
+
+        :returns: The list the server's ends of the connections are added to.
+        """
+        server_sockets = []
+        self.server_sockets = server_sockets
+
+        def app(environ, start_response):
+            ws = environ['wsgi.websocket']
+            server_sockets.append(ws)
+            ws.receive()
+
+            return []
+
+        self.server, self.url = serve(self, app, **kwargs)
+
+        return server_sockets
+
+    def connect(self, **kwargs):
+        count = len(self.server_sockets)
+        ws = connect(self.url, **kwargs)
+        self.addCleanup(ws.close)
+
+        # The application is called once the handshake is done
+        with gevent.Timeout(5):
+            while len(self.server_sockets) == count:
+                gevent.sleep(0.01)
+
+        return ws
+
+    def receive_frame(self, ws):
+        """
+        :returns: Whether the next message was compressed, and the message.
+        """
+        with gevent.Timeout(5):
+            header, payload = ws.read_frame()
+
+        compressed = bool(header.flags & Header.RSV0_MASK)
+
+        if compressed:
+            payload = ws.inflate(payload, header.fin)
+
+        return compressed, bytes(payload)
+
+    def test_uncompressed(self):
+        server_sockets = self.start()
+        clients = [self.connect() for i in range(3)]
+        message = PreparedMessage(u'hello \u20ac')
+
+        for ws in server_sockets:
+            ws.send_prepared(message)
+
+        for ws in clients:
+            with gevent.Timeout(5):
+                self.assertEqual(ws.receive(), u'hello \u20ac')
+
+        self.assertEqual(list(message.frames), [None])
+
+    def test_frame_shared_between_connections(self):
+        server_sockets = self.start()
+        clients = [self.connect(compress=True) for i in range(3)]
+        payload = b'event ' * 2000
+        message = PreparedMessage(payload)
+
+        for ws in server_sockets:
+            ws.send_prepared(message)
+
+        for ws in clients:
+            self.assertEqual(self.receive_frame(ws), (True, payload))
+
+        # Only compressed once
+        self.assertEqual(len(message.frames), 1)
+
+    def test_context_takeover_after_ordinary_messages(self):
+        server_sockets = self.start()
+        client = self.connect(compress=True)
+        ws = server_sockets[0]
+        payload = binascii.hexlify(os.urandom(32)) * 10
+
+        ws.send(payload)
+        self.assertEqual(self.receive_frame(client), (True, payload))
+        compressor = ws.compressor
+        self.assertIsNotNone(compressor)
+
+        # A small message is compressed in the connection's context
+        small = PreparedMessage(payload + b'small')
+        ws.send_prepared(small)
+        self.assertEqual(self.receive_frame(client),
+                         (True, payload + b'small'))
+        self.assertIs(ws.compressor, compressor)
+        self.assertEqual(small.frames, {})
+
+        # A large one is sent the shared frame, and the compressor is let go
+        large = PreparedMessage(payload * (PREPARED_CONTEXT_SIZE // 320 + 1))
+        ws.send_prepared(large)
+        self.assertEqual(self.receive_frame(client), (True, large.payload))
+        self.assertIsNone(ws.compressor)
+        self.assertEqual(len(large.frames), 1)
+
+        # Ordinary messages after it still decode
+        for i in range(3):
+            ws.send(payload)
+            self.assertEqual(self.receive_frame(client), (True, payload))
+
+        ws.send_prepared(large)
+        self.assertEqual(self.receive_frame(client), (True, large.payload))
+        ws.send(payload)
+        self.assertEqual(self.receive_frame(client), (True, payload))
+
+    def test_no_context_takeover(self):
+        server_sockets = self.start()
+        client = self.connect(compress=True, deflate_no_context_takeover=True)
+        ws = server_sockets[0]
+        message = PreparedMessage(b'event ' * 100)
+
+        for i in range(2):
+            ws.send(b'ordinary ' * 100)
+            self.assertEqual(self.receive_frame(client),
+                             (True, b'ordinary ' * 100))
+            ws.send_prepared(message)
+            self.assertEqual(self.receive_frame(client),
+                             (True, b'event ' * 100))
+
+        self.assertEqual(len(message.frames), 1)
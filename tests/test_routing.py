@@ -0,0 +1,157 @@
+import random
+import re
+import unittest
+from collections import OrderedDict
+
+import support  # noqa: F401
+
+from geventwebsocket import Resource, WebSocketApplication
+from geventwebsocket.routing import Router, literal_prefix
+
+
+class ChatApplication(WebSocketApplication):
+    pass
+
+
+class EchoApplication(WebSocketApplication):
+    pass
+
+
+def wsgi_app(environ, start_response):
+    return []
+
+
+def linear_scan(routes, path, accept=None):
+    """
+    Look `path` up the way `Resource` originally did.
+    """
+    for pattern, app in routes:
+        if re.match(pattern, path) and (accept is None or accept(app)):
+            return pattern, app
+
+    return None, None
+
+
+class LiteralPrefixTest(unittest.TestCase):
+    def test_prefixes(self):
+        for pattern, prefix in [
+                ('^/chat/room', '/chat/room'),
+                ('/chat', '/chat'),
+                ('/ab?c', '/a'),
+                ('/x+y', '/x'),
+                ('/x*', '/'),
+                ('/a{2}', '/'),
+                (r'/a\.b\d', '/a.b'),
+                (r'/a\b', '/a'),
+                ('/a|/b', ''),
+                ('(?i)/x', ''),
+                ('/(chat)', '/'),
+                ('/[ab]', '/'),
+                ('', '')]:
+            self.assertEqual(literal_prefix(pattern), prefix, pattern)
+
+    def test_compiled_pattern(self):
+        self.assertEqual(literal_prefix(re.compile('/chat')), '')
+
+
+class RouterTest(unittest.TestCase):
+    patterns = ['^/$', '/', '/chat', r'/chat/(\d+)', '^/ab?c', '/a|/zz',
+                '/api/v[12]/x', r'/a\.b', '(?i)/UP', '/api/', '/x*y',
+                re.compile('/compiled')]
+
+    paths = ['/', '', '/chat', '/chat/12', '/chatter', '/ac', '/abc', '/zz',
+             '/api/v1/x', '/api/v3/x', '/a.b', '/aXb', '/up', '/UP', '/y',
+             '/xxy', '/compiled', '/nothing', 'x']
+
+    def test_same_as_linear_scan(self):
+        rng = random.Random(1)
+        patterns = self.patterns + ['/r{0:d}/'.format(i) for i in range(100)]
+        paths = self.paths + ['/r{0:d}/x'.format(i) for i in range(0, 120, 7)]
+
+        for i in range(20):
+            routes = [(pattern, rng.choice([ChatApplication, wsgi_app]))
+                      for pattern in patterns]
+            rng.shuffle(routes)
+            router = Router(routes)
+
+            for accept in (None, callable, lambda app: app is wsgi_app):
+                for path in paths:
+                    self.assertEqual(
+                        router.match(path, accept, accept),
+                        linear_scan(routes, path, accept), path)
+
+    def test_cache(self):
+        router = Router([('/a', 1), ('/', 2)], cache_size=2)
+
+        self.assertEqual(router.match('/a'), ('/a', 1))
+        self.assertEqual(router.match('/b'), ('/', 2))
+        self.assertEqual(list(router.cache), [('/a', None), ('/b', None)])
+
+        # A hit makes the entry the most recently used
+        self.assertEqual(router.match('/a'), ('/a', 1))
+        self.assertEqual(list(router.cache), [('/b', None), ('/a', None)])
+
+        # So the least recently used is evicted
+        self.assertEqual(router.match('/c'), ('/', 2))
+        self.assertEqual(list(router.cache), [('/a', None), ('/c', None)])
+
+    def test_cache_key(self):
+        router = Router([('/', ChatApplication), ('/', wsgi_app)])
+
+        self.assertEqual(
+            router.match('/', True, lambda app: app is not wsgi_app),
+            ('/', ChatApplication))
+        self.assertEqual(
+            router.match('/', False, lambda app: app is wsgi_app),
+            ('/', wsgi_app))
+        self.assertEqual(len(router.cache), 2)
+
+    def test_no_match_cached(self):
+        router = Router([('/a', 1)])
+
+        self.assertEqual(router.match('/b'), (None, None))
+        self.assertEqual(router.match('/b'), (None, None))
+
+
+class ResourceRoutingTest(unittest.TestCase):
+    def test_apps_list_mutated(self):
+        resource = Resource([('/chat', ChatApplication)])
+        self.assertIs(resource._app_by_path('/echo', True), None)
+
+        resource.apps.append(('/echo', EchoApplication))
+        self.assertIs(resource._app_by_path('/echo', True), EchoApplication)
+
+        resource.apps[0] = ('/chat', EchoApplication)
+        self.assertIs(resource._app_by_path('/chat', True), EchoApplication)
+
+        del resource.apps[:]
+        self.assertIs(resource._app_by_path('/chat', True), None)
+
+    def test_apps_replaced(self):
+        resource = Resource(OrderedDict([('/chat', ChatApplication)]))
+        self.assertIs(resource._app_by_path('/chat', True), ChatApplication)
+
+        resource.apps = OrderedDict([('/chat', EchoApplication)]).items()
+        self.assertIs(resource._app_by_path('/chat', True), EchoApplication)
+
+        resource.apps = (('/chat', ChatApplication),)
+        self.assertIs(resource._app_by_path('/chat', True), ChatApplication)
+
+    def test_router_kept(self):
+        resource = Resource(OrderedDict([('/chat', ChatApplication)]))
+        router = resource.router
+
+        resource._app_by_path('/chat', True)
+        self.assertIs(resource.router, router)
+
+        resource.apps = tuple(resource.apps)
+        router = resource.router
+        resource._app_by_path('/chat', True)
+        self.assertIs(resource.router, router)
+
+    def test_websocket_and_wsgi_apps(self):
+        resource = Resource([('/', wsgi_app), ('/', ChatApplication)])
+
+        self.assertIs(resource._app_by_path('/', True), ChatApplication)
+        self.assertIs(resource._app_by_path('/', False), wsgi_app)
+        self.assertEqual(resource.app_route('/chat'), '/')
@@ -0,0 +1,64 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gevent  # noqa: E402
+from gevent.event import Event  # noqa: E402
+
+from geventwebsocket import WebSocketServer  # noqa: E402
+from geventwebsocket.client import connect  # noqa: E402
+from geventwebsocket.exceptions import WebSocketError  # noqa: E402
+from geventwebsocket.sendqueue import CLOSE  # noqa: E402
+
+
+class ClosePolicyTest(unittest.TestCase):
+    def test_stalled_peer_is_disconnected(self):
+        overflowed = Event()
+        release = Event()
+        state = {}
+
+        def app(environ, start_response):
+            ws = environ['wsgi.websocket']
+            ws.enable_buffering(high_water=256 * 1024, policy=CLOSE)
+            payload = b'x' * 65536
+
+            try:
+                with gevent.Timeout(10):
+                    while True:
+                        ws.send(payload)
+                        gevent.sleep(0)
+            except WebSocketError:
+                state['ws'] = ws
+                overflowed.set()
+
+            # The application doesn't return, the connection must be torn
+            # down regardless
+            release.wait()
+            return []
+
+        server = WebSocketServer(('127.0.0.1', 0), app, log=None,
+                                 error_log=None)
+        server.start()
+        self.addCleanup(server.stop)
+        self.addCleanup(release.set)
+
+        client = connect('ws://127.0.0.1:{0:d}/'.format(server.server_port))
+        self.addCleanup(client.handler.close)
+
+        # The client doesn't read until the queue overflowed
+        self.assertTrue(overflowed.wait(10))
+
+        sock = client.handler.socket
+
+        with gevent.Timeout(10):
+            while sock.recv(65536):
+                pass
+
+        self.assertFalse(release.is_set())
+        self.assertTrue(state['ws'].closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import io
+import os
+import unittest
+
+import gevent
+
+from support import client_frame, serve
+
+from geventwebsocket.client import connect
+from geventwebsocket.websocket import WebSocket
+
+
+class SendStreamTest(unittest.TestCase):
+    def receive_all(self, ws, count):
+        messages = []
+
+        with gevent.Timeout(10):
+            for _ in range(count):
+                message = ws.receive()
+                self.assertIsNotNone(message)
+                messages.append(message)
+
+        return messages
+
+    def test_fragments(self):
+        data = bytes(bytearray(range(256))) * 1000
+
+        def app(environ, start_response):
+            ws = environ['wsgi.websocket']
+            ws.send_stream(io.BytesIO(data), fragment_size=1000)
+            ws.send_stream([u'text ', u'in ', u'chunks'], binary=False)
+            ws.receive()
+            return []
+
+        server, url = serve(self, app)
+        ws = connect(url)
+        self.addCleanup(ws.close)
+
+        stream = ws.receive_stream()
+        chunks = list(stream)
+
+        self.assertTrue(stream.binary)
+        self.assertEqual(len(chunks), len(data) // 1000)
+        self.assertEqual(b''.join(chunks), data)
+        self.assertEqual(ws.receive(), u'text in chunks')
+
+    def check_concurrent_sends(self, compress):
+        # Random, so that compressed fragments aren't empty
+        chunks = [os.urandom(1000) for _ in range(50)]
+        count = 50
+
+        def app(environ, start_response):
+            ws = environ['wsgi.websocket']
+
+            def send_small():
+                for i in range(count):
+                    ws.send(u'small {0:d}'.format(i))
+                    gevent.sleep(0)
+
+            # The small messages must not go in between the fragments
+            sender = gevent.spawn(send_small)
+            gevent.sleep(0)
+            ws.send_stream(iter(chunks))
+            sender.join()
+            ws.receive()
+            return []
+
+        server, url = serve(self, app)
+        ws = connect(url, compress=compress)
+        self.addCleanup(ws.close)
+
+        messages = self.receive_all(ws, count + 1)
+        large = [m for m in messages if not isinstance(m, type(u''))]
+
+        self.assertEqual(len(large), 1)
+        self.assertEqual(bytes(large[0]), b''.join(chunks))
+        self.assertEqual([m for m in messages if m not in large],
+                         [u'small {0:d}'.format(i) for i in range(count)])
+
+    def test_concurrent_sends(self):
+        self.check_concurrent_sends(False)
+
+    def test_concurrent_sends_compressed(self):
+        self.check_concurrent_sends(True)
+
+
+class ReceiveStreamTest(unittest.TestCase):
+    def test_fragments_and_pings(self):
+        received = []
+
+        def app(environ, start_response):
+            ws = environ['wsgi.websocket']
+            stream = ws.receive_stream()
+            received.append((stream.binary, list(stream)))
+            ws.send(u'done')
+            ws.receive()
+            return []
+
+        server, url = serve(self, app)
+        ws = connect(url)
+        self.addCleanup(ws.close)
+
+        # A ping in between fragments is answered, and not part of the
+        # message
+        ws.handler.socket.sendall(
+            client_frame(WebSocket.OPCODE_TEXT, b'caf\xc3', fin=False) +
+            client_frame(WebSocket.OPCODE_PING, b'ping') +
+            client_frame(WebSocket.OPCODE_CONTINUATION, b'\xa9 ', fin=False) +
+            client_frame(WebSocket.OPCODE_CONTINUATION, b'au lait'))
+
+        self.assertEqual(ws.receive(), u'done')
+        self.assertEqual(received, [(False, [u'caf', u'\xe9 ', u'au lait'])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import struct
+import unittest
+
+import gevent
+
+from support import client_frame, serve
+
+from geventwebsocket.client import connect
+from geventwebsocket.websocket import WebSocket
+
+TEXT = WebSocket.OPCODE_TEXT
+CONTINUATION = WebSocket.OPCODE_CONTINUATION
+
+SNOWMAN = u'☃'.encode('utf-8')
+CLEF = u'\U0001d11e'.encode('utf-8')
+
+
+def fragments(payloads):
+    frames = []
+
+    for i, payload in enumerate(payloads):
+        frames.append(client_frame(TEXT if i == 0 else CONTINUATION, payload,
+                                   fin=i == len(payloads) - 1))
+
+    return b''.join(frames)
+
+
+class FragmentedTextTest(unittest.TestCase):
+    def setUp(self):
+        self.results = []
+
+        def app(environ, start_response):
+            ws = environ['wsgi.websocket']
+
+            while True:
+                message = ws.receive()
+                self.results.append(message)
+
+                if message is None:
+                    break
+
+            return []
+
+        server, url = serve(self, app)
+        self.ws = connect(url)
+        self.addCleanup(self.ws.handler.close)
+
+    def close_code(self):
+        with gevent.Timeout(5):
+            while True:
+                header, payload = self.ws.read_frame()
+
+                if header.opcode == WebSocket.OPCODE_CLOSE:
+                    return struct.unpack('!H', bytes(payload[:2]))[0]
+
+    def wait_results(self, count):
+        with gevent.Timeout(5):
+            while len(self.results) < count:
+                gevent.sleep(0.01)
+
+    def test_code_points_split_across_frames(self):
+        message = SNOWMAN + b' and ' + CLEF
+        # Split within every multi-octet sequence
+        splits = [message[:1], message[1:2], message[2:7], message[7:9],
+                  message[9:]]
+
+        self.ws.handler.socket.sendall(
+            fragments(splits) + fragments([b'', CLEF[:3], CLEF[3:]]))
+        self.wait_results(2)
+
+        self.assertEqual(self.results, [message.decode('utf-8'),
+                                        CLEF.decode('utf-8')])
+
+    def test_invalid_in_first_fragment(self):
+        self.ws.handler.socket.sendall(fragments([b'ok \xff', b'more']))
+
+        self.assertEqual(self.close_code(), 1007)
+
+    def test_invalid_in_later_fragment(self):
+        # Detected as it arrives, before the message is complete
+        self.ws.handler.socket.sendall(
+            client_frame(TEXT, b'ok ', fin=False) +
+            client_frame(CONTINUATION, SNOWMAN[:2], fin=False) +
+            client_frame(CONTINUATION, b'\x41', fin=False))
+
+        self.assertEqual(self.close_code(), 1007)
+
+    def test_truncated_at_end_of_message(self):
+        self.ws.handler.socket.sendall(fragments([b'ok ', CLEF[:3]]))
+
+        self.assertEqual(self.close_code(), 1007)
+
+    def test_surrogates_rejected(self):
+        self.ws.handler.socket.sendall(client_frame(TEXT, b'\xed\xa0\x80'))
+
+        self.assertEqual(self.close_code(), 1007)
+
+
+if __name__ == '__main__':
+    unittest.main()